@@ -1,35 +1,148 @@
-from django.contrib import admin
+import datetime
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.widgets import AdminDateWidget
+from django.core.paginator import Paginator
+from django.forms.models import BaseInlineFormSet
 from .models import Author, Genre, Book, BookInstance, Language
+from .forms import DEFAULT_RENEWAL_PERIOD, RenewBookForm
+from .pagination import EstimatedCountPaginator
+from .database import retry_on_lock
+from . import loans
+
+
+class RetryOnLockAdmin(admin.ModelAdmin):
+    """ModelAdmin saving and deleting again while the database is locked"""
+
+    # both views run in their own transaction, see catalog/database.py
+    def changeform_view(self, *args, **kwargs):
+        return retry_on_lock(super().changeform_view)(*args, **kwargs)
+
+    def delete_view(self, *args, **kwargs):
+        return retry_on_lock(super().delete_view)(*args, **kwargs)
+
+
+class RenewActionForm(ActionForm):
+    """The action bar of the copies, with the due date of the renew action"""
+    renewal_date = forms.DateField(
+        required=False, widget=AdminDateWidget,
+        initial=lambda: datetime.date.today() + DEFAULT_RENEWAL_PERIOD,
+    )
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """Inline formset editing one page of the related objects"""
+    per_page = 20
+    page_param = 'page'
+    page_number = 1
+
+    def get_queryset(self):
+        if not hasattr(self, 'page'):
+            paginator = Paginator(super().get_queryset(), self.per_page)
+            self.page = paginator.get_page(self.page_number)
+            self.page_links = list(paginator.get_elided_page_range(self.page.number))
+        return self.page.object_list
+
+
+class PaginatedInline(admin.TabularInline):
+    """Tabular inline showing ``per_page`` rows, with links to the other pages"""
+    formset = PaginatedInlineFormSet
+    template = 'admin/catalog/paginated_tabular.html'
+    per_page = 20
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.per_page = self.per_page
+        formset.page_param = f'{self.model._meta.model_name}_page'
+        formset.page_number = request.GET.get(formset.page_param, 1)
+        return formset
+
 
 # Inline class for BookInstance; to be displayed in Book admin page
-class BooksInstanceInline(admin.TabularInline):
+class BooksInstanceInline(PaginatedInline):
     model = BookInstance 
     classes = ('collapse',) # to make it collapsible in the admin interface
+    raw_id_fields = ('borrower',)
+    show_change_link = True
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'display_genre')
+class BookAdmin(RetryOnLockAdmin):
+    list_display = ('title', 'author', 'display_genre', 'copies_available', 'copies_total')
+    list_select_related = ('author',)
+    search_fields = ('title', 'isbn')
+    autocomplete_fields = ('author', 'genre', 'language')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False # a second COUNT(*) when filtering
 
     inlines = [BooksInstanceInline]
 
+    def get_queryset(self, request):
+        # display_genre reads the prefetched genres
+        return super().get_queryset(request).prefetch_related('genre')
+
 # Inline class for Book; to be displayed in Author admin page
-class BookInline(admin.TabularInline):
+class BookInline(PaginatedInline):
     model = Book
     classes = ('collapse',)
+    autocomplete_fields = ('genre', 'language')
+    show_change_link = True
 
 @admin.register(Author)
-class AuthorAdmin(admin.ModelAdmin):
+class AuthorAdmin(RetryOnLockAdmin):
     list_display = ('last_name', 'first_name', 'date_of_birth', 'date_of_death') # display columns in admin list view
     fields = ['first_name', 'last_name', ('date_of_birth', 'date_of_death')] # layout of fields in admin detail view
+    search_fields = ('last_name', 'first_name')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     inlines = [BookInline]
 
-admin.site.register(Genre)
+@admin.register(Genre)
+class GenreAdmin(RetryOnLockAdmin):
+    search_fields = ('name',)
+    ordering = ('name',)
 
 @admin.register(BookInstance)
-class BookInstanceAdmin(admin.ModelAdmin):
+class BookInstanceAdmin(RetryOnLockAdmin):
     list_filter = ('status', 'due_back') # filters in the right sidebar
     list_display = ('display_book', 'status', 'due_back', 'id', 'borrower')
+    list_select_related = ('book', 'borrower')
+    # a total ordering, served by the bookinst_due_back_idx index
+    ordering = ('due_back', 'id')
+    autocomplete_fields = ('book',)
+    raw_id_fields = ('borrower',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['renew_copies', 'return_copies']
+    action_form = RenewActionForm
+
+    def report(self, request, results, done):
+        counts = {}
+        for result in results.values():
+            counts[result] = counts.get(result, 0) + 1
+        summary = ', '.join(f'{count} {result}' for result, count in counts.items())
+        level = messages.SUCCESS if counts.get(done) == len(results) else messages.WARNING
+        self.message_user(request, summary, level)
+
+    @admin.action(description='Renew selected copies until the renewal date', permissions=['mark_returned'])
+    def renew_copies(self, request, queryset):
+        # same rules as the renewal form of a single copy
+        form = RenewBookForm(request.POST)
+        if not form.is_valid():
+            self.message_user(request, ' '.join(form.errors['renewal_date']), messages.ERROR)
+            return
+        due_back = form.cleaned_data['renewal_date']
+        results = loans.bulk_renew(list(queryset.values_list('pk', flat=True)), due_back)
+        self.report(request, results, loans.RENEWED)
+
+    @admin.action(description='Mark selected copies as returned', permissions=['mark_returned'])
+    def return_copies(self, request, queryset):
+        results = loans.bulk_return(list(queryset.values_list('pk', flat=True)))
+        self.report(request, results, loans.RETURNED)
+
+    def has_mark_returned_permission(self, request):
+        return request.user.has_perm('catalog.can_mark_returned')
 
     # organize detail view layout
     fieldsets = (
@@ -41,4 +154,7 @@ class BookInstanceAdmin(admin.ModelAdmin):
         }),
     )
 
-admin.site.register(Language)
+@admin.register(Language)
+class LanguageAdmin(RetryOnLockAdmin):
+    search_fields = ('name',)
+    ordering = ('name',)
@@ -0,0 +1,249 @@
+"""Read-only JSON API of the catalog.
+
+    /catalog/api/                   the resources
+    /catalog/api/<resource>/        cursor paginated list, ?cursor= and ?limit=
+    /catalog/api/<resource>/<pk>/   one object
+
+- ?fields=title,isbn returns only these fields (the id is always there), and
+  ?fields[author]=last_name does the same for an included resource;
+- ?include=author,genre embeds related objects. Foreign keys are joined in the
+  main query (what select_related does), to-many relations are read with one
+  more query each (what prefetch_related does).
+
+Rows are read with QuerySet.values() and serialized as they come, no model
+instance is created: only the requested columns are selected, so the database
+work and the payload grow with what the client asks for.
+"""
+from functools import wraps
+
+from django.core.exceptions import ValidationError
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+
+from .models import Author, Book, BookInstance, Genre, Language
+from .pagination import CursorPaginator, InvalidCursor
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class ApiError(Exception):
+    """A bad request, answered with a 400"""
+
+
+class Relation:
+    """Related objects that ?include= embeds"""
+
+    def __init__(self, path, resource, many=False):
+        self.path = path  # lookup from the model, e.g. 'author'
+        self.resource = resource  # name in RESOURCES
+        self.many = many
+
+
+class Resource:
+    def __init__(self, model, fields, ordering, relations=None, login_required=False):
+        self.model = model
+        self.fields = fields  # {API name: values() lookup}
+        self.ordering = ordering  # for the cursor pagination, ends with the primary key
+        self.relations = relations or {}
+        self.login_required = login_required
+
+
+RESOURCES = {
+    'books': Resource(
+        Book,
+        fields={
+            'title': 'title',
+            'summary': 'summary',
+            'isbn': 'isbn',
+            'author': 'author_id',
+            'language': 'language_id',
+            'copies_total': 'copies_total',
+            'copies_available': 'copies_available',
+            'updated_at': 'updated_at',
+        },
+        ordering=['title', 'id'],
+        relations={
+            'author': Relation('author', 'authors'),
+            'language': Relation('language', 'languages'),
+            'genre': Relation('genre', 'genres', many=True),
+        },
+    ),
+    'authors': Resource(
+        Author,
+        fields={
+            'first_name': 'first_name',
+            'last_name': 'last_name',
+            'date_of_birth': 'date_of_birth',
+            'date_of_death': 'date_of_death',
+            'updated_at': 'updated_at',
+        },
+        ordering=['last_name', 'first_name', 'id'],
+        relations={'books': Relation('book', 'books', many=True)},
+    ),
+    # the borrower is never exposed, and the copies need a login like on the book page
+    'copies': Resource(
+        BookInstance,
+        fields={
+            'book': 'book_id',
+            'imprint': 'imprint',
+            'status': 'status',
+            'due_back': 'due_back',
+            'updated_at': 'updated_at',
+        },
+        ordering=['id'],
+        relations={'book': Relation('book', 'books')},
+        login_required=True,
+    ),
+    'genres': Resource(Genre, fields={'name': 'name'}, ordering=['name', 'id']),
+    'languages': Resource(Language, fields={'name': 'name'}, ordering=['name', 'id']),
+}
+
+
+def parse_fields(resource, value, name):
+    """The API field names of ``fields`` (comma separated), all of them when empty"""
+    if value is None:
+        return list(resource.fields)
+    names = [field for field in value.split(',') if field]
+    unknown = [field for field in names if field not in resource.fields and field != 'id']
+    if unknown:
+        raise ApiError(f'Unknown fields for {name}: {", ".join(unknown)}')
+    return [field for field in names if field != 'id']
+
+
+class ResourceQuery:
+    """The fields and embedded relations requested for a resource"""
+
+    def __init__(self, resource, params):
+        self.resource = resource
+        self.fields = parse_fields(resource, params.get('fields'), 'fields')
+        self.includes = {}
+        for name in filter(None, params.get('include', '').split(',')):
+            if name not in resource.relations:
+                raise ApiError(f'Unknown include: {name}')
+            related = RESOURCES[resource.relations[name].resource]
+            self.includes[name] = parse_fields(related, params.get(f'fields[{name}]'), name)
+
+    def related(self, name):
+        relation = self.resource.relations[name]
+        return relation, RESOURCES[relation.resource]
+
+    def values(self, queryset):
+        """``queryset`` reading the requested columns only, with the to-one relations joined"""
+        lookups = {'id', *self.resource.ordering}
+        lookups.update(self.resource.fields[field] for field in self.fields)
+        for name, fields in self.includes.items():
+            relation, related = self.related(name)
+            if not relation.many:
+                lookups.add(f'{relation.path}__id')
+                lookups.update(f'{relation.path}__{related.fields[field]}' for field in fields)
+        return queryset.values(*lookups)
+
+    def serialize(self, rows):
+        objects = []
+        for row in rows:
+            obj = {'id': row['id']}
+            for field in self.fields:
+                obj[field] = row[self.resource.fields[field]]
+            for name, fields in self.includes.items():
+                relation, related = self.related(name)
+                if relation.many:
+                    continue
+                prefix = relation.path + '__'
+                if row[prefix + 'id'] is None:
+                    obj[name] = None
+                else:
+                    obj[name] = {'id': row[prefix + 'id']}
+                    obj[name].update((field, row[prefix + related.fields[field]]) for field in fields)
+            objects.append(obj)
+        self.embed_many(objects)
+        return objects
+
+    def embed_many(self, objects):
+        """Add the to-many relations to ``objects``, one query per relation"""
+        ids = [obj['id'] for obj in objects]
+        for name, fields in self.includes.items():
+            relation, related = self.related(name)
+            if not relation.many or not ids:
+                continue
+            prefix = relation.path + '__'
+            lookups = [prefix + 'id', *(prefix + related.fields[field] for field in fields)]
+            rows = (
+                self.resource.model.objects.filter(pk__in=ids)
+                .order_by('pk', *(prefix + field for field in related.ordering))
+                .values('pk', *lookups)
+            )
+            embedded = {pk: [] for pk in ids}
+            for row in rows:
+                if row[prefix + 'id'] is None:
+                    continue  # no related object, the LEFT JOIN gives one empty row
+                item = {'id': row[prefix + 'id']}
+                item.update((field, row[prefix + related.fields[field]]) for field in fields)
+                embedded[row['pk']].append(item)
+            for obj in objects:
+                obj[name] = embedded[obj['id']]
+
+
+def api_view(view):
+    """GET only, resolve the resource, and answer errors with JSON"""
+    @require_GET
+    @wraps(view)
+    def wrapper(request, resource, **kwargs):
+        if resource not in RESOURCES:
+            return JsonResponse({'error': f'Unknown resource: {resource}'}, status=404)
+        resource = RESOURCES[resource]
+        if resource.login_required and not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        try:
+            return view(request, resource, ResourceQuery(resource, request.GET), **kwargs)
+        except ApiError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Http404 as e:
+            return JsonResponse({'error': str(e)}, status=404)
+    return wrapper
+
+
+@require_GET
+def api_root(request):
+    return JsonResponse({name: reverse('api_list', args=[name]) for name in RESOURCES})
+
+
+def _page_link(request, cursor):
+    if cursor is None:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return f'{request.path}?{params.urlencode()}'
+
+
+@api_view
+def api_list(request, resource, query):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError('limit must be a number')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ApiError(f'limit must be between 1 and {MAX_LIMIT}')
+    paginator = CursorPaginator(query.values(resource.model.objects.all()), limit, resource.ordering)
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        raise ApiError('Invalid cursor')
+    return JsonResponse({
+        'results': query.serialize(page.object_list),
+        'next': _page_link(request, page.next_cursor),
+        'previous': _page_link(request, page.previous_cursor),
+    })
+
+
+@api_view
+def api_detail(request, resource, query, pk):
+    try:
+        pk = resource.model._meta.pk.to_python(pk)
+    except ValidationError:
+        raise Http404(f'No {resource.model._meta.verbose_name} found')
+    rows = list(query.values(resource.model.objects.filter(pk=pk)))
+    if not rows:
+        raise Http404(f'No {resource.model._meta.verbose_name} found')
+    return JsonResponse(query.serialize(rows)[0])
@@ -0,0 +1,221 @@
+"""Async versions of the read-only catalog pages, for ASGI servers.
+
+Served instead of the views of catalog/views.py when settings.CATALOG_ASYNC_VIEWS
+is True (see catalog/urls.py). They query with the async ORM and render the
+same templates in the event loop, so everything a template touches is loaded
+beforehand: related objects with select_related/prefetch_related, the user with
+its permissions, and the session (loaded with the user). The fragment,
+statistics and visit caches are used from the event loop too, keep them out
+of the database cache backend.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Max
+from django.http import Http404
+from django.shortcuts import render
+from django.views import View
+
+from catalog import fragments, recommendations, visits
+from catalog.conditional import AsyncConditionalGetMixin, latest, select_aggregates
+from catalog.models import Author, Book
+from catalog.pagination import CursorPaginator, InvalidCursor
+from catalog.stats import aget_stats
+from catalog.views import author_books_prefetch, index_context
+
+
+async def load_user(request):
+    """Load the user and its permissions, templates can't query the database here"""
+    user = await request.auser()
+    if user.is_authenticated:
+        # fills the permission caches of the user, used by {{ perms }}
+        await user.aget_all_permissions()
+    request.user = user
+    return user
+
+
+async def index(request):
+    user = await load_user(request)
+    visitor, cookie = visits.visitor_id(request, user)
+    stats, num_visits = await asyncio.gather(aget_stats(), visits.arecord_visit(visitor, first=cookie is not None))
+    response = render(request, 'index.html', context=index_context(stats, num_visits))
+    return visits.set_visitor_cookie(response, cookie)
+
+
+class AsyncPage(View):
+    """Load the user before the handler, optionally require a logged in user"""
+    login_required = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await load_user(request)
+        if self.login_required and not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncListView(AsyncPage):
+    """The pagination of ListView and CursorPaginationMixin, with the async ORM"""
+    model = None
+    template_name = None
+    context_object_name = None
+    paginate_by = None
+    cursor_ordering = None
+    cursor_kwarg = 'cursor'
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    async def paginate(self, queryset):
+        """(paginator, page, is_paginated, is_cursor_paginated)"""
+        if getattr(settings, 'CATALOG_CURSOR_PAGINATION', False):
+            paginator = CursorPaginator(queryset, self.paginate_by, self.cursor_ordering)
+            try:
+                page = await paginator.apage(self.request.GET.get(self.cursor_kwarg))
+            except InvalidCursor:
+                raise Http404('Invalid cursor')
+            return paginator, page, page.has_other_pages(), page.has_other_pages()
+
+        # the same as MultipleObjectMixin.paginate_queryset
+        paginator = Paginator(queryset.order_by(*self.cursor_ordering), self.paginate_by)
+        paginator.count = await queryset.acount()
+        page_number = self.kwargs.get('page') or self.request.GET.get('page') or 1
+        try:
+            number = paginator.num_pages if page_number == 'last' else int(page_number)
+            page = paginator.page(number)
+        except (ValueError, InvalidPage):
+            raise Http404('Invalid page')
+        page.object_list = [obj async for obj in page.object_list]
+        return paginator, page, page.has_other_pages(), False
+
+    async def get(self, request, *args, **kwargs):
+        paginator, page, is_paginated, is_cursor_paginated = await self.paginate(self.get_queryset())
+        context = {
+            'view': self,
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': is_paginated,
+            'is_cursor_paginated': is_cursor_paginated,
+            'object_list': page.object_list,
+            self.context_object_name: page.object_list,
+        }
+        return render(request, self.template_name, context)
+
+
+class AsyncDetailView(AsyncPage):
+    """A book or author page, with its content block from the fragment cache"""
+    model = None
+    template_name = None
+    context_object_name = None
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    async def aget_extra_context(self, obj):
+        """More context, the template can't query the database in async views"""
+        return {}
+
+    async def get(self, request, pk):
+        self.fragment_key, self.fragment = await fragments.alookup(self.context_object_name, pk)
+        try:
+            obj = await self.get_queryset().aget(pk=pk)
+        except self.model.DoesNotExist:
+            raise Http404(f'No {self.model._meta.verbose_name} found matching the query')
+        context = {
+            'view': self, 'object': obj, self.context_object_name: obj,
+            'fragment': self.fragment, 'fragment_key': self.fragment_key,
+        }
+        context.update(await self.aget_extra_context(obj))
+        return render(request, self.template_name, context)
+
+
+class BookListView(AsyncConditionalGetMixin, AsyncListView):
+    model = Book
+    template_name = 'catalog/book_list.html'
+    context_object_name = 'book_list'
+    paginate_by = 3
+    cursor_ordering = ['title', 'id']
+
+    def get_queryset(self):
+        return Book.objects.select_related('author')
+
+    async def aget_validators(self):
+        # see catalog.views.BookListView
+        return await sync_to_async(select_aggregates)(
+            (Book.objects.all(), 'MAX', 'updated_at'),
+            (Author.objects.all(), 'MAX', 'updated_at'),
+            (Book.objects.all(), 'COUNT', 'pk'),
+        )
+
+
+class AuthorListView(AsyncListView):
+    model = Author
+    template_name = 'catalog/author_list.html'
+    context_object_name = 'author_list'
+    paginate_by = 5
+    cursor_ordering = ['last_name', 'first_name', 'id']
+
+
+class BookDetailView(AsyncConditionalGetMixin, AsyncDetailView):
+    model = Book
+    template_name = 'catalog/book_detail.html'
+    context_object_name = 'book'
+    login_required = True
+
+    def get_queryset(self):
+        if self.fragment is not None:
+            return Book.objects.all()
+        return (
+            Book.objects.select_related('author', 'language')
+            .prefetch_related('genre', 'bookinstance_set', recommendations.prefetch())
+        )
+
+    async def aget_last_modified(self):
+        row = await (
+            Book.objects.filter(pk=self.kwargs['pk'])
+            .annotate(copies_updated_at=Max('bookinstance__updated_at'))
+            .values_list('updated_at', 'author__updated_at', 'copies_updated_at')
+            .afirst()
+        )
+        return latest(*row) if row else None
+
+    async def aget_validators(self):
+        if self.last_modified is None:
+            return None
+        return await fragments.afragment_key('book', self.kwargs['pk'])
+
+
+class AuthorDetailView(AsyncConditionalGetMixin, AsyncDetailView):
+    model = Author
+    template_name = 'catalog/author_detail.html'
+    context_object_name = 'author'
+
+    def get_queryset(self):
+        if self.fragment is not None:
+            return Author.objects.all()
+        return Author.objects.prefetch_related(author_books_prefetch())
+
+    async def aget_extra_context(self, obj):
+        # the books are only prefetched when the content block isn't cached
+        if await self.request.user.ahas_perm('catalog.delete_author'):
+            return {'has_books': await obj.book_set.aexists()}
+        return {}
+
+    async def aget_last_modified(self):
+        row = await (
+            Author.objects.filter(pk=self.kwargs['pk'])
+            .annotate(
+                books_updated_at=Max('book__updated_at'),
+                copies_updated_at=Max('book__bookinstance__updated_at'),
+            )
+            .values_list('updated_at', 'books_updated_at', 'copies_updated_at')
+            .afirst()
+        )
+        return latest(*row) if row else None
+
+    async def aget_validators(self):
+        if self.last_modified is None:
+            return None
+        return await fragments.afragment_key('author', self.kwargs['pk'])
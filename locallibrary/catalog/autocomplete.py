@@ -0,0 +1,38 @@
+"""Prefix search behind the autocomplete widgets of the book form.
+
+Authors are searched on the index of LOWER(last_name) with a range condition
+(prefix <= name < prefix + the last code point), which every database can
+serve from a plain index, unlike a case insensitive LIKE. Genres and languages
+are searched in the in-process tables of catalog/reference.py.
+"""
+from django.db.models.functions import Lower
+
+from . import reference
+from .models import Author, Genre, Language
+
+LIMIT = 10
+MAX_LIMIT = 50
+# sorts after every other character
+LAST_CHARACTER = '\U0010ffff'
+
+
+def author_queryset(prefix):
+    """The authors whose last name starts with ``prefix``, ignoring case, in name order"""
+    prefix = prefix.lower()
+    return (
+        Author.objects.alias(lower_last_name=Lower('last_name'))
+        .filter(lower_last_name__gte=prefix, lower_last_name__lt=prefix + LAST_CHARACTER)
+        .order_by(Lower('last_name'), 'id')
+    )
+
+
+def search_authors(prefix, limit=LIMIT):
+    rows = author_queryset(prefix).values_list('pk', 'last_name', 'first_name')[:limit]
+    return [(pk, f'{last_name}, {first_name}') for pk, last_name, first_name in rows]
+
+
+SEARCHES = {
+    'author': search_authors,
+    'genre': lambda prefix, limit=LIMIT: reference.search(Genre, prefix, limit),
+    'language': lambda prefix, limit=LIMIT: reference.search(Language, prefix, limit),
+}
@@ -0,0 +1,104 @@
+"""Copy counters of Book (total, available, on loan, reserved, maintenance).
+
+Every change of the status or book of a BookInstance is applied to the
+counters of its book with ``UPDATE ... SET copies_x = copies_x + delta``, in
+the transaction of the change:
+- saved and deleted copies through the signal receivers of catalog/signals.py
+  (BookInstance.save() runs in a transaction for that);
+- QuerySet.update() and bulk_create() paths call apply_moves() themselves, or
+  set the counters of new books directly.
+
+Any other QuerySet.update() that changes the status or the book of copies must
+call apply_moves() in the same transaction, or the counters drift until the
+next recount. Book.save() never writes the counters of an existing book, only
+the UPDATEs of this module do.
+
+recount() compares the counters with the copies and repairs the drift, see the
+recount_availability command.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import COPY_COUNTERS, COPY_STATUS_COUNTERS, Book, BookInstance
+
+
+def count_moves(moves):
+    """{book id: Counter(field: delta)} of (book id, old status, new status) moves.
+
+    A new copy has no old status, a deleted copy no new status.
+    """
+    deltas = defaultdict(Counter)
+    for book_id, old_status, new_status in moves:
+        if old_status is not None and book_id is not None:
+            deltas[book_id]['copies_total'] -= 1
+            deltas[book_id][COPY_STATUS_COUNTERS.get(old_status)] -= 1
+        if new_status is not None and book_id is not None:
+            deltas[book_id]['copies_total'] += 1
+            deltas[book_id][COPY_STATUS_COUNTERS.get(new_status)] += 1
+    return deltas
+
+
+def apply_moves(moves):
+    """Apply copy moves to the counters of their books"""
+    # books with the same changes (e.g. one copy returned each) share an UPDATE
+    books = defaultdict(list)
+    for book_id, delta in count_moves(moves).items():
+        changes = frozenset((field, value) for field, value in delta.items() if field and value)
+        if changes:
+            books[changes].append(book_id)
+    for changes, book_ids in books.items():
+        values = {field: F(field) + value for field, value in changes}
+        # the book list shows availability, its ETag follows Book.updated_at
+        Book.objects.filter(pk__in=book_ids).update(updated_at=timezone.now(), **values)
+
+
+def copy_counts(copies):
+    """The counter values of books with ``copies``, a list of statuses"""
+    counts = {field: 0 for field in COPY_COUNTERS}
+    for status in copies:
+        counts['copies_total'] += 1
+        if status in COPY_STATUS_COUNTERS:
+            counts[COPY_STATUS_COUNTERS[status]] += 1
+    return counts
+
+
+def recount(batch_size=1000, repair=True, using='default'):
+    """Compare the counters with the copies, ``batch_size`` books at a time.
+
+    Returns the ids of the books whose counters drifted, repaired when ``repair``.
+    """
+    books = Book.objects.using(using)
+    drifted = []
+    last_pk = 0
+    while True:
+        with transaction.atomic(using=using):
+            batch = list(
+                books.select_for_update().filter(pk__gt=last_pk).order_by('pk')
+                .values('pk', *COPY_COUNTERS)[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1]['pk']
+            actual = {row['pk']: {field: 0 for field in COPY_COUNTERS} for row in batch}
+            rows = (
+                BookInstance.objects.using(using)
+                .filter(book_id__in=list(actual)).order_by()
+                .values('book_id', 'status').annotate(copies=Count('pk'))
+            )
+            for row in rows:
+                counts = actual[row['book_id']]
+                counts['copies_total'] += row['copies']
+                if row['status'] in COPY_STATUS_COUNTERS:
+                    counts[COPY_STATUS_COUNTERS[row['status']]] += row['copies']
+
+            wrong = []
+            for row in batch:
+                if any(row[field] != actual[row['pk']][field] for field in COPY_COUNTERS):
+                    wrong.append(Book(pk=row['pk'], updated_at=timezone.now(), **actual[row['pk']]))
+            drifted.extend(book.pk for book in wrong)
+            if repair and wrong:
+                books.bulk_update(wrong, [*COPY_COUNTERS, 'updated_at'])
+    return drifted
@@ -0,0 +1,519 @@
+"""Synthetic catalog data and a benchmark of the catalog views.
+
+generate_catalog() fills the database with random (but reproducible) authors,
+genres, languages, books, copies and borrowers using bulk inserts.
+run_benchmark() requests every route of catalog/urls.py through the test
+client and measures latency percentiles, query counts and peak memory. The
+results are plain dictionaries that the benchmark_catalog command saves as JSON
+and compares with a stored baseline.
+run_asgi_benchmark() sends concurrent requests to the read-only pages through
+the ASGI handler, once with the sync views and once with the async ones
+(settings.CATALOG_ASYNC_VIEWS), and measures the throughput of both.
+run_sqlite_benchmark() runs patrons reading and librarians renewing loans in
+threads against two scratch SQLite files, one with Django's defaults and one
+with the settings of DATABASES['default'], and counts the writes that failed
+with "database is locked".
+"""
+import asyncio
+import datetime
+import importlib
+import platform
+import random
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Permission
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, reset_queries, transaction
+from django.db.models import Max
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, clear_url_caches, get_resolver, reverse
+
+from . import availability, database, fragments, reference, search, stats
+from .instrumentation import percentile
+from .models import Author, Book, BookInstance, Genre, Language
+
+SIZES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+WORDS = (
+    'the of and time night sea war house star river king winter shadow glass city '
+    'garden iron silver moon fire stone song empire dream storm letter road hunter'
+).split()
+STATUSES = ['a', 'a', 'a', 'o', 'o', 'r', 'm']
+BENCHMARK_USER = 'benchmark'
+# url arguments that aren't objects: the JSON API and the autocomplete are measured on
+# the books and the authors
+SAMPLE_ARGUMENTS = {'resource': 'books', 'kind': 'author'}
+SAMPLE_QUERIES = {'autocomplete': '?q=a'}
+# the pages with an async version, see catalog/async_views.py
+READ_ROUTES = ('index', 'books', 'book_detail', 'authors', 'author_detail')
+
+
+def parse_size(value):
+    """'1k', '100k', '1M' or a number of books"""
+    value = str(value).strip().lower()
+    if value in SIZES:
+        return SIZES[value]
+    if value.endswith('k'):
+        return int(value[:-1]) * 1000
+    if value.endswith('m'):
+        return int(value[:-1]) * 1000000
+    return int(value)
+
+
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def _batches(total, size):
+    for start in range(0, total, size):
+        yield start, min(size, total - start)
+
+
+def generate_catalog(books, batch_size=5000, seed=0, copies_per_book=2, index_search=True, log=None):
+    """Add ``books`` books with their authors, genres, languages, copies and borrowers.
+
+    Returns the number of rows created per model.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    created = {}
+    start = time.perf_counter()
+
+    languages = [Language(name=f'Language {seed}-{number}') for number in range(20)]
+    genres = [Genre(name=f'Genre {seed}-{number}') for number in range(50)]
+    with transaction.atomic():
+        Language.objects.bulk_create(languages, ignore_conflicts=True)
+        Genre.objects.bulk_create(genres, ignore_conflicts=True)
+    language_ids = list(Language.objects.values_list('pk', flat=True))
+    genre_ids = list(Genre.objects.values_list('pk', flat=True))
+
+    User = get_user_model()
+    password = make_password(None)
+    first_user = (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    users = [
+        User(username=f'reader-{seed}-{first_user + number}', password=password)
+        for number in range(max(1, books // 100))
+    ]
+    User.objects.bulk_create(users, batch_size=batch_size)
+    user_ids = list(User.objects.filter(username__startswith=f'reader-{seed}-').values_list('pk', flat=True))
+
+    authors = [
+        Author(first_name=_words(rng, 1).title(), last_name=f'{_words(rng, 1).title()} {number}')
+        for number in range(max(1, books // 10))
+    ]
+    with transaction.atomic():
+        Author.objects.bulk_create(authors, batch_size=batch_size)
+    author_ids = list(Author.objects.values_list('pk', flat=True))
+
+    first_isbn = (Book.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    BookGenre = Book.genre.through
+    today = datetime.date.today()
+    counts = {'books': 0, 'copies': 0}
+    book_ids = []
+    touched_authors = set()
+    for offset, size in _batches(books, batch_size):
+        # statuses first: the copy counters of the books are set in the same INSERT
+        statuses = [[rng.choice(STATUSES) for _ in range(copies_per_book)] for _ in range(size)]
+        with transaction.atomic():
+            new_books = Book.objects.bulk_create([
+                Book(
+                    title=_words(rng, rng.randint(1, 5)).capitalize(),
+                    summary=_words(rng, 40),
+                    isbn=f'9{seed % 10}{first_isbn + offset + number:011d}',
+                    author_id=rng.choice(author_ids),
+                    language_id=rng.choice(language_ids),
+                    **availability.copy_counts(statuses[number]),
+                )
+                for number in range(size)
+            ])
+            BookGenre.objects.bulk_create([
+                BookGenre(book_id=book.pk, genre_id=genre_id)
+                for book in new_books
+                for genre_id in rng.sample(genre_ids, min(len(genre_ids), rng.randint(1, 3)))
+            ])
+            copies = []
+            for book, book_statuses in zip(new_books, statuses):
+                for status in book_statuses:
+                    on_loan = status in ('o', 'r')
+                    copies.append(BookInstance(
+                        book_id=book.pk,
+                        imprint=_words(rng, 3),
+                        status=status,
+                        borrower_id=rng.choice(user_ids) if on_loan else None,
+                        due_back=today + datetime.timedelta(days=rng.randint(-10, 30)) if status == 'o' else None,
+                    ))
+            BookInstance.objects.bulk_create(copies)
+        counts['books'] += len(new_books)
+        counts['copies'] += len(copies)
+        book_ids.extend(book.pk for book in new_books)
+        touched_authors.update(book.author_id for book in new_books)
+        elapsed = time.perf_counter() - start
+        log(f'{counts["books"]} books, {counts["copies"]} copies ({counts["books"] / elapsed:.0f} books/s)')
+
+    # bulk_create doesn't send post_save, update the derived data by hand
+    if index_search:
+        for offset, size in _batches(len(book_ids), batch_size):
+            search.index_books(book_ids[offset:offset + size])
+    stats.invalidate_stats()
+    # author pages list their books, the book form lists the genres and languages
+    fragments.invalidate('author', touched_authors)
+    reference.invalidate(Genre)
+    reference.invalidate(Language)
+
+    created['languages'] = len(languages)
+    created['genres'] = len(genres)
+    created['users'] = len(users)
+    created['authors'] = len(authors)
+    created.update(counts)
+    return created
+
+
+def benchmark_user():
+    """A staff user with every catalog permission, used to reach the restricted views"""
+    User = get_user_model()
+    user, created = User.objects.get_or_create(username=BENCHMARK_USER, defaults={'is_staff': True})
+    if created:
+        user.set_unusable_password()
+        user.save()
+        user.user_permissions.set(Permission.objects.filter(content_type__app_label='catalog'))
+    return user
+
+
+def catalog_routes():
+    """(url name, url) of every route of catalog/urls.py, with sample objects for the arguments"""
+    book = Book.objects.order_by('pk').first()
+    author = Author.objects.order_by('pk').first()
+    copy = BookInstance.objects.order_by('pk').first()
+    routes = []
+    for pattern in get_resolver('catalog.urls').url_patterns:
+        if not isinstance(pattern, URLPattern) or not pattern.name:
+            continue
+        converters = pattern.pattern.converters
+        kwargs = {name: value for name, value in SAMPLE_ARGUMENTS.items() if name in converters}
+        if 'pk' in converters:
+            converter = type(converters['pk']).__name__
+            if converter == 'UUIDConverter':
+                sample = copy
+            elif pattern.name.startswith('author'):
+                sample = author
+            else:
+                sample = book
+            if sample is None:
+                continue
+            kwargs['pk'] = sample.pk
+        routes.append((pattern.name, reverse(pattern.name, kwargs=kwargs) + SAMPLE_QUERIES.get(pattern.name, '')))
+    return routes
+
+
+def measure_route(client, url, requests):
+    """Latency percentiles (ms), query count and peak memory of GET ``url``"""
+    timings = []
+    # a full query log (DEBUG=True) would make the capture empty
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    # the query log is cleared by the next requests, count now
+    query_count = len(queries)
+    status = response.status_code
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    client.get(url)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'status': status,
+        'requests': requests,
+        'mean_ms': statistics.fmean(timings) if timings else 0,
+        'p50_ms': percentile(timings, 0.5),
+        'p95_ms': percentile(timings, 0.95),
+        'p99_ms': percentile(timings, 0.99),
+        'queries': query_count,
+        'peak_memory_kb': peak / 1024,
+    }
+
+
+def run_benchmark(requests=20, host='localhost', routes=None, log=None):
+    """Benchmark every catalog route, return the results as a dictionary"""
+    log = log or (lambda message: None)
+    client = Client(HTTP_HOST=host)
+    client.force_login(benchmark_user())
+    results = {}
+    for name, url in catalog_routes():
+        if routes and name not in routes:
+            continue
+        results[name] = measure_route(client, url, requests)
+        log(f'{name}: p50 {results[name]["p50_ms"]:.1f}ms p95 {results[name]["p95_ms"]:.1f}ms '
+            f'{results[name]["queries"]} queries')
+    return {
+        'meta': {
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'books': Book.objects.count(),
+            'copies': BookInstance.objects.count(),
+        },
+        'routes': results,
+    }
+
+
+@contextmanager
+def use_async_views(enabled=True):
+    """Serve the catalog with the async views (or the sync ones) inside the block"""
+    import catalog.urls
+
+    def reload_urls():
+        # urls.py picks the views when it is imported, and the root urlconf keeps
+        # the patterns it included
+        importlib.reload(catalog.urls)
+        importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+        clear_url_caches()
+
+    try:
+        with override_settings(CATALOG_ASYNC_VIEWS=enabled):
+            reload_urls()
+            yield
+    finally:
+        reload_urls()
+
+
+async def _measure_concurrent(client, url, requests, concurrency):
+    """Throughput and latency percentiles of ``requests`` GETs, ``concurrency`` at a time"""
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+    statuses = set()
+
+    async def fetch():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get(url)
+            timings.append((time.perf_counter() - start) * 1000)
+            statuses.add(response.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(fetch() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    timings.sort()
+    return {
+        'status': max(statuses),
+        'requests': requests,
+        'concurrency': concurrency,
+        'requests_per_second': requests / elapsed if elapsed else 0,
+        'p50_ms': percentile(timings, 0.5),
+        'p95_ms': percentile(timings, 0.95),
+    }
+
+
+async def _measure_views(routes, requests, concurrency, host, user, log):
+    client = AsyncClient(HTTP_HOST=host)
+    await client.aforce_login(user)
+    results = {}
+    for name, url in routes:
+        await client.get(url)  # warm up the caches
+        results[name] = await _measure_concurrent(client, url, requests, concurrency)
+        log(f'{name}: {results[name]["requests_per_second"]:.0f} requests/s '
+            f'p50 {results[name]["p50_ms"]:.1f}ms p95 {results[name]["p95_ms"]:.1f}ms')
+    return results
+
+
+def run_asgi_benchmark(requests=200, concurrency=20, host='localhost', routes=None, log=None):
+    """Compare the sync and async versions of the read-only pages under concurrent load"""
+    log = log or (lambda message: None)
+    user = benchmark_user()
+    selected = [
+        (name, url) for name, url in catalog_routes()
+        if name in READ_ROUTES and (not routes or name in routes)
+    ]
+    results = {}
+    for mode in ('sync', 'async'):
+        log(f'{mode} views, {concurrency} concurrent requests')
+        with use_async_views(mode == 'async'):
+            results[mode] = async_to_sync(_measure_views)(selected, requests, concurrency, host, user, log)
+    return {
+        'meta': {
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'books': Book.objects.count(),
+            'copies': BookInstance.objects.count(),
+        },
+        'views': results,
+    }
+
+
+# the SQLite settings compared by run_sqlite_benchmark(): Django's defaults
+# without retries, and those of DATABASES['default'] with retried writes
+SQLITE_PROFILES = ('default', 'tuned')
+
+
+class _UsingRouter:
+    """Sends every query to one database, to fill a scratch database with generate_catalog()"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def db_for_read(self, model, **hints):
+        return self.alias
+
+    def db_for_write(self, model, **hints):
+        return self.alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+@contextmanager
+def scratch_database(profile, directory):
+    """A database alias for a new SQLite file in ``directory``, migrated, configured as ``profile``"""
+    alias = f'catalog_benchmark_{profile}'
+    settings_dict = dict(connections.settings[DEFAULT_DB_ALIAS])
+    settings_dict['NAME'] = f'{directory}/{profile}.sqlite3'
+    settings_dict['OPTIONS'] = settings.DATABASES['default'].get('OPTIONS', {}) if profile == 'tuned' else {}
+    settings_dict['CONN_MAX_AGE'] = 0
+    connections.settings[alias] = settings_dict
+    try:
+        call_command('migrate', database=alias, verbosity=0)
+        yield alias
+    finally:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+def _sqlite_workload(alias, retry, readers, writers, seconds, seed):
+    """Reads and writes per second, write failures and latencies of one database"""
+    book_ids = list(Book.objects.using(alias).values_list('pk', flat=True))
+    copy_ids = list(BookInstance.objects.using(alias).filter(status='o').values_list('pk', flat=True))
+    lock = threading.Lock()
+    totals = {'reads': 0, 'writes': 0, 'errors': 0}
+    write_timings = []
+    deadline = time.perf_counter() + seconds
+
+    def renew(pk, due_back):
+        # read then write, like the renewal form: the transaction needs the write lock half way
+        with transaction.atomic(using=alias):
+            if BookInstance.objects.using(alias).filter(pk=pk, status='o').exists():
+                BookInstance.objects.using(alias).filter(pk=pk).update(due_back=due_back)
+
+    if retry:
+        renew = database.retry_on_lock(renew, using=alias)
+
+    def reader(number):
+        rng = random.Random(seed + number)
+        reads = 0
+        try:
+            while time.perf_counter() < deadline:
+                book = Book.objects.using(alias).select_related('author').get(pk=rng.choice(book_ids))
+                list(book.bookinstance_set.using(alias).values_list('status', 'due_back'))
+                reads += 1
+        finally:
+            connections[alias].close()
+        with lock:
+            totals['reads'] += reads
+
+    def writer(number):
+        rng = random.Random(seed - number - 1)
+        writes, errors, timings = 0, 0, []
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    renew(rng.choice(copy_ids), datetime.date.today() + datetime.timedelta(days=rng.randint(1, 30)))
+                except OperationalError as error:
+                    if not database.is_locked(error):
+                        raise
+                    errors += 1
+                else:
+                    writes += 1
+                    timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            connections[alias].close()
+        with lock:
+            totals['writes'] += writes
+            totals['errors'] += errors
+            write_timings.extend(timings)
+
+    threads = [threading.Thread(target=reader, args=(number,)) for number in range(readers)]
+    threads += [threading.Thread(target=writer, args=(number,)) for number in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    write_timings.sort()
+    return {
+        'reads_per_second': totals['reads'] / elapsed,
+        'writes_per_second': totals['writes'] / elapsed,
+        'writes': totals['writes'],
+        'locked_errors': totals['errors'],
+        'write_p50_ms': percentile(write_timings, 0.5),
+        'write_p95_ms': percentile(write_timings, 0.95),
+    }
+
+
+def run_sqlite_benchmark(books=200, readers=8, writers=4, seconds=5, seed=0, log=None):
+    """Compare Django's default SQLite settings with the tuned ones under concurrent reads and writes"""
+    log = log or (lambda message: None)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in SQLITE_PROFILES:
+            with scratch_database(profile, directory) as alias:
+                # the same data in both files
+                with override_settings(DATABASE_ROUTERS=[_UsingRouter(alias)]):
+                    generate_catalog(books, seed=seed, index_search=False)
+                database.reset_retry_stats()
+                results[profile] = _sqlite_workload(alias, profile == 'tuned', readers, writers, seconds, seed)
+                results[profile]['retries'] = database.retry_stats()['retries']
+                with connections[alias].cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    results[profile]['journal_mode'] = cursor.fetchone()[0]
+            log(f'{profile}: {results[profile]["reads_per_second"]:.0f} reads/s, '
+                f'{results[profile]["writes_per_second"]:.0f} writes/s, '
+                f'{results[profile]["locked_errors"]} "database is locked" errors, '
+                f'{results[profile]["retries"]} retries, write p95 {results[profile]["write_p95_ms"]:.1f}ms')
+    return {
+        'meta': {
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'books': books,
+            'readers': readers,
+            'writers': writers,
+            'seconds': seconds,
+        },
+        'profiles': results,
+    }
+
+
+def compare(results, baseline, threshold=1.25):
+    """Regressions of ``results`` against ``baseline``, as a list of messages.
+
+    A route regresses when its p95 latency grows by more than ``threshold``
+    times, or when it runs more queries than in the baseline.
+    """
+    regressions = []
+    for name, current in results['routes'].items():
+        previous = baseline.get('routes', {}).get(name)
+        if previous is None:
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * threshold:
+            regressions.append(f'{name}: p95 {previous["p95_ms"]:.1f}ms -> {current["p95_ms"]:.1f}ms')
+        if current['queries'] > previous['queries']:
+            regressions.append(f'{name}: {previous["queries"]} -> {current["queries"]} queries')
+    return regressions
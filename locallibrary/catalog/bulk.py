@@ -0,0 +1,251 @@
+"""Bulk import and export of catalog records.
+
+Used by the import_catalog and export_catalog management commands. Records are
+flat dictionaries with the keys of RECORD_FIELDS; ``genres`` holds the genre
+names separated by ';'. Input is read and written in chunks so memory does not
+grow with the size of the file.
+"""
+import csv
+import json
+import time
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import Lower
+
+from . import availability, fragments, reference, search, stats
+from .models import Author, Book, BookInstance, Genre, Language
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+RECORD_FIELDS = [
+    'title', 'summary', 'isbn', 'author_first_name', 'author_last_name',
+    'genres', 'language', 'imprint', 'copies',
+]
+GENRE_SEPARATOR = ';'
+
+
+def peak_memory_mb():
+    """Peak resident memory of the process in MB (None if unknown)"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_records(stream, file_format):
+    """Yield records from a CSV, JSON lines or JSON array stream"""
+    if file_format == 'csv':
+        yield from csv.DictReader(stream)
+    elif file_format == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    elif file_format == 'json':
+        # a JSON array can't be parsed incrementally with the standard library
+        yield from json.load(stream)
+    else:
+        raise ValueError(f'Unknown format {file_format!r}')
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _clean(value):
+    return (value or '').strip() if not isinstance(value, (int, float)) else value
+
+
+def _genre_names(value):
+    if isinstance(value, list):
+        names = value
+    else:
+        names = (value or '').split(GENRE_SEPARATOR)
+    return [name.strip() for name in names if name and name.strip()]
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.books = 0
+        self.copies = 0
+        self.skipped = 0
+        self.start = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+class CatalogImporter:
+    """Import records with bulk inserts, one transaction per batch.
+
+    Authors, genres and languages are resolved through in-memory maps and
+    created on first use. Books whose ISBN already exists are skipped.
+    """
+
+    def __init__(self, batch_size=1000, default_status='a'):
+        self.batch_size = batch_size
+        self.default_status = default_status
+        self.stats = ImportStats()
+        self.authors = {}
+        # genres and languages are small tables, load them once
+        self.genres = {name.lower(): pk for pk, name in Genre.objects.values_list('pk', 'name')}
+        self.languages = {name.lower(): pk for pk, name in Language.objects.values_list('pk', 'name')}
+
+    def _resolve_named(self, model, cache, names):
+        missing = {}
+        for name in names:
+            # the first spelling met wins
+            if name.lower() not in cache:
+                missing.setdefault(name.lower(), name)
+        if not missing:
+            return
+        # ignore_conflicts: another process may have created them meanwhile
+        model.objects.bulk_create([model(name=name) for name in missing.values()], ignore_conflicts=True)
+        # bulk_create sends no post_save
+        reference.invalidate(model)
+        created = model.objects.annotate(lower_name=Lower('name')).filter(lower_name__in=list(missing))
+        for pk, lower_name in created.values_list('pk', 'lower_name'):
+            cache[lower_name] = pk
+
+    def _resolve_authors(self, records):
+        keys = {
+            (record['author_first_name'], record['author_last_name'])
+            for record in records if record['author_first_name'] or record['author_last_name']
+        }
+        missing = {key for key in keys if key not in self.authors}
+        if not missing:
+            return
+        last_names = {last_name for _, last_name in missing}
+        existing = Author.objects.filter(last_name__in=last_names).values_list('pk', 'first_name', 'last_name')
+        for pk, first_name, last_name in existing:
+            self.authors.setdefault((first_name, last_name), pk)
+        new_authors = [
+            Author(first_name=first_name, last_name=last_name)
+            for first_name, last_name in missing if (first_name, last_name) not in self.authors
+        ]
+        for author in Author.objects.bulk_create(new_authors, batch_size=self.batch_size):
+            self.authors[(author.first_name, author.last_name)] = author.pk
+
+    def _normalize(self, record):
+        record = {field: _clean(record.get(field)) for field in RECORD_FIELDS}
+        record['genres'] = _genre_names(record['genres'])
+        try:
+            record['copies'] = int(record['copies'] or 0)
+        except ValueError:
+            record['copies'] = 0
+        return record
+
+    def import_batch(self, records):
+        records = [self._normalize(record) for record in records]
+        self.stats.read += len(records)
+
+        # dedupe on ISBN, inside the batch and against the database
+        isbns = {record['isbn'] for record in records if record['isbn']}
+        existing = set(Book.objects.filter(isbn__in=isbns).values_list('isbn', flat=True))
+        unique_records = []
+        for record in records:
+            if not record['isbn'] or record['isbn'] in existing:
+                self.stats.skipped += 1
+                continue
+            existing.add(record['isbn'])
+            unique_records.append(record)
+        if not unique_records:
+            return []
+
+        with transaction.atomic():
+            self._resolve_named(Genre, self.genres, [name for r in unique_records for name in r['genres']])
+            self._resolve_named(Language, self.languages, [r['language'] for r in unique_records if r['language']])
+            self._resolve_authors(unique_records)
+
+            books = Book.objects.bulk_create([
+                Book(
+                    title=record['title'],
+                    summary=record['summary'],
+                    isbn=record['isbn'],
+                    author_id=self.authors.get((record['author_first_name'], record['author_last_name'])),
+                    language_id=self.languages.get(record['language'].lower()),
+                    # bulk_create doesn't send post_save, the copy counters are set here
+                    **availability.copy_counts([self.default_status] * record['copies']),
+                )
+                for record in unique_records
+            ], batch_size=self.batch_size)
+
+            BookGenre = Book.genre.through
+            BookGenre.objects.bulk_create([
+                BookGenre(book_id=book.pk, genre_id=genre_id)
+                for book, record in zip(books, unique_records)
+                for genre_id in {self.genres[name.lower()] for name in record['genres']}
+            ], batch_size=self.batch_size)
+
+            copies = BookInstance.objects.bulk_create([
+                BookInstance(book_id=book.pk, imprint=record['imprint'], status=self.default_status)
+                for book, record in zip(books, unique_records)
+                for _ in range(record['copies'])
+            ], batch_size=self.batch_size)
+
+            # bulk_create doesn't send post_save, keep the derived data current by hand
+            book_ids = [book.pk for book in books]
+            search.index_books(book_ids)
+            fragments.invalidate('author', {book.author_id for book in books})
+            transaction.on_commit(stats.invalidate_stats)
+
+        self.stats.books += len(books)
+        self.stats.copies += len(copies)
+        return books
+
+    def run(self, records):
+        for batch in chunked(records, self.batch_size):
+            self.import_batch(batch)
+        return self.stats
+
+
+def export_records(batch_size=1000):
+    """Yield a record per book, reading the books ``batch_size`` at a time"""
+    books = (
+        Book.objects.select_related('author', 'language')
+        .prefetch_related('genre')
+        .annotate(copies=Count('bookinstance'), imprint=Max('bookinstance__imprint'))
+        .order_by('pk')
+    )
+    for book in books.iterator(chunk_size=batch_size):
+        yield {
+            'title': book.title,
+            'summary': book.summary,
+            'isbn': book.isbn,
+            'author_first_name': book.author.first_name if book.author else '',
+            'author_last_name': book.author.last_name if book.author else '',
+            'genres': GENRE_SEPARATOR.join(genre.name for genre in book.genre.all()),
+            'language': book.language.name if book.language else '',
+            'imprint': book.imprint or '',
+            'copies': book.copies,
+        }
+
+
+def write_records(records, stream, file_format):
+    """Write records to a stream as CSV or JSON lines, return the number written"""
+    count = 0
+    if file_format == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=RECORD_FIELDS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            count += 1
+    elif file_format == 'jsonl':
+        for record in records:
+            stream.write(json.dumps(record) + '\n')
+            count += 1
+    else:
+        raise ValueError(f'Unknown format {file_format!r}')
+    return count
@@ -0,0 +1,30 @@
+"""Helpers shared by the caches of the catalog.
+
+The statistics, the page fragments, the reference tables and the permission
+sets are invalidated by bumping or deleting cache entries. Only a cache shared
+by every process (file, database, memcached, redis) makes such an invalidation
+visible to the other processes; a local-memory cache only clears the copy of
+the process that made the change.
+"""
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+# caches that live in one process
+LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def is_shared(cache):
+    """Whether every process sees the entries of ``cache``"""
+    return not isinstance(cache, LOCAL_CACHES)
+
+
+def invalidate_on_commit(invalidate, *args):
+    """Call ``invalidate(*args)`` now, and again when the current transaction commits.
+
+    A concurrent request may read the old rows between the two and cache them
+    again, under the new version for the versioned caches. ``args`` are used
+    twice, pass lists rather than iterators or querysets.
+    """
+    invalidate(*args)
+    transaction.on_commit(lambda: invalidate(*args))
@@ -0,0 +1,168 @@
+"""Loan history: an append-only log of loan events, and daily rollups for reporting.
+
+The loan operations of catalog/loans.py call record() in their transaction,
+and so do the receivers of catalog/signals.py for copies saved elsewhere (e.g.
+the admin). The events of a call are inserted with one bulk INSERT, so a bulk
+renewal of 500 copies writes its 500 events at once, and they commit or roll
+back with the loan.
+
+rollup() turns the events of a day into one row for the day, one per book and
+one per genre (the genres of the books at the time of the rollup). The
+rollup_circulation command rolls up every day completed since its last run,
+and the staff dashboard only reads the rollups, so its cost doesn't grow with
+the number of events. A rollup replaces the rows of its day, so a day can be
+rolled up again (e.g. after late events).
+"""
+import datetime
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+from django.utils import timezone
+
+from .models import (
+    Book, BookCirculationDay, CirculationDay, Genre, GenreCirculationDay, JobCheckpoint, LoanEvent,
+)
+
+CHECKPOINT = 'circulation-rollup'
+BATCH_SIZE = 1000
+# rollup column counting each kind of event
+COUNTERS = {
+    LoanEvent.CHECKOUT: 'checkouts',
+    LoanEvent.RENEW: 'renewals',
+    LoanEvent.RETURN: 'returns',
+}
+DASHBOARD_DAYS = 30
+DASHBOARD_TOP = 10
+
+
+def record(kind, copies):
+    """Log ``kind`` for ``copies``, (copy id, book id, borrower id, due back) tuples.
+
+    Called in the transaction of the loan, which retries as a whole.
+    """
+    now = timezone.now()
+    events = [
+        LoanEvent(kind=kind, copy_id=copy_id, book_id=book_id, borrower_id=borrower_id, due_back=due_back,
+                  created_at=now)
+        for copy_id, book_id, borrower_id, due_back in copies
+    ]
+    if events:
+        LoanEvent.objects.bulk_create(events, batch_size=BATCH_SIZE)
+
+
+def day_range(day):
+    """The start and end of ``day`` in the current time zone"""
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return start, start + datetime.timedelta(days=1)
+
+
+def rollup(day):
+    """Replace the rollups of ``day`` by those of its events, return the number of events"""
+    start, end = day_range(day)
+    events = LoanEvent.objects.filter(created_at__gte=start, created_at__lt=end)
+    totals = {'day': day, 'borrowers': 0, **{column: 0 for column in COUNTERS.values()}}
+    books = defaultdict(lambda: {column: 0 for column in COUNTERS.values()})
+    genres = defaultdict(lambda: {column: 0 for column in COUNTERS.values()})
+    # the database groups the day's events, a few rows per active book come back
+    for book_id, kind, count in events.values_list('book_id', 'kind').annotate(count=Count('id')).order_by():
+        totals[COUNTERS[kind]] += count
+        if book_id is not None:
+            books[book_id][COUNTERS[kind]] += count
+    book_ids = list(books)
+    for offset in range(0, len(book_ids), BATCH_SIZE):
+        book_genres = Book.genre.through.objects.filter(book_id__in=book_ids[offset:offset + BATCH_SIZE])
+        for book_id, genre_id in book_genres.values_list('book_id', 'genre_id'):
+            for column, count in books[book_id].items():
+                genres[genre_id][column] += count
+    totals['borrowers'] = events.aggregate(borrowers=Count('borrower_id', distinct=True))['borrowers']
+
+    with transaction.atomic():
+        CirculationDay.objects.filter(day=day).delete()
+        BookCirculationDay.objects.filter(day=day).delete()
+        GenreCirculationDay.objects.filter(day=day).delete()
+        CirculationDay.objects.create(**totals)
+        BookCirculationDay.objects.bulk_create(
+            [BookCirculationDay(day=day, book_id=pk, **counts) for pk, counts in books.items()],
+            batch_size=BATCH_SIZE,
+        )
+        GenreCirculationDay.objects.bulk_create(
+            [GenreCirculationDay(day=day, genre_id=pk, **counts) for pk, counts in genres.items()],
+            batch_size=BATCH_SIZE,
+        )
+    return sum(totals[column] for column in COUNTERS.values())
+
+
+def load_checkpoint():
+    position = JobCheckpoint.objects.filter(name=CHECKPOINT).values_list('position', flat=True).first()
+    if not position:
+        return None
+    return datetime.date.fromisoformat(position['day'])
+
+
+def save_checkpoint(day):
+    JobCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={'position': {'day': day.isoformat()}})
+
+
+def reset_checkpoint():
+    JobCheckpoint.objects.filter(name=CHECKPOINT).delete()
+
+
+def process(until=None, log=None):
+    """Roll up every completed day since the last run, up to ``until`` (yesterday by default).
+
+    Returns the counts of the run and its throughput.
+    """
+    log = log or (lambda message: None)
+    until = until or timezone.localdate() - datetime.timedelta(days=1)
+    start = time.perf_counter()
+    last = load_checkpoint()
+    if last is None:
+        first = LoanEvent.objects.aggregate(first=Min('created_at'))['first']
+        day = timezone.localdate(first) if first else until + datetime.timedelta(days=1)
+    else:
+        day = last + datetime.timedelta(days=1)
+    result = {'days': 0, 'events': 0}
+    while day <= until:
+        events = rollup(day)
+        save_checkpoint(day)
+        result['days'] += 1
+        result['events'] += events
+        log(f'{day}: {events} events')
+        day += datetime.timedelta(days=1)
+    elapsed = time.perf_counter() - start
+    result['seconds'] = elapsed
+    result['events_per_second'] = result['events'] / elapsed if elapsed else 0
+    return result
+
+
+def dashboard(days=DASHBOARD_DAYS, today=None):
+    """The circulation of the last ``days`` rolled up days, from the rollups only"""
+    end = today or timezone.localdate()
+    start = end - datetime.timedelta(days=days)
+    # named apart from the columns they add up
+    totals = {f'total_{column}': Sum(column) for column in COUNTERS.values()}
+    daily = list(CirculationDay.objects.filter(day__gte=start, day__lt=end).order_by('day'))
+    top_books = list(
+        BookCirculationDay.objects.filter(day__gte=start, day__lt=end)
+        .values('book_id').annotate(**totals).order_by('-total_checkouts', 'book_id')[:DASHBOARD_TOP]
+    )
+    top_genres = list(
+        GenreCirculationDay.objects.filter(day__gte=start, day__lt=end)
+        .values('genre_id').annotate(**totals).order_by('-total_checkouts', 'genre_id')[:DASHBOARD_TOP]
+    )
+    titles = dict(Book.objects.filter(pk__in=[row['book_id'] for row in top_books]).values_list('pk', 'title'))
+    names = dict(Genre.objects.filter(pk__in=[row['genre_id'] for row in top_genres]).values_list('pk', 'name'))
+    for row in top_books:
+        row['title'] = titles.get(row['book_id'], f'Deleted book {row["book_id"]}')
+    for row in top_genres:
+        row['name'] = names.get(row['genre_id'], f'Deleted genre {row["genre_id"]}')
+    return {
+        'start': start,
+        'end': end - datetime.timedelta(days=1),
+        'daily': daily,
+        'totals': {column: sum(getattr(row, column) for row in daily) for column in COUNTERS.values()},
+        'top_books': top_books,
+        'top_genres': top_genres,
+    }
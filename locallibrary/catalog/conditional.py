@@ -0,0 +1,144 @@
+"""HTTP conditional GET (ETag / Last-Modified) for the catalog pages.
+
+ConditionalGetMixin answers a GET with 304 Not Modified, before the page is
+queried or rendered, when the validators sent by the client still match. The
+validators must be cheap: views compute them with a single aggregate query on
+the ``updated_at`` columns, or from the fragment versions of
+catalog/fragments.py that are only read from the cache.
+
+The pages show the user name, links that depend on the permissions of the
+user and a CSRF token, so the ETag also depends on the user, their permissions
+and the CSRF cookie, and responses are marked private. Pending flash messages
+are shown by the next rendered page, requests that have some are never
+answered with 304.
+"""
+import hashlib
+
+from django.contrib import messages
+from django.db import connection
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+from . import permissions
+
+
+def aggregate_sql(queryset, function, field='pk'):
+    """``(SELECT function(field) FROM (queryset))``, to combine several in one SELECT"""
+    sql, params = queryset.order_by().values(field).query.sql_with_params()
+    column = '*' if function == 'COUNT' else connection.ops.quote_name(queryset.model._meta.get_field(field).column)
+    return f'(SELECT {function}({column}) FROM ({sql}) AS subquery)', params
+
+
+def select_aggregates(*aggregates):
+    """Run (queryset, function, field) aggregates in one query, return their values"""
+    columns, params = [], []
+    for aggregate in aggregates:
+        sql, sql_params = aggregate_sql(*aggregate)
+        columns.append(sql)
+        params.extend(sql_params)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT ' + ', '.join(columns), params)
+        return cursor.fetchone()
+
+
+def latest(*timestamps):
+    """The most recent of the timestamps that are not None"""
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+
+def has_messages(request):
+    """Whether flash messages wait to be shown by the next page"""
+    return len(messages.get_messages(request)) > 0
+
+
+def _permissions(user):
+    # the version of the cached permission set, or the set itself without a shared cache
+    if user is None or not user.is_authenticated:
+        return None
+    cache = permissions.get_cache()
+    if cache is not None:
+        return permissions.permissions_key(user.pk, cache)
+    return sorted(user.get_all_permissions())
+
+
+def make_etag(request, validators, timestamp=None):
+    """A strong ETag from the validators of the page content and the requesting user"""
+    user = getattr(request, 'user', None)
+    # the CSRF secret, the page embeds a token derived from it; the timestamp
+    # also catches the changes made by processes that don't share the fragment cache
+    parts = (validators, timestamp, getattr(user, 'pk', None), _permissions(user), request.META.get('CSRF_COOKIE'))
+    return quote_etag(hashlib.sha1(repr(parts).encode()).hexdigest())
+
+
+def _timestamp(last_modified):
+    return int(last_modified.timestamp()) if last_modified else None
+
+
+def finish_response(request, response, validators, etag, timestamp):
+    """Add the validators and cache headers to the response of a conditional GET"""
+    if etag and response.status_code == 200:
+        # a full page: rendering may create the CSRF cookie, recompute the ETag
+        if hasattr(response, 'render'):
+            response.render()
+        etag = make_etag(request, validators, timestamp)
+    if response.status_code in (200, 304):
+        if etag and not response.has_header('ETag'):
+            response.headers['ETag'] = etag
+        if timestamp and not response.has_header('Last-Modified'):
+            response.headers['Last-Modified'] = http_date(timestamp)
+        # the pages depend on the user: don't share them, and revalidate every time
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class ConditionalGetMixin:
+    """Answer GET requests with 304 when the ETag or Last-Modified still match"""
+
+    def get_last_modified(self):
+        """The datetime of the last change of the page, None when unknown"""
+        return None
+
+    def get_validators(self):
+        """Cheap values that change whenever the page content does, None when unknown.
+
+        Called after get_last_modified(), whose result is in self.last_modified.
+        """
+        return None
+
+    def get(self, request, *args, **kwargs):
+        if has_messages(request):
+            # the messages must be rendered, and the page isn't cached with them
+            return finish_response(request, super().get(request, *args, **kwargs), None, None, None)
+        self.last_modified = self.get_last_modified()
+        timestamp = _timestamp(self.last_modified)
+        validators = self.get_validators()
+        etag = make_etag(request, validators, timestamp) if validators is not None else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return finish_response(request, response, validators, etag, timestamp)
+
+
+class AsyncConditionalGetMixin:
+    """ConditionalGetMixin for async views, with async aget_last_modified()/aget_validators()"""
+
+    async def aget_last_modified(self):
+        return None
+
+    async def aget_validators(self):
+        return None
+
+    async def get(self, request, *args, **kwargs):
+        if has_messages(request):
+            return finish_response(request, await super().get(request, *args, **kwargs), None, None, None)
+        self.last_modified = await self.aget_last_modified()
+        timestamp = _timestamp(self.last_modified)
+        validators = await self.aget_validators()
+        etag = make_etag(request, validators, timestamp) if validators is not None else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = await super().get(request, *args, **kwargs)
+        return finish_response(request, response, validators, etag, timestamp)
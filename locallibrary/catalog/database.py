@@ -0,0 +1,103 @@
+"""Writes that survive a busy SQLite database.
+
+SQLite has a single writer. With the settings of settings.DATABASES (WAL
+journal, IMMEDIATE transactions and a busy timeout) readers never wait for the
+writer and writers queue for the lock instead of failing at once, but a writer
+can still give up with "database is locked" when the queue is longer than the
+timeout. retry_on_lock() runs such a write again after a short, growing and
+randomized pause (settings.CATALOG_WRITE_RETRIES and
+CATALOG_WRITE_RETRY_DELAY).
+
+A write is only retried when it is the whole transaction: inside an atomic
+block the error is raised, the caller owns the transaction and has to retry
+all of it.
+"""
+import functools
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+_counters_lock = threading.Lock()
+_counters = {
+    'retries': 0,
+    'failures': 0,
+}
+
+
+def get_retries():
+    return getattr(settings, 'CATALOG_WRITE_RETRIES', 5)
+
+
+def get_retry_delay():
+    return getattr(settings, 'CATALOG_WRITE_RETRY_DELAY', 0.05)
+
+
+def _bump_counter(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def is_locked(error):
+    """True if ``error`` means another connection holds the lock"""
+    return isinstance(error, OperationalError) and 'locked' in str(error)
+
+
+def retry_on_lock(func=None, using=DEFAULT_DB_ALIAS):
+    """Decorator running ``func`` again, with exponential backoff, while the database is locked"""
+    if func is None:
+        return functools.partial(retry_on_lock, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if not is_locked(error) or connections[using].in_atomic_block:
+                    raise
+                if attempt >= get_retries():
+                    _bump_counter('failures')
+                    raise
+            _bump_counter('retries')
+            # the jitter keeps the writers that failed together from retrying together
+            time.sleep(get_retry_delay() * 2 ** attempt * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    return wrapper
+
+
+def atomic_with_retry(func, using=DEFAULT_DB_ALIAS):
+    """``func`` in a transaction, retried as a whole while the database is locked"""
+    return retry_on_lock(transaction.atomic(using=using)(func), using=using)
+
+
+class RetryOnLockMixin:
+    """Save the form of a generic edit view in one transaction, retried while the database is locked"""
+
+    def form_valid(self, form):
+        instance = form.instance
+        adding, pk = instance._state.adding, instance.pk
+        form_valid = super().form_valid
+
+        def save(form):
+            # an attempt that failed after its INSERT (e.g. saving the m2m rows) left the
+            # instance with the pk of the rolled back row: insert it again
+            instance._state.adding, instance.pk = adding, pk
+            return form_valid(form)
+        return atomic_with_retry(save)(form)
+
+
+def retry_stats():
+    """Counters of the retried writes, and of those that failed after every retry"""
+    with _counters_lock:
+        return dict(_counters)
+
+
+def reset_retry_stats():
+    with _counters_lock:
+        for name in _counters:
+            _counters[name] = 0
@@ -1,26 +1,162 @@
 from django import forms
 from django.forms import ModelForm
 import datetime
+import uuid
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
-from catalog.models import BookInstance
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from catalog import reference
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+RENEWAL_PERIOD = datetime.timedelta(weeks=4)
+DEFAULT_RENEWAL_PERIOD = datetime.timedelta(weeks=3)
+
+def validate_renewal_date(data):
+    """Renewal rules shared by the single and bulk renewal forms"""
+    # check if date is not in the past 
+    if data < datetime.date.today():
+        raise ValidationError(_('Invalid date - renewal in past'))
+    
+    # check if date is in the allowed range (+4 weeks from today)
+    if data > datetime.date.today() + RENEWAL_PERIOD:
+        raise ValidationError(_('Invalid date - renewal more than 4 weeks ahead'))
 
 class RenewBookForm(forms.Form):
     renewal_date = forms.DateField(help_text="Enter a date between now and 4 weeks (default 3).")
 
     def clean_renewal_date(self):
         data = self.cleaned_data['renewal_date']
-        # check if date is not in the past 
-        if data < datetime.date.today():
-            raise ValidationError(_('Invalid date - renewal in past'))
-        
-        # check if date is in the allowed range (+4 weeks from today)
-        if data > datetime.date.today() + datetime.timedelta(weeks=4):
-            raise ValidationError(_('Invalid date - renewal more than 4 weeks ahead'))
-        
+        validate_renewal_date(data)
         # return cleaned data always
         return data
-    
+
+class UUIDListField(forms.Field):
+    """A list of UUIDs, submitted as repeated values (e.g. checkboxes)"""
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        if not value:
+            return []
+        if isinstance(value, str):
+            value = [value]
+        try:
+            return [uuid.UUID(str(item)) for item in value]
+        except ValueError:
+            raise ValidationError(_('Invalid copy id'), code='invalid')
+
+class BulkLoanForm(forms.Form):
+    """Renew or return many copies at once"""
+    ACTION_CHOICES = (
+        ('renew', 'Renew'),
+        ('return', 'Mark returned'),
+    )
+    action = forms.ChoiceField(choices=ACTION_CHOICES)
+    copies = UUIDListField()
+    renewal_date = forms.DateField(required=False, help_text="Enter a date between now and 4 weeks (default 3).")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('action') == 'renew':
+            renewal_date = cleaned_data.get('renewal_date')
+            if renewal_date is None:
+                self.add_error('renewal_date', _('A renewal date is required to renew'))
+            else:
+                try:
+                    validate_renewal_date(renewal_date)
+                except ValidationError as e:
+                    self.add_error('renewal_date', e)
+        return cleaned_data
+
+class CheckoutForm(forms.Form):
+    """Lend a copy of a book to a user"""
+    borrower = forms.CharField(help_text="Username of the borrower")
+    due_back = forms.DateField(help_text="Enter a date between now and 4 weeks (default 3).")
+
+    def clean_borrower(self):
+        username = self.cleaned_data['borrower']
+        try:
+            return get_user_model().objects.get(username=username)
+        except get_user_model().DoesNotExist:
+            raise ValidationError(_('Unknown user'))
+
+    def clean_due_back(self):
+        data = self.cleaned_data['due_back']
+        validate_renewal_date(data)
+        return data
+
+class LoanExportForm(forms.Form):
+    """Filters of the on-loan copies export"""
+    FORMAT_CHOICES = (
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    )
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False)
+    overdue = forms.BooleanField(required=False, help_text="Only copies past their due date")
+    borrower = forms.CharField(required=False, help_text="Username of the borrower")
+    due_after = forms.DateField(required=False)
+    due_before = forms.DateField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        due_after, due_before = cleaned_data.get('due_after'), cleaned_data.get('due_before')
+        if due_after and due_before and due_after > due_before:
+            raise ValidationError(_('Invalid date range - due_after is after due_before'))
+        return cleaned_data
+
+    def filter(self, queryset):
+        """Apply the (valid) filters to a BookInstance queryset"""
+        data = self.cleaned_data
+        if data['overdue']:
+            queryset = queryset.filter(due_back__lt=datetime.date.today())
+        if data['borrower']:
+            queryset = queryset.filter(borrower__username=data['borrower'])
+        if data['due_after']:
+            queryset = queryset.filter(due_back__gte=data['due_after'])
+        if data['due_before']:
+            queryset = queryset.filter(due_back__lte=data['due_before'])
+        return queryset
+
+class AutocompleteSelect(forms.Widget):
+    """Text input suggesting the matches of an autocomplete endpoint, for foreign keys to big tables.
+
+    Only the selected object is loaded, never the whole table.
+    """
+    template_name = 'catalog/widgets/autocomplete.html'
+
+    class Media:
+        js = ['js/autocomplete.js']
+
+    def __init__(self, kind, model, attrs=None):
+        super().__init__(attrs)
+        self.kind = kind
+        self.model = model
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        selected = None
+        if value:
+            try:
+                selected = self.model._default_manager.filter(pk=value).first()
+            except (ValueError, ValidationError):
+                pass  # an invalid submitted value, the field reports the error
+        context['widget']['label'] = str(selected) if selected else ''
+        context['widget']['url'] = reverse('autocomplete', args=[self.kind])
+        return context
+
+class BookForm(ModelForm):
+    """Book create/update form, rendered with the same queries whatever the size of the catalog"""
+    class Meta:
+        model = Book
+        fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
+        widgets = {'author': AutocompleteSelect('author', Author)}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the small reference tables come from the in-process cache
+        self.fields['genre'].choices = reference.choices(Genre)
+        self.fields['language'].choices = [('', self.fields['language'].empty_label), *reference.choices(Language)]
+
 # class RenewBookForm(ModelForm):
 #     class Meta:
 #         model = BookInstance
@@ -0,0 +1,154 @@
+"""Versioned cache of the content blocks of the book and author pages.
+
+Each book and author has a version token in the cache, bumped by the signal
+receivers in catalog/signals.py when the object or anything it displays
+changes, and again when the change commits (caching.invalidate_on_commit()).
+The fragment key includes the version, so a change makes the old fragment
+unreachable and it simply expires.
+Genres and languages are shown by many books, they have a single version each.
+
+The versions live in the cache named by settings.CATALOG_FRAGMENT_CACHE. With
+the local-memory cache only the process that made a change bumps them, the
+other processes serve their old fragments until settings.CATALOG_FRAGMENT_TIMEOUT
+expires them; use a cache shared by every process (file, database, memcached)
+to see changes at once.
+
+Only the content blocks are cached, the permission dependent sidebars are
+always rendered.
+"""
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+DEFAULT_TIMEOUT = 300
+# versions shared by every book fragment
+GLOBAL_VERSIONS = {
+    'book': ('genre', 'language'),
+    'author': (),
+}
+
+_counters_lock = threading.Lock()
+_counters = {
+    'hits': 0,
+    'misses': 0,
+    'invalidations': 0,
+}
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_FRAGMENT_CACHE', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOG_FRAGMENT_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def _bump_counter(name, value=1):
+    with _counters_lock:
+        _counters[name] += value
+
+
+def version_key(kind, pk=None):
+    return f'catalog:version:{kind}' if pk is None else f'catalog:version:{kind}:{pk}'
+
+
+def _versions(keys):
+    cache = get_cache()
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        # a lost version must never make an old fragment reachable again
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+async def _aversions(keys):
+    cache = get_cache()
+    versions = await cache.aget_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        await cache.aset_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def _version_keys(kind, pk):
+    return [version_key(kind, pk)] + [version_key(name) for name in GLOBAL_VERSIONS.get(kind, ())]
+
+
+def version(kind, pk=None):
+    """The current version token of an object, or the global one of ``kind``"""
+    return _versions([version_key(kind, pk)])[0]
+
+
+def versioned_key(prefix, kind, pk):
+    """A cache key that changes with the versions of the object"""
+    return f'{prefix}:{kind}:{pk}:' + '.'.join(_versions(_version_keys(kind, pk)))
+
+
+async def aversioned_key(prefix, kind, pk):
+    return f'{prefix}:{kind}:{pk}:' + '.'.join(await _aversions(_version_keys(kind, pk)))
+
+
+def fragment_key(kind, pk):
+    return versioned_key('catalog:fragment', kind, pk)
+
+
+async def afragment_key(kind, pk):
+    return await aversioned_key('catalog:fragment', kind, pk)
+
+
+def lookup(kind, pk):
+    """(key, cached HTML or None) of the fragment.
+
+    A miss is stored under this key once rendered, and it must be taken before
+    the page data is read: a change committed during the render bumps the
+    version, the HTML of the old data must not be stored under the new one.
+    """
+    key = fragment_key(kind, pk)
+    html = get_cache().get(key)
+    _bump_counter('hits' if html is not None else 'misses')
+    return key, html
+
+
+async def alookup(kind, pk):
+    key = await afragment_key(kind, pk)
+    html = await get_cache().aget(key)
+    _bump_counter('hits' if html is not None else 'misses')
+    return key, html
+
+
+def get_fragment(kind, pk):
+    """The cached HTML of the fragment, None on a miss"""
+    return lookup(kind, pk)[1]
+
+
+def set_fragment(key, html):
+    """Store a fragment under the key returned by lookup()"""
+    get_cache().set(key, html, get_timeout())
+
+
+def invalidate(kind, pks=None):
+    """Bump the version of the given objects, or the global version of ``kind``"""
+    if pks is None:
+        keys = [version_key(kind)]
+    else:
+        keys = [version_key(kind, pk) for pk in pks if pk is not None]
+    if keys:
+        get_cache().set_many({key: uuid.uuid4().hex for key in keys}, None)
+        _bump_counter('invalidations', len(keys))
+
+
+def cache_stats():
+    """Hit/miss counters of the fragment cache"""
+    with _counters_lock:
+        return dict(_counters)
+
+
+def reset_cache_stats():
+    with _counters_lock:
+        for name in _counters:
+            _counters[name] = 0
@@ -0,0 +1,203 @@
+"""Per-view request metrics for the catalog.
+
+QueryTimingMiddleware records, for every request served by a catalog view, the
+total time, number and duration of SQL queries, duplicated queries, template
+render time and response size. The last CATALOG_INSTRUMENTATION_SAMPLES
+requests of each view are kept in memory (a ring buffer) and summarized as
+p50/p95/p99 by the metrics endpoint, in the Prometheus text format.
+
+The middleware is only installed when settings.CATALOG_INSTRUMENTATION is True,
+otherwise Django drops it at startup and it costs nothing.
+"""
+import math
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template import base as template_base
+
+DEFAULT_SAMPLES = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+# (name, help) of the sampled values, in the order they are recorded
+METRICS = (
+    ('request_duration_seconds', 'Time spent handling the request'),
+    ('sql_queries', 'Number of SQL queries'),
+    ('sql_duration_seconds', 'Time spent running SQL queries'),
+    ('duplicate_sql_queries', 'Number of SQL queries already run by the request'),
+    ('template_render_seconds', 'Time spent rendering templates'),
+    ('response_size_bytes', 'Size of the response body'),
+)
+
+_current = ContextVar('catalog_request_metrics', default=None)
+
+
+class RequestMetrics:
+    """Counters of the request being served"""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        # database execute wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[(sql, str(params))] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+
+class MetricsRegistry:
+    """Bounded samples per view, safe to use from several threads"""
+
+    def __init__(self, size=DEFAULT_SAMPLES):
+        self.size = size
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.totals = Counter()
+
+    def record(self, view, values):
+        with self.lock:
+            if view not in self.samples:
+                self.samples[view] = deque(maxlen=self.size)
+            self.samples[view].append(values)
+            self.totals[view] += 1
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+
+    def summary(self):
+        """{view: {'count': total requests, metric: {quantile: value}}}"""
+        with self.lock:
+            snapshot = {view: list(samples) for view, samples in self.samples.items()}
+            totals = dict(self.totals)
+        result = {}
+        for view, samples in snapshot.items():
+            result[view] = {'count': totals[view]}
+            for index, (name, _) in enumerate(METRICS):
+                values = sorted(sample[index] for sample in samples)
+                result[view][name] = {quantile: percentile(values, quantile) for quantile in QUANTILES}
+        return result
+
+
+def percentile(sorted_values, quantile):
+    """Nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0
+    rank = math.ceil(quantile * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+registry = MetricsRegistry(getattr(settings, 'CATALOG_INSTRUMENTATION_SAMPLES', DEFAULT_SAMPLES))
+
+_original_render = template_base.Template.render
+_render_patch_lock = threading.Lock()
+
+
+def _timed_render(self, context):
+    metrics = _current.get()
+    if metrics is None:
+        return _original_render(self, context)
+    # included templates are rendered inside their parent, only time the outermost
+    metrics.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        metrics.template_depth -= 1
+        if not metrics.template_depth:
+            metrics.template_time += time.perf_counter() - start
+
+
+def install_template_timer():
+    with _render_patch_lock:
+        template_base.Template.render = _timed_render
+
+
+def is_catalog_view(request):
+    match = getattr(request, 'resolver_match', None)
+    return match is not None and match.func.__module__.startswith('catalog.')
+
+
+def prometheus_text(summary=None):
+    """The metrics in the Prometheus text exposition format"""
+    summary = registry.summary() if summary is None else summary
+    lines = []
+    for name, help_text in METRICS:
+        metric = f'catalog_{name}'
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} summary')
+        for view, values in sorted(summary.items()):
+            for quantile, value in values[name].items():
+                lines.append(f'{metric}{{view="{view}",quantile="{quantile}"}} {value:g}')
+            lines.append(f'{metric}_count{{view="{view}"}} {values["count"]}')
+    lines.extend(cache_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def cache_counters():
+    """Counters of the catalog caches, by cache name"""
+    from . import fragments, stats
+    return {
+        'stats': stats.cache_stats(),
+        'fragments': fragments.cache_stats(),
+    }
+
+
+def cache_lines():
+    lines = []
+    counters = cache_counters()
+    for event in ('hits', 'misses'):
+        metric = f'catalog_cache_{event}_total'
+        lines.append(f'# HELP {metric} Lookups of the catalog caches')
+        lines.append(f'# TYPE {metric} counter')
+        for cache, values in sorted(counters.items()):
+            lines.append(f'{metric}{{cache="{cache}"}} {values[event]}')
+    return lines
+
+
+class QueryTimingMiddleware:
+    """Record the cost of every request served by a catalog view"""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'CATALOG_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_template_timer()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - start
+
+        if is_catalog_view(request):
+            size = 0 if response.streaming else len(response.content)
+            registry.record(request.resolver_match.view_name, (
+                duration, metrics.queries, metrics.sql_time,
+                metrics.duplicates, metrics.template_time, size,
+            ))
+        return response
@@ -0,0 +1,209 @@
+"""Loan operations on book copies (BookInstance).
+
+Checkout, reservation and return move a copy between LOAN_STATUS states with a
+conditional UPDATE (``WHERE status = <expected status>``), so two librarians
+can never lend the same copy: the second UPDATE matches no row and the next
+copy is tried. On databases supporting it, the candidate copy is picked and
+locked in one query with SELECT ... FOR UPDATE SKIP LOCKED.
+
+Bulk operations change their copies with one UPDATE per batch inside a
+transaction, and return a result per requested copy.
+
+Every transaction is retried while the database is locked (catalog/database.py).
+Checkouts, renewals and returns are logged in the loan history (catalog/circulation.py)
+by the transaction that makes them.
+"""
+import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import availability, caching, circulation, fragments, stats
+from .database import atomic_with_retry, retry_on_lock
+from .models import BookInstance, LoanEvent
+
+BULK_BATCH_SIZE = 500
+
+# attempts to claim a copy before giving up, when other requests keep winning the race
+CLAIM_ATTEMPTS = 10
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+# per copy results
+RENEWED = 'renewed'
+RETURNED = 'returned'
+NOT_ON_LOAN = 'not on loan'
+NOT_FOUND = 'not found'
+
+
+class LoanError(Exception):
+    pass
+
+
+class NoCopyAvailable(LoanError):
+    pass
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def catalog_changed(book_ids):
+    """Invalidate the data derived from the copies of books after a QuerySet.update()"""
+    # update() doesn't send post_save, see catalog/signals.py
+    caching.invalidate_on_commit(fragments.invalidate, 'book', list(set(book_ids)))
+    transaction.on_commit(stats.invalidate_stats)
+
+
+@retry_on_lock
+def _update_batch(batch, values, event):
+    """Update the copies of ``batch`` that are on loan, return {copy id: status before}"""
+    with transaction.atomic():
+        rows = (
+            BookInstance.objects.select_for_update().filter(pk__in=batch)
+            .values_list('pk', 'status', 'book_id', 'borrower_id', 'due_back')
+        )
+        statuses = {row[0]: row[1] for row in rows}
+        on_loan = [row for row in rows if row[1] == 'o']
+        if on_loan:
+            BookInstance.objects.filter(pk__in=[row[0] for row in on_loan]).update(**values)
+            moved = [(book_id, status, values.get('status', status)) for _, status, book_id, _, _ in on_loan]
+            availability.apply_moves(moved)
+            catalog_changed(book_id for book_id, _, _ in moved)
+            # a renewal logs the new due date, a return the one it had
+            circulation.record(event, [
+                (pk, book_id, borrower_id, values.get('due_back') or due_back)
+                for pk, _, book_id, borrower_id, due_back in on_loan
+            ])
+    return statuses
+
+
+def _bulk_update_on_loan(copy_ids, values, result, event, batch_size):
+    # update() skips auto_now, the conditional GET of the catalog pages relies on updated_at
+    values = dict(values, updated_at=timezone.now())
+    results = {}
+    copy_ids = list(dict.fromkeys(copy_ids))
+    for batch in batches(copy_ids, batch_size):
+        statuses = _update_batch(batch, values, event)
+        for pk in batch:
+            if pk not in statuses:
+                results[pk] = NOT_FOUND
+            elif statuses[pk] != 'o':
+                results[pk] = NOT_ON_LOAN
+            else:
+                results[pk] = result
+    return results
+
+
+def bulk_renew(copy_ids, due_back, batch_size=BULK_BATCH_SIZE):
+    """Set the due date of the copies on loan, return {copy id: result}"""
+    values = {'due_back': due_back, 'notified_due_back': None}
+    return _bulk_update_on_loan(copy_ids, values, RENEWED, LoanEvent.RENEW, batch_size)
+
+
+def bulk_return(copy_ids, batch_size=BULK_BATCH_SIZE):
+    """Mark the copies on loan as available again, return {copy id: result}"""
+    values = {'status': 'a', 'borrower': None, 'due_back': None, 'notified_due_back': None}
+    return _bulk_update_on_loan(copy_ids, values, RETURNED, LoanEvent.RETURN, batch_size)
+
+
+@retry_on_lock
+def _claim_copy(candidates, values, event=None):
+    """Move one copy of ``candidates`` to ``values`` and return it, None if there is none.
+
+    ``event`` is logged for the copy in the loan history.
+    """
+    values = dict(values, updated_at=timezone.now())
+    # everything is read and written in the transaction of the claim, so an error
+    # can always be retried: it never leaves a claimed copy behind
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            # pick and lock any free copy in one query, copies locked by others are skipped
+            copy = candidates.select_for_update(skip_locked=True).first()
+            if copy is None:
+                return None
+            BookInstance.objects.filter(pk=copy.pk).update(**values)
+            availability.apply_moves([(copy.book_id, copy.status, values['status'])])
+            copy.refresh_from_db()
+            if event:
+                circulation.record(event, [(copy.pk, copy.book_id, copy.borrower_id, copy.due_back)])
+    else:
+        # optimistic: the UPDATE only succeeds if the copy is still in the expected state
+        for _ in range(CLAIM_ATTEMPTS):
+            row = candidates.values_list('pk', 'book_id', 'status').first()
+            if row is None:
+                return None
+            pk, book_id, status = row
+            with transaction.atomic():
+                if candidates.filter(pk=pk).update(**values):
+                    availability.apply_moves([(book_id, status, values['status'])])
+                    copy = BookInstance.objects.get(pk=pk)
+                    if event:
+                        circulation.record(event, [(copy.pk, copy.book_id, copy.borrower_id, copy.due_back)])
+                    break
+        else:
+            raise LoanError('Too many concurrent requests for this book, try again')
+    catalog_changed([copy.book_id])
+    return copy
+
+
+def checkout(book, borrower, due_back=None):
+    """Lend a copy of ``book`` to ``borrower``, return the BookInstance.
+
+    A copy reserved by the borrower is used first, then any available copy.
+    """
+    due_back = due_back or datetime.date.today() + LOAN_PERIOD
+    values = {'status': 'o', 'borrower': borrower, 'due_back': due_back, 'notified_due_back': None}
+    copies = BookInstance.objects.filter(book=book).order_by()
+    copy = _claim_copy(copies.filter(status='r', borrower=borrower), values, LoanEvent.CHECKOUT)
+    if copy is None:
+        copy = _claim_copy(copies.filter(status='a'), values, LoanEvent.CHECKOUT)
+    if copy is None:
+        raise NoCopyAvailable(f'No copy of {book} is available')
+    return copy
+
+
+def reserve(book, borrower):
+    """Reserve an available copy of ``book`` for ``borrower``, return the BookInstance"""
+    values = {'status': 'r', 'borrower': borrower, 'due_back': None}
+    copy = _claim_copy(BookInstance.objects.filter(book=book, status='a').order_by(), values)
+    if copy is None:
+        raise NoCopyAvailable(f'No copy of {book} is available')
+    return copy
+
+
+@retry_on_lock
+def return_copy(copy_id):
+    """Make a copy on loan or reserved available again"""
+    values = {'status': 'a', 'borrower': None, 'due_back': None, 'notified_due_back': None, 'updated_at': timezone.now()}
+    with transaction.atomic():
+        row = (
+            BookInstance.objects.select_for_update().filter(pk=copy_id)
+            .values_list('book_id', 'status', 'borrower_id', 'due_back').first()
+        )
+        if row is None or row[1] not in ('o', 'r'):
+            raise LoanError('This copy is not on loan or reserved')
+        book_id, status, borrower_id, due_back = row
+        # the status condition keeps the UPDATE safe where SELECT ... FOR UPDATE is a no-op (SQLite)
+        if not BookInstance.objects.filter(pk=copy_id, status=status).update(**values):
+            raise LoanError('This copy is not on loan or reserved')
+        availability.apply_moves([(book_id, status, 'a')])
+        if status == 'o':
+            # a cancelled reservation isn't a loan
+            circulation.record(LoanEvent.RETURN, [(copy_id, book_id, borrower_id, due_back)])
+        copy = BookInstance.objects.get(pk=copy_id)
+    catalog_changed([copy.book_id])
+    return copy
+
+
+def renew_copy(copy, due_back):
+    """Set the due date of one copy, like the renewal form of the librarians"""
+    def renew():
+        copy.due_back = due_back
+        # a renewal, even to the same date, is a new due date for the overdue notices
+        copy.notified_due_back = None
+        # logged by the post_save receiver of catalog/signals.py
+        copy._loan_renewed = True
+        copy.save(update_fields=['due_back', 'notified_due_back', 'updated_at'])
+    atomic_with_retry(renew)()
+    return copy
@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.benchmark import compare, run_asgi_benchmark, run_benchmark, run_sqlite_benchmark
+
+
+class Command(BaseCommand):
+    help = "Benchmark every catalog route and compare the results with a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per route')
+        parser.add_argument('--route', action='append', dest='routes', help='Only benchmark this url name')
+        parser.add_argument('--host', default='localhost', help='Host header of the requests')
+        parser.add_argument('--output', help='Save the results to this JSON file')
+        parser.add_argument('--baseline', help='JSON results to compare with')
+        parser.add_argument('--threshold', type=float, default=1.25, help='Allowed p95 slowdown factor')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Compare the sync and async read-only pages under concurrent ASGI requests')
+        parser.add_argument('--concurrency', type=int, default=20, help='Concurrent requests with --asgi')
+        parser.add_argument('--sqlite', action='store_true',
+                            help='Compare the default and tuned SQLite settings under concurrent reads and writes')
+        parser.add_argument('--readers', type=int, default=8, help='Reading threads with --sqlite')
+        parser.add_argument('--writers', type=int, default=4, help='Writing threads with --sqlite')
+        parser.add_argument('--seconds', type=float, default=5, help='Duration of each run with --sqlite')
+
+    def handle(self, *args, **options):
+        if (options['asgi'] or options['sqlite']) and options['baseline']:
+            raise CommandError('--baseline compares route latencies, it can\'t be used with --asgi or --sqlite')
+        if options['sqlite']:
+            results = run_sqlite_benchmark(
+                readers=options['readers'], writers=options['writers'], seconds=options['seconds'],
+                log=self.stdout.write,
+            )
+        elif options['asgi']:
+            results = run_asgi_benchmark(
+                requests=options['requests'], concurrency=options['concurrency'], host=options['host'],
+                routes=options['routes'], log=self.stdout.write,
+            )
+        else:
+            results = run_benchmark(
+                requests=options['requests'], host=options['host'], routes=options['routes'], log=self.stdout.write
+            )
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                json.dump(results, stream, indent=2)
+            self.stdout.write(f'Results saved to {options["output"]}')
+
+        if options['baseline']:
+            with open(options['baseline']) as stream:
+                baseline = json.load(stream)
+            regressions = compare(results, baseline, options['threshold'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(regression)
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS('No regression against the baseline'))
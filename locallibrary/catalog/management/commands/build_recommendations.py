@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog import recommendations
+
+
+class Command(BaseCommand):
+    help = "Recompute the 'Readers also liked' books of the books that changed since the last run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Recompute every book")
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K, help="Books recommended per book")
+        parser.add_argument('--engine', choices=[recommendations.NUMPY, recommendations.PYTHON],
+                            help="NumPy/SciPy sparse matrices or pure Python (default: numpy if installed)")
+        parser.add_argument('--worker', action='store_true', help="Keep running, every --interval seconds")
+        parser.add_argument('--interval', type=int, default=3600)
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            self.run(options, full)
+            if not options['worker']:
+                break
+            full = False
+            time.sleep(options['interval'])
+
+    def run(self, options, full):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        result = recommendations.process(full=full, k=options['top_k'], engine=options['engine'], log=log)
+        self.stdout.write(
+            f'{result["recomputed"]} of {result["books"]} books recomputed ({result["engine"]}), '
+            f'{result["rows"]} recommendations in {result["seconds"]:.2f}s '
+            f'({result["books_per_second"]:.0f} books/s)'
+        )
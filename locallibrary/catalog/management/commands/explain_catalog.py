@@ -0,0 +1,78 @@
+import datetime
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from catalog import circulation, overdue
+from catalog.models import (
+    Author, Book, BookCirculationDay, BookInstance, BookRecommendation, CirculationDay, Genre, LoanEvent,
+)
+from catalog.stats import fantasy_books
+
+# words that show up in the query plan when an index is used
+INDEX_MARKERS = {
+    'sqlite': ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY'),
+    'postgresql': ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan'),
+    'mysql': ('Using index', 'ref', 'range'),
+}
+# full table scans
+SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN \w+\s*$', re.MULTILINE),
+    'postgresql': re.compile(r'Seq Scan'),
+    'mysql': re.compile(r'\bALL\b'),
+}
+
+
+def catalog_querysets(user_id=0):
+    """The querysets run by the catalog views, by view name"""
+    start, end = circulation.day_range(datetime.date(2024, 1, 1))
+    return [
+        ('index: available copies', BookInstance.objects.filter(status__exact='a')),
+        ('index: fantasy books', fantasy_books()),
+        ('index: genres', Genre.objects.all()),
+        ('books', Book.objects.order_by('title', 'id')[:3]),
+        ('book_detail', Book.objects.select_related('author', 'language').filter(pk=1)),
+        ('book_detail: copies', BookInstance.objects.filter(book_id=1)),
+        ('book_detail: recommendations',
+         BookRecommendation.objects.select_related('recommended__author').filter(book_id=1).order_by('rank')),
+        ('authors', Author.objects.all()[:5]),
+        ('author_detail: books', Book.objects.filter(author_id=1)),
+        ('my_borrowed', BookInstance.objects.filter(borrower_id=user_id, status__exact='o').order_by('due_back')[:10]),
+        ('all_borrowed', BookInstance.objects.filter(status__exact='o').order_by('due_back')[:10]),
+        ('process_overdue', overdue.batch_queryset()[:overdue.BATCH_SIZE]),
+        ('rollup_circulation: events of the day', LoanEvent.objects.filter(created_at__gte=start, created_at__lt=end)),
+        ('circulation: days', CirculationDay.objects.filter(day__gte=start.date(), day__lt=end.date())),
+        ('circulation: books', BookCirculationDay.objects.filter(day__gte=start.date(), day__lt=end.date())),
+    ]
+
+
+def uses_index(plan, vendor=None):
+    """True if the plan uses an index and does not scan a whole table"""
+    vendor = vendor or connection.vendor
+    scan = SCAN_PATTERNS.get(vendor)
+    if scan and scan.search(plan):
+        return False
+    return any(marker in plan for marker in INDEX_MARKERS.get(vendor, ('INDEX',)))
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN on the querysets of the catalog views and report whether they use an index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plan', action='store_true', help='Print the full query plans')
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.order_by('pk').first()
+        missing = 0
+        for name, queryset in catalog_querysets(user.pk if user else 0):
+            plan = queryset.explain()
+            if uses_index(plan):
+                self.stdout.write(self.style.SUCCESS(f'{name}: index'))
+            else:
+                missing += 1
+                self.stdout.write(self.style.WARNING(f'{name}: no index'))
+            if options['verbose_plan']:
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+        self.stdout.write(f'{missing} queries without an index')
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.bulk import export_records, peak_memory_mb, write_records
+
+
+class Command(BaseCommand):
+    help = "Export the catalog, one record per book, as CSV or JSON lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, '-' for stdout")
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default='csv')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        start = time.perf_counter()
+        stream = self.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            count = write_records(export_records(options['batch_size']), stream, options['format'])
+        finally:
+            if path != '-':
+                stream.close()
+
+        elapsed = time.perf_counter() - start
+        memory = peak_memory_mb()
+        # keep stdout clean for the records
+        self.stderr.write(
+            f'Exported {count} books in {elapsed:.2f}s, {count / elapsed if elapsed else 0:.0f} rows/s'
+            + (f', peak memory {memory:.1f} MB' if memory is not None else '')
+        )
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.benchmark import generate_catalog, parse_size
+
+
+class Command(BaseCommand):
+    help = "Fill the database with synthetic catalog data (e.g. 1k, 100k or 1M books)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('size', help="Number of books: 1k, 100k, 1M or a number")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--copies', type=int, default=2, help='Copies per book')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-search-index', action='store_true', help="Don't index the books for search")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        created = generate_catalog(
+            parse_size(options['size']),
+            batch_size=options['batch_size'],
+            seed=options['seed'],
+            copies_per_book=options['copies'],
+            index_search=not options['no_search_index'],
+            log=self.stdout.write,
+        )
+        elapsed = time.perf_counter() - start
+        summary = ', '.join(f'{count} {name}' for name, count in created.items())
+        self.stdout.write(self.style.SUCCESS(f'Created {summary} in {elapsed:.1f}s'))
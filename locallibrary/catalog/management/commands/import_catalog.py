@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.bulk import CatalogImporter, peak_memory_mb, read_records
+from catalog.models import BookInstance
+
+FORMATS = ('csv', 'jsonl', 'json')
+
+
+class Command(BaseCommand):
+    help = "Import books, authors, genres, languages and copies from a CSV or JSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, '-' for stdin")
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        # a status outside BookInstance.LOAN_STATUS has no copy counter on Book
+        parser.add_argument(
+            '--status', default='a', choices=[code for code, _ in BookInstance.LOAN_STATUS],
+            help='Status of the imported copies'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in FORMATS:
+            raise CommandError(f'Unknown format {file_format!r}, use --format')
+
+        importer = CatalogImporter(batch_size=options['batch_size'], default_status=options['status'])
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            result = importer.run(read_records(stream, file_format))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {result.read} records: {result.books} books and {result.copies} copies created, '
+            f'{result.skipped} skipped'
+        ))
+        memory = peak_memory_mb()
+        self.stdout.write(
+            f'{result.elapsed:.2f}s, {result.rows_per_second:.0f} rows/s'
+            + (f', peak memory {memory:.1f} MB' if memory is not None else '')
+        )
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog import overdue
+
+
+class Command(BaseCommand):
+    help = "Email the borrowers of the overdue copies not notified yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=overdue.BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Count the notices without sending them")
+        parser.add_argument('--reset', action='store_true', help="Forget the notices sent and notify every overdue copy")
+        parser.add_argument('--worker', action='store_true', help="Keep running, every --interval seconds")
+        parser.add_argument('--interval', type=int, default=3600)
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            overdue.reset_notices()
+        while True:
+            self.run(options)
+            if not options['worker']:
+                break
+            time.sleep(options['interval'])
+
+    def run(self, options):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        result = overdue.process(batch_size=options['batch_size'], dry_run=options['dry_run'], log=log)
+        self.stdout.write(
+            f'{result["copies"]} overdue copies, {result["borrowers"]} borrowers, {result["emails"]} emails sent, '
+            f'{result["no_email"]} borrowers without email in {result["seconds"]:.2f}s '
+            f'({result["copies_per_second"]:.0f} copies/s, {result["emails_per_second"]:.0f} emails/s)'
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from catalog import availability, fragments, stats
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = "Check the copy counters of the books against their copies and repair the drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help="Only report the books whose counters are wrong")
+
+    def handle(self, *args, **options):
+        drifted = availability.recount(batch_size=options['batch_size'], repair=not options['dry_run'])
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All copy counters are correct'))
+            return
+        for pk in drifted[:20]:
+            self.stdout.write(f'Book {pk}: counters drifted')
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drifted)} books with wrong counters'))
+            return
+        # the pages showing the counters
+        fragments.invalidate('book', drifted)
+        fragments.invalidate('author', set(Book.objects.filter(pk__in=drifted).values_list('author_id', flat=True)))
+        stats.invalidate_stats()
+        self.stdout.write(self.style.SUCCESS(f'Repaired the counters of {len(drifted)} books'))
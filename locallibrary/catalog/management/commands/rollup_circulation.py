@@ -0,0 +1,40 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog import circulation
+
+
+class Command(BaseCommand):
+    help = "Roll up the loan events of every day completed since the last run, for the circulation dashboard"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--day', type=datetime.date.fromisoformat,
+                            help="Roll up this day (YYYY-MM-DD) again, without moving the checkpoint")
+        parser.add_argument('--until', type=datetime.date.fromisoformat,
+                            help="Last day to roll up (default: yesterday)")
+        parser.add_argument('--reset', action='store_true', help="Forget the checkpoint and start from the first event")
+        parser.add_argument('--worker', action='store_true', help="Keep running, every --interval seconds")
+        parser.add_argument('--interval', type=int, default=3600)
+
+    def handle(self, *args, **options):
+        if options['day']:
+            events = circulation.rollup(options['day'])
+            self.stdout.write(f'{options["day"]}: {events} events')
+            return
+        if options['reset']:
+            circulation.reset_checkpoint()
+        while True:
+            self.run(options)
+            if not options['worker']:
+                break
+            time.sleep(options['interval'])
+
+    def run(self, options):
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        result = circulation.process(until=options['until'], log=log)
+        self.stdout.write(
+            f'{result["days"]} days rolled up, {result["events"]} events in {result["seconds"]:.2f}s '
+            f'({result["events_per_second"]:.0f} events/s)'
+        )
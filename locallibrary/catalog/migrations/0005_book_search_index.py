@@ -0,0 +1,67 @@
+from django.db import migrations
+
+# the table names of catalog/search.py as they were when this migration was written,
+# so that later changes of the module don't change what the migration does
+FTS_TABLE = 'catalog_book_fts'
+TSVECTOR_TABLE = 'catalog_book_search'
+SEARCH_CONFIG = 'english'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    book = apps.get_model('catalog', 'Book')._meta.db_table
+    author = apps.get_model('catalog', 'Author')._meta.db_table
+    genre = apps.get_model('catalog', 'Genre')._meta.db_table
+    book_genre = apps.get_model('catalog', 'Book').genre.through._meta.db_table
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "title, summary, isbn, authors, genres, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, summary, isbn, authors, genres) "
+            f"SELECT b.id, b.title, b.summary, b.isbn, "
+            f"COALESCE(a.first_name || ' ' || a.last_name, ''), "
+            f"COALESCE((SELECT group_concat(g.name, ' ') FROM {book_genre} bg "
+            f"JOIN {genre} g ON g.id = bg.genre_id WHERE bg.book_id = b.id), '') "
+            f"FROM {book} b LEFT JOIN {author} a ON a.id = b.author_id"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {TSVECTOR_TABLE} ("
+            f"book_id bigint PRIMARY KEY REFERENCES {book} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TSVECTOR_TABLE}_document_idx ON {TSVECTOR_TABLE} USING GIN (document)"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {TSVECTOR_TABLE} (book_id, document) "
+            f"SELECT b.id, "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', b.title), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', b.summary), 'D') || "
+            f"setweight(to_tsvector('simple', b.isbn), 'A') || "
+            f"setweight(to_tsvector('simple', COALESCE(a.first_name || ' ' || a.last_name, '')), 'B') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', COALESCE((SELECT string_agg(g.name, ' ') FROM {book_genre} bg "
+            f"JOIN {genre} g ON g.id = bg.genre_id WHERE bg.book_id = b.id), '')), 'C') "
+            f"FROM {book} b LEFT JOIN {author} a ON a.id = b.author_id"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {TSVECTOR_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:14
+
+from django.db import migrations, models
+
+# the copy statuses counted, as they were when this migration was written
+STATUS_COUNTERS = {
+    'm': 'copies_maintenance',
+    'o': 'copies_on_loan',
+    'a': 'copies_available',
+    'r': 'copies_reserved',
+}
+
+
+def count_copies(apps, schema_editor):
+    book = apps.get_model('catalog', 'Book')._meta.db_table
+    copy = apps.get_model('catalog', 'BookInstance')._meta.db_table
+    counts = [f'copies_total = (SELECT COUNT(*) FROM {copy} c WHERE c.book_id = {book}.id)'] + [
+        f"{field} = (SELECT COUNT(*) FROM {copy} c WHERE c.book_id = {book}.id AND c.status = '{status}')"
+        for status, field in STATUS_COUNTERS.items()
+    ]
+    schema_editor.execute(f'UPDATE {book} SET {", ".join(counts)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_maintenance',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_on_loan',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_reserved',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:41
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_jobcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='author',
+            index=models.Index(django.db.models.functions.text.Lower('last_name'), models.F('id'), name='author_last_name_lower_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:23
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import F, Q
+
+
+def mark_notified(apps, schema_editor):
+    # the copies notified before the checkpoint of the previous notifier aren't notified again
+    alias = schema_editor.connection.alias
+    checkpoints = apps.get_model('catalog', 'JobCheckpoint').objects.using(alias)
+    copies = apps.get_model('catalog', 'BookInstance').objects.using(alias)
+    position = checkpoints.filter(name='overdue-notices').values_list('position', flat=True).first()
+    if position:
+        due_back = datetime.date.fromisoformat(position['due_back'])
+        copies.filter(
+            Q(due_back__lt=due_back) | Q(due_back=due_back, id__lte=position['id']), status='o',
+        ).update(notified_due_back=F('due_back'))
+        checkpoints.filter(name='overdue-notices').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_loan_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookinstance',
+            name='notified_due_back',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_notified, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,8 @@
 from django.conf import settings
-from django.db import models
+from django.db import DatabaseError, models, router, transaction
 from django.urls import reverse
-from django.db.models import UniqueConstraint
+from django.utils import timezone
+from django.db.models import F, UniqueConstraint
 from django.db.models.functions import Lower
 from datetime import date
 
@@ -38,6 +39,13 @@ class Book(models.Model):
     isbn = models.CharField('ISBN', max_length=13, unique=True, help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn">ISBN number</a>')
     genre = models.ManyToManyField(Genre, help_text="Select a genre for this book")
     language = models.ForeignKey('Language', on_delete=models.SET_NULL, null=True) # 
+    updated_at = models.DateTimeField(auto_now=True, db_index=True) # for conditional GET (Last-Modified / ETag)
+    # number of copies per status, kept current by catalog/availability.py
+    copies_total = models.PositiveIntegerField(default=0, editable=False)
+    copies_available = models.PositiveIntegerField(default=0, editable=False)
+    copies_on_loan = models.PositiveIntegerField(default=0, editable=False)
+    copies_reserved = models.PositiveIntegerField(default=0, editable=False)
+    copies_maintenance = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.title
@@ -51,7 +59,44 @@ class Book(models.Model):
         return ', '.join(genre.name for genre in self.genre.all()[:2])
     
     display_genre.short_description = 'Genre' #
+
+    def save(self, *args, **kwargs):
+        # the copy counters are changed with UPDATE ... SET copies_x = copies_x + 1,
+        # saving a book must not overwrite them with the values it was loaded with
+        if self._state.adding or kwargs.get('update_fields') is not None:
+            return super().save(*args, **kwargs)
+        kwargs.pop('update_fields', None)
+        fields = [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and field.name not in COPY_COUNTERS
+        ]
+        using = kwargs.get('using') or router.db_for_write(Book, instance=self)
+        try:
+            # in a savepoint, a failed save would doom the whole transaction
+            with transaction.atomic(using=using):
+                super().save(*args, update_fields=fields, **kwargs)
+        except DatabaseError as error:
+            # "did not affect any rows": like a full save, insert the book
+            # again when its row was deleted (IntegrityError and such are subclasses)
+            if type(error) is not DatabaseError or Book.objects.using(using).filter(pk=self.pk).exists():
+                raise
+            super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the book list (catalog/pagination.py)
+            models.Index(fields=['title', 'id'], name='book_title_idx'),
+        ]
     
+# Book field counting the copies of each BookInstance status
+COPY_STATUS_COUNTERS = {
+    'm': 'copies_maintenance',
+    'o': 'copies_on_loan',
+    'a': 'copies_available',
+    'r': 'copies_reserved',
+}
+COPY_COUNTERS = ['copies_total', *COPY_STATUS_COUNTERS.values()]
+
 import uuid  # Required for unique book instances
 
 class BookInstance(models.Model):
@@ -76,10 +121,27 @@ class BookInstance(models.Model):
         default='m',
         help_text='Book availability'
     )
+    updated_at = models.DateTimeField(auto_now=True)
+    # the due date of the last overdue notice, see catalog/overdue.py
+    notified_due_back = models.DateField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['due_back']
         permissions = (("can_mark_returned", "Set book as returned"),)
+        indexes = [
+            # all borrowed books, ordered by due date
+            models.Index(fields=['status', 'due_back'], name='bookinst_status_due_idx'),
+            # books borrowed by a user, ordered by due date
+            models.Index(fields=['borrower', 'status', 'due_back'], name='bookinst_borrower_loan_idx'),
+            # the admin changelist, ordered by due date
+            models.Index(fields=['due_back', 'id'], name='bookinst_due_back_idx'),
+            # only copies on loan, a small part of the table
+            models.Index(
+                fields=['due_back', 'id'], 
+                condition=models.Q(status='o'), 
+                name='bookinst_on_loan_idx'
+            ),
+        ]
 
     
     def __str__(self):
@@ -92,6 +154,11 @@ class BookInstance(models.Model):
     def is_overdue(self):
         return bool(self.due_back and date.today() > self.due_back)
     
+    def save(self, *args, **kwargs):
+        # the availability counters of the book are updated by signal receivers, in the same transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
     display_book.short_description = 'Book'
 
 class Author(models.Model):
@@ -100,9 +167,15 @@ class Author(models.Model):
     last_name = models.CharField(max_length=100)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField('Died', null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         ordering = ['last_name', 'first_name']
+        indexes = [
+            models.Index(fields=['last_name', 'first_name', 'id'], name='author_name_idx'),
+            # prefix search of the autocomplete (catalog/autocomplete.py)
+            models.Index(Lower('last_name'), F('id'), name='author_last_name_lower_idx'),
+        ]
 
     def get_absolute_url(self):
         """Returns the url to access a particular author instance"""
@@ -133,3 +206,103 @@ class Language(models.Model):
                 violation_error_code='Language already exists (case insensitive match)'
             )
         ]
+
+
+class VisitCount(models.Model):
+    """Home page visits of a visitor, written in batches by catalog/visits.py"""
+    visitor = models.CharField(max_length=64, unique=True, help_text="user:<id> or anonymous:<cookie>")
+    count = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.visitor}: {self.count}'
+
+
+class JobCheckpoint(models.Model):
+    """Where a batch job stopped, so that its next run carries on from there"""
+    name = models.CharField(max_length=100, unique=True)
+    position = models.JSONField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.position}'
+
+
+class BookRecommendation(models.Model):
+    """A book shown on the page of another ("Readers also liked"), computed by catalog/recommendations.py"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # also the index of the book page query, WHERE book_id = ? ORDER BY rank
+            UniqueConstraint(fields=['book', 'rank'], name='bookrec_book_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id} -> {self.recommended_id} ({self.score:.3f})'
+
+
+class LoanEvent(models.Model):
+    """A checkout, renewal or return, appended by catalog/circulation.py and never changed.
+
+    The ids of the copy, book and borrower are kept without foreign key
+    constraints, so the history outlives them.
+    """
+    CHECKOUT = 'checkout'
+    RENEW = 'renew'
+    RETURN = 'return'
+    KINDS = [(CHECKOUT, 'Checkout'), (RENEW, 'Renewal'), (RETURN, 'Return')]
+
+    kind = models.CharField(max_length=10, choices=KINDS)
+    copy_id = models.UUIDField()
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    borrower = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+'
+    )
+    due_back = models.DateField(null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # the events of a day, read by the rollups
+            models.Index(fields=['created_at'], name='loanevent_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.created_at:%Y-%m-%d %H:%M} {self.kind} {self.copy_id}'
+
+
+class CirculationDay(models.Model):
+    """Loan events of a day, rolled up by catalog/circulation.py"""
+    day = models.DateField(unique=True)
+    checkouts = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    borrowers = models.PositiveIntegerField(default=0, help_text="Distinct borrowers of the day's events")
+
+
+class BookCirculationDay(models.Model):
+    """Loan events of a book in a day"""
+    day = models.DateField()
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    checkouts = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [UniqueConstraint(fields=['day', 'book'], name='bookcirc_day_book_unique')]
+
+
+class GenreCirculationDay(models.Model):
+    """Loan events of the books of a genre in a day"""
+    day = models.DateField()
+    genre = models.ForeignKey(Genre, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    checkouts = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [UniqueConstraint(fields=['day', 'genre'], name='genrecirc_day_genre_unique')]
@@ -0,0 +1,119 @@
+"""Overdue loans: find them and email their borrowers, in batches.
+
+process() reads the copies on loan whose due date has passed with one keyset
+query per batch, served by the bookinst_on_loan_idx partial index (due_back,
+id WHERE status = 'o'). Each batch is grouped by borrower, one email per
+borrower (a borrower whose copies span two batches gets two), and every email
+of the run goes through one connection of settings.EMAIL_BACKEND.
+
+After each batch, the due date of the copies whose borrower was emailed is
+saved in their notified_due_back, and only the copies whose due date differs
+(never notified, or edited since) are notified by the next runs. The loan
+operations of catalog/loans.py clear it when a copy is renewed, returned or
+lent again. Copies whose borrower has no email address (or without borrower)
+stay pending and are counted by every run. A run that stopped half way
+resumes with the copies of its last batch, whose emails may be sent again.
+"""
+import datetime
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+
+from .models import BookInstance
+
+BATCH_SIZE = 500
+
+
+def overdue_copies(today=None):
+    return BookInstance.objects.filter(status='o', due_back__lt=today or datetime.date.today())
+
+
+def pending_copies(today=None):
+    """The overdue copies not notified for their current due date"""
+    return overdue_copies(today).filter(Q(notified_due_back__isnull=True) | ~Q(notified_due_back=F('due_back')))
+
+
+def mark_notified(rows):
+    """Save the due date notified for the copies of ``rows``"""
+    by_due_back = defaultdict(list)
+    for row in rows:
+        by_due_back[row['due_back']].append(row['id'])
+    for due_back, pks in by_due_back.items():
+        # a copy renewed in the meantime keeps its new due date pending
+        BookInstance.objects.filter(pk__in=pks, due_back=due_back).update(notified_due_back=due_back)
+
+
+def reset_notices():
+    """Forget the notices sent, every overdue copy is notified again"""
+    BookInstance.objects.filter(notified_due_back__isnull=False).update(notified_due_back=None)
+
+
+def batch_queryset(position=None, today=None):
+    """The pending copies after ``position`` (due_back, id) in due date order, as dictionaries"""
+    queryset = pending_copies(today)
+    if position:
+        due_back, pk = position
+        queryset = queryset.filter(Q(due_back__gt=due_back) | Q(due_back=due_back, id__gt=pk))
+    return queryset.order_by('due_back', 'id').values(
+        'id', 'due_back', 'book__title', 'borrower_id', 'borrower__username', 'borrower__first_name',
+        'borrower__email',
+    )
+
+
+def notice(copies):
+    """The email to the borrower of ``copies``"""
+    borrower = copies[0]
+    body = render_to_string('catalog/overdue_notice.txt', {
+        'name': borrower['borrower__first_name'] or borrower['borrower__username'],
+        'copies': copies,
+    })
+    subject = f'{len(copies)} overdue book{"s" if len(copies) > 1 else ""}'
+    return EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [borrower['borrower__email']])
+
+
+def process(batch_size=BATCH_SIZE, today=None, dry_run=False, log=None):
+    """Email the borrowers of the overdue copies not notified yet.
+
+    Returns the counts of the run and its throughput. A dry run sends nothing
+    and marks nothing.
+    """
+    log = log or (lambda message: None)
+    result = {'copies': 0, 'borrowers': 0, 'emails': 0, 'no_email': 0, 'batches': 0}
+    start = time.perf_counter()
+    position = None
+    # opened once for the whole run
+    with get_connection() as connection:
+        while True:
+            rows = list(batch_queryset(position, today)[:batch_size])
+            if not rows:
+                break
+            by_borrower = defaultdict(list)
+            for row in rows:
+                by_borrower[row['borrower_id']].append(row)
+            # a copy on loan without borrower has nobody to notify
+            by_borrower.pop(None, None)
+            messages, notified = [], []
+            for copies in by_borrower.values():
+                if copies[0]['borrower__email']:
+                    messages.append(notice(copies))
+                    notified.extend(copies)
+                else:
+                    # not marked, notified once the borrower has an address
+                    result['no_email'] += 1
+            if not dry_run:
+                result['emails'] += connection.send_messages(messages) or 0
+                mark_notified(notified)
+            position = rows[-1]['due_back'], rows[-1]['id']
+            result['copies'] += len(rows)
+            result['borrowers'] += len(by_borrower)
+            result['batches'] += 1
+            log(f'batch {result["batches"]}: {len(rows)} copies, {len(messages)} emails')
+    elapsed = time.perf_counter() - start
+    result['seconds'] = elapsed
+    result['copies_per_second'] = result['copies'] / elapsed if elapsed else 0
+    result['emails_per_second'] = result['emails'] / elapsed if elapsed else 0
+    return result
@@ -0,0 +1,252 @@
+"""Keyset (cursor) pagination for the catalog list views.
+
+Instead of OFFSET/LIMIT and a COUNT(*) per page, each page is fetched with a
+WHERE clause on the ordering columns of the last (or first) row of the
+previous page, so deep pages cost the same as the first one. The position is
+handed to the client as an opaque, url safe token.
+
+EstimatedCountPaginator is a regular paginator that skips the COUNT(*) of big
+unfiltered tables, for the admin changelists.
+"""
+import base64
+import json
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    """A page of results, with the tokens of its neighbour pages"""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Paginate a queryset on ``ordering``, a list of (ascending) field names.
+
+    The last field must be unique (usually the primary key) so that every row
+    has a distinct position. Nullable fields are sorted with NULLs last.
+    The queryset can return model instances or QuerySet.values() rows that
+    include the ordering fields.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = list(ordering)
+        self.fields = [queryset.model._meta.get_field(name) for name in self.ordering]
+
+    # tokens
+    def encode_cursor(self, obj, direction):
+        if isinstance(obj, dict):
+            # a row of QuerySet.values(), value_to_string() reads attributes
+            obj = SimpleNamespace(**{field.attname: obj[field.name] for field in self.fields})
+        values = [field.value_to_string(obj) if getattr(obj, field.attname) is not None else None
+                  for field in self.fields]
+        data = json.dumps({'v': values, 'd': direction}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values, direction = data['v'], data['d']
+            if direction not in ('n', 'p') or len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            values = [None if value is None else field.to_python(value)
+                      for field, value in zip(self.fields, values)]
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            raise InvalidCursor(cursor) from e
+        return values, direction
+
+    # queries
+    def _order_by(self, reverse=False):
+        expressions = []
+        for field in self.fields:
+            if reverse:
+                expressions.append(F(field.name).desc(nulls_first=True) if field.null else F(field.name).desc())
+            else:
+                expressions.append(F(field.name).asc(nulls_last=True) if field.null else F(field.name).asc())
+        return expressions
+
+    def _equal(self, field, value):
+        if value is None:
+            return Q(**{f'{field.name}__isnull': True})
+        return Q(**{field.name: value})
+
+    def _beyond(self, field, value, reverse):
+        # rows strictly after (or before, when reverse) ``value`` with NULLs sorted last
+        if reverse:
+            if value is None:
+                return Q(**{f'{field.name}__isnull': False})
+            return Q(**{f'{field.name}__lt': value})
+        if value is None:
+            return None
+        condition = Q(**{f'{field.name}__gt': value})
+        if field.null:
+            condition |= Q(**{f'{field.name}__isnull': True})
+        return condition
+
+    def _keyset_filter(self, values, reverse):
+        condition = Q(pk__in=[])
+        for index, (field, value) in enumerate(zip(self.fields, values)):
+            beyond = self._beyond(field, value, reverse)
+            if beyond is None:
+                continue
+            branch = Q()
+            for previous_field, previous_value in zip(self.fields[:index], values[:index]):
+                branch &= self._equal(previous_field, previous_value)
+            condition |= branch & beyond
+        return condition
+
+    def _page_queryset(self, cursor):
+        queryset = self.queryset
+        reverse = False
+        if cursor:
+            values, direction = self.decode_cursor(cursor)
+            reverse = direction == 'p'
+            queryset = queryset.filter(self._keyset_filter(values, reverse))
+        return queryset.order_by(*self._order_by(reverse))[:self.per_page + 1], reverse
+
+    def _make_page(self, rows, cursor, reverse):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        if not rows:
+            return CursorPage(rows)
+        # going forward there is a previous page whenever we started from a cursor,
+        # going backward there is always a next page
+        has_next = has_more if not reverse else True
+        has_previous = bool(cursor) if not reverse else has_more
+        return CursorPage(
+            rows,
+            next_cursor=self.encode_cursor(rows[-1], 'n') if has_next else None,
+            previous_cursor=self.encode_cursor(rows[0], 'p') if has_previous else None,
+        )
+
+    def page(self, cursor=None):
+        """Return the CursorPage designated by ``cursor`` (the first page if empty)"""
+        queryset, reverse = self._page_queryset(cursor)
+        return self._make_page(list(queryset), cursor, reverse)
+
+    async def apage(self, cursor=None):
+        """page() with the async ORM"""
+        queryset, reverse = self._page_queryset(cursor)
+        return self._make_page([row async for row in queryset], cursor, reverse)
+
+
+class CursorPaginationMixin:
+    """Opt-in keyset pagination for ListView subclasses.
+
+    Set ``cursor_ordering`` on the view; cursor pagination is used when
+    ``cursor_pagination`` is True, or when it is None and the
+    CATALOG_CURSOR_PAGINATION setting is enabled.
+    """
+    cursor_ordering = None
+    cursor_pagination = None
+    cursor_kwarg = 'cursor'
+
+    def use_cursor_pagination(self):
+        if self.cursor_pagination is None:
+            return getattr(settings, 'CATALOG_CURSOR_PAGINATION', False)
+        return self.cursor_pagination
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.use_cursor_pagination():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size, self.cursor_ordering)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['is_cursor_paginated'] = self.use_cursor_pagination() and context.get('is_paginated', False)
+        return context
+
+
+def estimate_count(queryset):
+    """Estimated number of rows of an unfiltered queryset, None when unknown.
+
+    Read from the statistics of the database (PostgreSQL, MySQL, SQLite after
+    ANALYZE) or else the largest rowid (SQLite), without scanning the table.
+    """
+    query = queryset.query
+    if query.where or query.distinct or query.combinator or query.is_sliced:
+        return None
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                # "rows [rows per key ...]" of the table and of each index
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+                stats = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+                if stats:
+                    return max(stats)
+            # deleted rows leave holes, this over-estimates, by far after a bulk delete
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    # PostgreSQL returns -1 for a table never analyzed
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator counting big unfiltered tables with estimate_count() instead of COUNT(*)"""
+    # below this many rows the exact count is cheap
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < self.exact_count_limit:
+            return super().count
+        # the estimate can be far off (e.g. MAX(rowid) after a bulk delete), a
+        # table that in fact has fewer rows than the limit is counted exactly
+        counted = self.object_list.order_by()[:self.exact_count_limit].count()
+        return estimate if counted >= self.exact_count_limit else counted
@@ -0,0 +1,112 @@
+"""Authentication backend that keeps the permissions of each user in the cache.
+
+ModelBackend runs two queries per request for a logged in user (the permissions
+of the user and of their groups) as soon as a template checks perms.* or a view
+requires a permission. CachedModelBackend stores the resolved set of
+"app_label.codename" strings in the cache named by
+settings.CATALOG_PERMISSIONS_CACHE, under a key made of a version of the user
+and a global version, both kept in that cache too.
+
+The signal receivers of catalog/signals.py bump the version of a user when
+their permissions, groups or superuser flag change, and the global version when
+the permissions of a group change or a group or permission is deleted, so the
+next request loads the new set.
+
+The cache must be shared by every process: with a local-memory cache the other
+workers would keep granting a revoked permission until the timeout. Without a
+shared cache (no alias, a LocMemCache or a DummyCache) the backend is a plain
+ModelBackend.
+"""
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+from .caching import is_shared
+
+GLOBAL_VERSION_KEY = 'catalog:permissions:version'
+
+
+def get_cache():
+    """The shared cache of the permission sets, None if there is none"""
+    alias = getattr(settings, 'CATALOG_PERMISSIONS_CACHE', None)
+    if alias is None:
+        return None
+    cache = caches[alias]
+    return cache if is_shared(cache) else None
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOG_PERMISSIONS_TIMEOUT', 3600)
+
+
+def version_key(user_pk):
+    return f'{GLOBAL_VERSION_KEY}:{user_pk}'
+
+
+def _key(user_pk, versions, keys):
+    # a lost version must never make an old set reachable again
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    return f'catalog:permissions:{user_pk}:' + '.'.join({**versions, **missing}[key] for key in keys), missing
+
+
+def permissions_key(user_pk, cache=None):
+    cache = cache or get_cache()
+    keys = [version_key(user_pk), GLOBAL_VERSION_KEY]
+    key, missing = _key(user_pk, cache.get_many(keys), keys)
+    if missing:
+        cache.set_many(missing, None)
+    return key
+
+
+async def apermissions_key(user_pk, cache=None):
+    cache = cache or get_cache()
+    keys = [version_key(user_pk), GLOBAL_VERSION_KEY]
+    key, missing = _key(user_pk, await cache.aget_many(keys), keys)
+    if missing:
+        await cache.aset_many(missing, None)
+    return key
+
+
+def invalidate(user_pks):
+    """Reload the permissions of these users on their next request"""
+    cache = get_cache()
+    if cache is not None:
+        cache.set_many({version_key(pk): uuid.uuid4().hex for pk in user_pks}, None)
+
+
+def invalidate_all():
+    cache = get_cache()
+    if cache is not None:
+        cache.set(GLOBAL_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend reading the permission set of a user from the shared cache"""
+
+    def get_all_permissions(self, user_obj, obj=None):
+        cache = get_cache()
+        if cache is None or not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return super().get_all_permissions(user_obj, obj)
+        if not hasattr(user_obj, '_perm_cache'):
+            key = permissions_key(user_obj.pk, cache)
+            perms = cache.get(key)
+            if perms is None:
+                perms = super().get_all_permissions(user_obj)
+                cache.set(key, perms, get_timeout())
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
+
+    async def aget_all_permissions(self, user_obj, obj=None):
+        cache = get_cache()
+        if cache is None or not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return await super().aget_all_permissions(user_obj, obj)
+        if not hasattr(user_obj, '_perm_cache'):
+            key = await apermissions_key(user_obj.pk, cache)
+            perms = await cache.aget(key)
+            if perms is None:
+                perms = await super().aget_all_permissions(user_obj)
+                await cache.aset(key, perms, get_timeout())
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
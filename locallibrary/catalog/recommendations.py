@@ -0,0 +1,231 @@
+"""'Readers also liked': the books most similar to each book, computed in batches.
+
+Each book is a sparse vector of weighted features: its author, its genres and
+the readers who borrowed it (now, or in the loan history of catalog/circulation.py). Two books are as similar as the cosine of their
+vectors, and the TOP_K most similar books of each book are stored in
+BookRecommendation, which the book page reads with one query on the
+(book, rank) index.
+
+With NumPy and SciPy installed, the similarities of BLOCK_SIZE books at a time
+are one product of sparse matrices (books x features times its transpose).
+Without them, a pure Python version adds up the weights of the shared features
+through an inverted index, with the same results.
+
+A run recomputes every book the first time, then only the books whose list may
+have changed since the previous run (saved in a JobCheckpoint):
+- the books changed since then (their row, genres or copies), their
+  similarities with everything changed;
+- the books sharing a feature with one of them, the changed book may now
+  enter their list;
+- the books listing one of them, it may have to leave the list.
+A deleted book simply disappears from the lists that had it; a full run
+(build_recommendations --full) fills them again.
+"""
+import datetime
+import heapq
+import itertools
+import math
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+
+from . import caching, fragments
+from .models import Book, BookInstance, BookRecommendation, JobCheckpoint, LoanEvent
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional, the pure Python version is used instead
+    np = sparse = None
+
+CHECKPOINT = 'recommendations'
+TOP_K = 5
+BLOCK_SIZE = 1000
+# a shared author says more than a shared genre
+FEATURE_WEIGHTS = {
+    'author': 2.0,
+    'genre': 1.0,
+    'borrower': 1.0,
+}
+NUMPY = 'numpy'
+PYTHON = 'python'
+# scores are rounded so that both versions rank the books the same way
+PRECISION = 6
+
+
+def prefetch():
+    """The recommendations of the book page, best first, with what the template shows"""
+    return Prefetch(
+        'recommendations',
+        queryset=BookRecommendation.objects.select_related('recommended__author').order_by('rank'),
+    )
+
+
+def load_checkpoint():
+    position = JobCheckpoint.objects.filter(name=CHECKPOINT).values_list('position', flat=True).first()
+    if not position:
+        return None
+    return datetime.datetime.fromisoformat(position['since'])
+
+
+def save_checkpoint(since):
+    JobCheckpoint.objects.update_or_create(name=CHECKPOINT, defaults={'position': {'since': since.isoformat()}})
+
+
+def reset_checkpoint():
+    JobCheckpoint.objects.filter(name=CHECKPOINT).delete()
+
+
+def book_features():
+    """{book id: {(kind, id): weight}} of every book, books without features included"""
+    features = {}
+    for pk, author_id in Book.objects.values_list('pk', 'author_id'):
+        features[pk] = {('author', author_id): FEATURE_WEIGHTS['author']} if author_id else {}
+    for pk, genre_id in Book.genre.through.objects.values_list('book_id', 'genre_id'):
+        features[pk][('genre', genre_id)] = FEATURE_WEIGHTS['genre']
+    borrowers = BookInstance.objects.filter(borrower__isnull=False).values_list('book_id', 'borrower_id').distinct()
+    history = (
+        LoanEvent.objects.filter(kind=LoanEvent.CHECKOUT, book__isnull=False, borrower__isnull=False)
+        .values_list('book_id', 'borrower_id').distinct()
+    )
+    for pk, borrower_id in itertools.chain(borrowers, history):
+        # the log keeps the ids of deleted books
+        if pk in features:
+            features[pk][('borrower', borrower_id)] = FEATURE_WEIGHTS['borrower']
+    return features
+
+
+def _similar_python(features):
+    norms = {pk: math.sqrt(sum(weight * weight for weight in vector.values())) for pk, vector in features.items()}
+    books_by_feature = defaultdict(list)
+    for pk, vector in features.items():
+        for feature, weight in vector.items():
+            books_by_feature[feature].append((pk, weight))
+
+    def similar(book_ids, k):
+        results = {}
+        for pk in book_ids:
+            dots = defaultdict(float)
+            for feature, weight in features[pk].items():
+                for other, other_weight in books_by_feature[feature]:
+                    dots[other] += weight * other_weight
+            dots.pop(pk, None)
+            best = heapq.nsmallest(k, (
+                (-round(dot / (norms[pk] * norms[other]), PRECISION), other) for other, dot in dots.items()
+            ))
+            results[pk] = [(other, -score) for score, other in best]
+        return results
+    return similar
+
+
+def _similar_numpy(features):
+    book_ids = np.array(sorted(features))
+    row_of = {pk: row for row, pk in enumerate(book_ids.tolist())}
+    columns = {}
+    rows, cols, weights = [], [], []
+    for pk, vector in features.items():
+        for feature, weight in vector.items():
+            rows.append(row_of[pk])
+            cols.append(columns.setdefault(feature, len(columns)))
+            weights.append(weight)
+    matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(len(book_ids), len(columns)))
+    # unit rows: the dot products are the cosines
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.diags(1 / norms).dot(matrix).tocsr()
+    transposed = matrix.T.tocsc()
+
+    def similar(pks, k):
+        block = np.array([row_of[pk] for pk in pks], dtype=np.int64)
+        similarities = matrix[block].dot(transposed).tocsr()
+        results = {}
+        for index, row in enumerate(block):
+            start, end = similarities.indptr[index], similarities.indptr[index + 1]
+            others = similarities.indices[start:end]
+            scores = np.round(similarities.data[start:end], PRECISION)
+            keep = (others != row) & (scores > 0)
+            others, scores = others[keep], scores[keep]
+            # best score first, then lowest book id, like heapq.nsmallest above
+            order = np.lexsort((book_ids[others], -scores))[:k]
+            results[int(book_ids[row])] = [
+                (int(book_ids[other]), float(score)) for other, score in zip(others[order], scores[order])
+            ]
+        return results
+    return similar
+
+
+def similarity_function(features, engine=None):
+    """``similar(book ids, k)`` returning {book id: [(similar book id, score)]}, best first"""
+    engine = engine or (NUMPY if sparse is not None else PYTHON)
+    if engine == NUMPY:
+        if sparse is None:
+            raise ImportError('the numpy engine needs NumPy and SciPy')
+        return _similar_numpy(features)
+    return _similar_python(features)
+
+
+def changed_books(since):
+    """Books whose features may have changed since ``since``"""
+    # a change of genres touches updated_at, see catalog/signals.py; loans touch the copies
+    changed = Book.objects.filter(Q(updated_at__gt=since) | Q(bookinstance__updated_at__gt=since))
+    return set(changed.values_list('pk', flat=True).distinct())
+
+
+def affected_books(changed, features):
+    """Books whose list of recommendations may change because ``changed`` did"""
+    affected = set(changed)
+    changed_features = {feature for pk in changed for feature in features.get(pk, ())}
+    affected.update(pk for pk, vector in features.items() if not changed_features.isdisjoint(vector))
+    changed = list(changed)
+    for start in range(0, len(changed), BLOCK_SIZE):
+        listing = BookRecommendation.objects.filter(recommended_id__in=changed[start:start + BLOCK_SIZE])
+        affected.update(listing.values_list('book_id', flat=True))
+    # deleted books have no features
+    return affected & features.keys()
+
+
+def save(results):
+    """Replace the recommendations of the books of ``results``"""
+    with transaction.atomic():
+        BookRecommendation.objects.filter(book_id__in=list(results)).delete()
+        BookRecommendation.objects.bulk_create([
+            BookRecommendation(book_id=pk, recommended_id=other, rank=rank, score=score)
+            for pk, similar in results.items()
+            for rank, (other, score) in enumerate(similar, 1)
+        ])
+        # the recommendations are part of the cached content block of the book page
+        caching.invalidate_on_commit(fragments.invalidate, 'book', list(results))
+    return sum(len(similar) for similar in results.values())
+
+
+def process(full=False, k=TOP_K, engine=None, log=None):
+    """Recompute the recommendations of the books that may have changed, or of every book.
+
+    Returns the counts of the run and its throughput.
+    """
+    log = log or (lambda message: None)
+    start = time.perf_counter()
+    # changes made while the run reads the catalog are picked up by the next one
+    started_at = timezone.now()
+    since = None if full else load_checkpoint()
+    features = book_features()
+    if since is None:
+        targets = sorted(features)
+    else:
+        targets = sorted(affected_books(changed_books(since), features))
+    engine = engine or (NUMPY if sparse is not None else PYTHON)
+    similar = similarity_function(features, engine) if targets else None
+    result = {'engine': engine, 'books': len(features), 'recomputed': 0, 'rows': 0}
+    for offset in range(0, len(targets), BLOCK_SIZE):
+        block = targets[offset:offset + BLOCK_SIZE]
+        result['rows'] += save(similar(block, k))
+        result['recomputed'] += len(block)
+        log(f'{result["recomputed"]}/{len(targets)} books')
+    save_checkpoint(started_at)
+    elapsed = time.perf_counter() - start
+    result['seconds'] = elapsed
+    result['books_per_second'] = result['recomputed'] / elapsed if elapsed else 0
+    return result
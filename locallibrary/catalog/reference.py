@@ -0,0 +1,70 @@
+"""In-process cache of the small reference tables, Genre and Language.
+
+Each process keeps the rows in memory, sorted by lower case name, for the
+choices of the book form and the prefix search of the autocomplete endpoints.
+The signal receivers of catalog/signals.py bump the version of the table (the
+global 'genre' and 'language' versions of the fragment cache), and a process
+reloads its copy when the version changed, so a change made by another process
+is seen on its next request. That needs a fragment cache shared by every
+process: with a local-memory cache the other processes would never see the
+bump, the tables are then read from the database each time.
+"""
+import bisect
+import threading
+
+from . import fragments
+from .caching import is_shared
+from .models import Genre, Language
+
+MODELS = (Genre, Language)
+
+_lock = threading.Lock()
+# model -> (version, [(lower case name, pk, name)])
+_tables = {}
+
+
+def _kind(model):
+    return model._meta.model_name
+
+
+def _load(model):
+    return sorted((name.lower(), pk, name) for pk, name in model.objects.values_list('pk', 'name'))
+
+
+def rows(model):
+    """[(lower case name, pk, name)] of a reference table, sorted"""
+    if not is_shared(fragments.get_cache()):
+        return _load(model)
+    version = fragments.version(_kind(model))
+    with _lock:
+        cached = _tables.get(model)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    loaded = _load(model)
+    with _lock:
+        _tables[model] = (version, loaded)
+    return loaded
+
+
+def choices(model):
+    """(pk, name) of every row, in name order"""
+    return [(pk, name) for _, pk, name in rows(model)]
+
+
+def search(model, prefix, limit):
+    """(pk, name) of the rows whose name starts with ``prefix``, ignoring case"""
+    prefix = prefix.lower()
+    table = rows(model)
+    results = []
+    for lower_name, pk, name in table[bisect.bisect_left(table, (prefix,)):]:
+        if not lower_name.startswith(prefix) or len(results) >= limit:
+            break
+        results.append((pk, name))
+    return results
+
+
+def invalidate(model):
+    """Reload ``model`` everywhere, after changes that sent no signal (e.g. bulk_create)"""
+    fragments.invalidate(_kind(model))
+    with _lock:
+        _tables.pop(model, None)
@@ -0,0 +1,193 @@
+"""Read replicas for the catalog.
+
+ReplicaRouter sends the reads of the catalog models to the databases listed in
+settings.CATALOG_READ_REPLICAS. A replica is picked round-robin or by lowest
+measured query latency (settings.CATALOG_REPLICA_SELECTION) on the first read
+of a request, and serves the whole request so its pages are consistent.
+Everything else goes to the primary ('default'):
+- writes, and every catalog read that follows a catalog write in the same
+  request (read-your-writes), or in the same thread outside of a request;
+- reads in a transaction of the primary, and SELECT ... FOR UPDATE;
+- reads for CATALOG_REPLICA_PIN_SECONDS after a write of the same client, so
+  the page shown after a form redirects doesn't miss the change on a lagging
+  replica. ReplicaPinningMiddleware keeps that state in a cookie.
+
+Without replicas the router returns None and Django uses 'default' as usual.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PIN_COOKIE = 'catalog_primary'
+ROUND_ROBIN = 'round-robin'
+LEAST_LATENCY = 'least-latency'
+# weight of the last query in the latency average of a replica
+LATENCY_WEIGHT = 0.2
+
+
+class ReadState:
+    """Where the catalog reads of a request go"""
+
+    def __init__(self, primary=False):
+        self.primary = primary
+        self.replica = None
+        self.wrote = False
+
+
+_state = ContextVar('catalog_read_state', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'CATALOG_READ_REPLICAS', []))
+
+
+def current_state():
+    state = _state.get()
+    if state is None:
+        # outside of a request: one state for the thread
+        state = ReadState()
+        _state.set(state)
+    return state
+
+
+@contextmanager
+def read_scope(primary=False):
+    """A fresh ReadState for the duration of the block, e.g. a request"""
+    state = ReadState(primary)
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+class LatencyTracker:
+    """Moving average of the query duration of each database"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+
+    def record(self, alias, duration):
+        with self.lock:
+            previous = self.latencies.get(alias)
+            if previous is None:
+                self.latencies[alias] = duration
+            else:
+                self.latencies[alias] = previous + LATENCY_WEIGHT * (duration - previous)
+
+    def fastest(self, aliases):
+        with self.lock:
+            # a database not measured yet is tried first
+            return min(aliases, key=lambda alias: self.latencies.get(alias, 0.0))
+
+    def clear(self):
+        with self.lock:
+            self.latencies.clear()
+
+
+latency = LatencyTracker()
+
+
+class LatencyRecorder:
+    """Database execute wrapper feeding the latency tracker"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            latency.record(self.alias, time.perf_counter() - start)
+
+
+@receiver(connection_created)
+def measure_replica(sender, connection, **kwargs):
+    if connection.alias in replicas():
+        connection.execute_wrappers.append(LatencyRecorder(connection.alias))
+
+
+class ReplicaRouter:
+    """Catalog reads to the replicas, everything else to the primary"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cycles = {}
+
+    def select(self, aliases):
+        if getattr(settings, 'CATALOG_REPLICA_SELECTION', ROUND_ROBIN) == LEAST_LATENCY:
+            return latency.fastest(aliases)
+        with self.lock:
+            key = tuple(aliases)
+            if key not in self.cycles:
+                self.cycles[key] = itertools.cycle(aliases)
+            return next(self.cycles[key])
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or model._meta.app_label != 'catalog':
+            return None
+        state = current_state()
+        if state.primary or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        if state.replica not in aliases:
+            state.replica = self.select(aliases)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        if not replicas():
+            return None
+        # sessions and last_login are written all the time, only catalog writes pin
+        if model._meta.app_label == 'catalog':
+            state = current_state()
+            state.primary = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Read from the primary during and shortly after a write of the client"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pinned = PIN_COOKIE in request.COOKIES
+        with read_scope(primary=pinned) as state:
+            response = self.get_response(request)
+        return self.pin(response, state, pinned)
+
+    async def __acall__(self, request):
+        pinned = PIN_COOKIE in request.COOKIES
+        with read_scope(primary=pinned) as state:
+            response = await self.get_response(request)
+        return self.pin(response, state, pinned)
+
+    def pin(self, response, state, pinned):
+        if state.wrote and not pinned:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=getattr(settings, 'CATALOG_REPLICA_PIN_SECONDS', 5), httponly=True
+            )
+        return response
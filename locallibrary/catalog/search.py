@@ -0,0 +1,194 @@
+"""Full-text search over the books of the catalog.
+
+The search index lives next to the catalog tables:
+
+* SQLite: an FTS5 virtual table ``catalog_book_fts`` whose rowid is the book id,
+  ranked with bm25().
+* PostgreSQL: a ``catalog_book_search`` table holding a weighted tsvector per
+  book with a GIN index, ranked with ts_rank_cd().
+
+Other databases fall back to (slow) icontains lookups. The index tables are
+created by migration 0005 and kept up to date by the receivers in
+catalog/signals.py.
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Q
+
+from .models import Book
+
+FTS_TABLE = 'catalog_book_fts'
+TSVECTOR_TABLE = 'catalog_book_search'
+SEARCH_CONFIG = 'english'
+
+
+def backend_for(conn=None):
+    """The name of the search backend used on the connection"""
+    vendor = (conn or connection).vendor
+    if vendor in ('sqlite', 'postgresql'):
+        return vendor
+    return 'fallback'
+
+
+def _documents(book_ids, using=DEFAULT_DB_ALIAS):
+    """Yield (book id, title, summary, isbn, authors, genres) for the books"""
+    books = (
+        Book.objects.using(using).filter(pk__in=book_ids)
+        .select_related('author')
+        .prefetch_related('genre')
+    )
+    for book in books:
+        author = ''
+        if book.author_id:
+            author = f'{book.author.first_name} {book.author.last_name}'
+        genres = ' '.join(genre.name for genre in book.genre.all())
+        yield (book.pk, book.title, book.summary, book.isbn, author, genres)
+
+
+def index_books(book_ids, using=None):
+    """(Re)index the given books, and drop the ones that no longer exist"""
+    book_ids = list(book_ids)
+    if not book_ids:
+        return
+    using = using or DEFAULT_DB_ALIAS
+    conn = connections[using]
+    backend = backend_for(conn)
+    if backend == 'fallback':
+        return
+    documents = list(_documents(book_ids, using))
+    placeholders = ', '.join(['%s'] * len(book_ids))
+    with conn.cursor() as cursor:
+        if backend == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', book_ids)
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, summary, isbn, authors, genres) '
+                'VALUES (%s, %s, %s, %s, %s, %s)',
+                documents
+            )
+        else:
+            cursor.execute(f'DELETE FROM {TSVECTOR_TABLE} WHERE book_id IN ({placeholders})', book_ids)
+            cursor.executemany(
+                f'INSERT INTO {TSVECTOR_TABLE} (book_id, document) VALUES (%s, '
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', %s), 'A') || "
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', %s), 'D') || "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'B') || "
+                f"setweight(to_tsvector('{SEARCH_CONFIG}', %s), 'C'))",
+                documents
+            )
+
+
+def unindex_books(book_ids, using=None):
+    book_ids = list(book_ids)
+    conn = connections[using or DEFAULT_DB_ALIAS]
+    backend = backend_for(conn)
+    if not book_ids or backend == 'fallback':
+        return
+    placeholders = ', '.join(['%s'] * len(book_ids))
+    table, column = (FTS_TABLE, 'rowid') if backend == 'sqlite' else (TSVECTOR_TABLE, 'book_id')
+    with conn.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', book_ids)
+
+
+def rebuild_index(batch_size=1000, using=None):
+    """Index every book, ``batch_size`` books at a time"""
+    using = using or DEFAULT_DB_ALIAS
+    count = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Book.objects.using(using).filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return count
+        index_books(ids, using)
+        count += len(ids)
+        last_id = ids[-1]
+
+
+def _terms(query):
+    return re.findall(r'\w+', query)
+
+
+def _fts_query(query):
+    # every word must match, as a prefix; quoting keeps FTS5 operators out
+    return ' '.join(f'"{term}"*' for term in _terms(query))
+
+
+class SearchResults:
+    """Lazy, ranked search results usable with django.core.paginator.Paginator"""
+    model = Book
+
+    def __init__(self, query, using=None):
+        self.query = query.strip()
+        self.using = using or DEFAULT_DB_ALIAS
+        self.connection = connections[self.using]
+        self.backend = backend_for(self.connection)
+        self._count = None
+
+    def _fallback_queryset(self):
+        condition = Q()
+        for term in _terms(self.query):
+            condition &= (
+                Q(title__icontains=term) | Q(summary__icontains=term) | Q(isbn__icontains=term)
+                | Q(author__first_name__icontains=term) | Q(author__last_name__icontains=term)
+                | Q(genre__name__icontains=term)
+            )
+        return Book.objects.using(self.using).filter(condition).distinct().order_by('title', 'id')
+
+    def _sql(self):
+        if self.backend == 'sqlite':
+            return (
+                f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+                [_fts_query(self.query)],
+                'rowid',
+                f'bm25({FTS_TABLE}, 10.0, 1.0, 10.0, 5.0, 2.0), rowid',
+            )
+        return (
+            f"FROM {TSVECTOR_TABLE}, websearch_to_tsquery('{SEARCH_CONFIG}', %s) query WHERE document @@ query",
+            [self.query],
+            'book_id',
+            'ts_rank_cd(document, query) DESC, book_id',
+        )
+
+    def count(self):
+        if self._count is None:
+            if not _terms(self.query):
+                self._count = 0
+            elif self.backend == 'fallback':
+                self._count = self._fallback_queryset().count()
+            else:
+                from_sql, params, _, _ = self._sql()
+                with self.connection.cursor() as cursor:
+                    cursor.execute(f'SELECT COUNT(*) {from_sql}', params)
+                    self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if not _terms(self.query) or (stop is not None and stop <= start):
+            return []
+        if self.backend == 'fallback':
+            return list(self._fallback_queryset()[start:stop])
+
+        from_sql, params, id_column, order_by = self._sql()
+        limit = -1 if stop is None else stop - start
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT {id_column} {from_sql} ORDER BY {order_by} LIMIT %s OFFSET %s',
+                params + [limit if limit >= 0 else 2 ** 62, start]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        books = Book.objects.using(self.using).select_related('author').in_bulk(ids)
+        return [books[book_id] for book_id in ids if book_id in books]
+
+
+def search_books(query, using=None):
+    """Search the title, summary, ISBN, author names and genres of the books"""
+    return SearchResults(query, using)
@@ -0,0 +1,243 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.utils import timezone
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import availability, caching, circulation, fragments, permissions, reference, search, stats
+from .models import Author, Book, BookInstance, Genre, Language, LoanEvent
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(m2m_changed, sender=Book.genre.through)
+def refresh_catalog_stats(sender, **kwargs):
+    """Drop the cached home page statistics when the catalog changes"""
+    if kwargs.get('action', 'post_').startswith('pre_'):
+        return
+    caching.invalidate_on_commit(stats.invalidate_stats)
+
+
+# Full-text search index (catalog/search.py)
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        search.index_books([instance.pk], using)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, using=None, **kwargs):
+    search.unindex_books([instance.pk], using)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def index_book_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # the books of the genre are unknown once the clear is done
+        instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        search.index_books([instance.pk])
+    elif action == 'post_clear':
+        search.index_books(getattr(instance, '_search_book_ids', []))
+    else:
+        search.index_books(pk_set or [])
+
+
+@receiver(post_save, sender=Author)
+def index_author_books(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.index_books(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+def index_genre_books(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.index_books(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Genre)
+def collect_genre_books(sender, instance, **kwargs):
+    instance._search_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def index_deleted_genre_books(sender, instance, **kwargs):
+    search.index_books(getattr(instance, '_search_book_ids', []))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def touch_book_genres(sender, instance, action, reverse, pk_set, **kwargs):
+    # the genres are part of the book: for its Last-Modified, and for the
+    # incremental runs of the recommendations (catalog/recommendations.py)
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        book_ids = [instance.pk]
+    elif action == 'post_clear':
+        book_ids = getattr(instance, '_search_book_ids', [])
+    else:
+        book_ids = pk_set or []
+    Book.objects.filter(pk__in=book_ids).update(updated_at=timezone.now())
+
+
+# Fragment cache of the book and author pages (catalog/fragments.py)
+
+def _book_author_ids(book_ids):
+    return set(Book.objects.filter(pk__in=book_ids).values_list('author_id', flat=True))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_fragments(sender, instance, **kwargs):
+    caching.invalidate_on_commit(fragments.invalidate, 'book', [instance.pk])
+    # the author page lists the books; the book may also have moved from another author
+    author_ids = {instance.author_id, getattr(instance, '_fragment_author_id', None)}
+    caching.invalidate_on_commit(fragments.invalidate, 'author', list(author_ids))
+
+
+@receiver(pre_save, sender=Book)
+def remember_book_author(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._fragment_author_id = Book.objects.filter(pk=instance.pk).values_list('author_id', flat=True).first()
+
+
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+def invalidate_copy_fragments(sender, instance, **kwargs):
+    # copies are listed on the book page and counted on the author page
+    caching.invalidate_on_commit(fragments.invalidate, 'book', [instance.book_id])
+    caching.invalidate_on_commit(fragments.invalidate, 'author', list(_book_author_ids([instance.book_id])))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def invalidate_genre_fragments(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        caching.invalidate_on_commit(fragments.invalidate, 'book', [instance.pk])
+    elif pk_set:
+        caching.invalidate_on_commit(fragments.invalidate, 'book', list(pk_set))
+    else:
+        # genre.book_set.clear(), the books are unknown
+        caching.invalidate_on_commit(fragments.invalidate, 'genre')
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(post_save, sender=Language)
+@receiver(post_delete, sender=Language)
+def invalidate_reference_data(sender, **kwargs):
+    # the version of the book fragments and of the in-process tables of catalog/reference.py
+    caching.invalidate_on_commit(reference.invalidate, sender)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def invalidate_author_fragments(sender, instance, **kwargs):
+    caching.invalidate_on_commit(fragments.invalidate, 'author', [instance.pk])
+    # book pages show the author name
+    book_ids = list(instance.book_set.values_list('pk', flat=True)) if instance.pk else []
+    caching.invalidate_on_commit(fragments.invalidate, 'book', book_ids)
+
+
+# Copy counters of Book (catalog/availability.py) and loan history (catalog/circulation.py)
+
+@receiver(pre_save, sender=BookInstance)
+def remember_copy_status(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding:
+        # from the database, the instance may have been loaded long ago
+        instance._availability_old = (
+            BookInstance.objects.filter(pk=instance.pk)
+            .values_list('book_id', 'status', 'borrower_id', 'due_back').first()
+        )
+
+
+@receiver(post_save, sender=BookInstance)
+def count_saved_copy(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    moves = [(instance.book_id, None, instance.status)]
+    old = None if created else getattr(instance, '_availability_old', None)
+    if old is not None:
+        moves.append((old[0], old[1], None))
+    availability.apply_moves(moves)
+
+
+@receiver(post_save, sender=BookInstance)
+def log_saved_copy(sender, instance, created, raw=False, **kwargs):
+    # loans made by saving the copy, e.g. in the admin; the loan operations of
+    # catalog/loans.py use QuerySet.update() and log their events themselves
+    if raw:
+        return
+    old = None if created else getattr(instance, '_availability_old', None)
+    # loans.renew_copy() renews, even to the same due date
+    renewed = instance.__dict__.pop('_loan_renewed', False)
+    was_on_loan = old is not None and old[1] == 'o'
+    copy = (instance.pk, instance.book_id, instance.borrower_id, instance.due_back)
+    if was_on_loan and (instance.status != 'o' or instance.borrower_id != old[2]):
+        circulation.record(LoanEvent.RETURN, [(instance.pk, old[0], old[2], old[3])])
+        was_on_loan = False
+    if instance.status == 'o' and not was_on_loan:
+        circulation.record(LoanEvent.CHECKOUT, [copy])
+    elif instance.status == 'o' and (renewed or instance.due_back != old[3]):
+        circulation.record(LoanEvent.RENEW, [copy])
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_deleted_copy(sender, instance, **kwargs):
+    availability.apply_moves([(instance.book_id, instance.status, None)])
+
+
+# Cached permissions of the users (catalog/permissions.py)
+
+def _invalidate_permissions(user_pks=None):
+    if user_pks is None:
+        caching.invalidate_on_commit(permissions.invalidate_all)
+    else:
+        caching.invalidate_on_commit(permissions.invalidate, list(user_pks))
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        _invalidate_permissions([instance.pk])
+    elif pk_set:
+        _invalidate_permissions(list(pk_set))
+    else:
+        # permission.user_set.clear() or group.user_set.clear(), the users are unknown
+        _invalidate_permissions()
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user_permissions(sender, instance, raw=False, update_fields=None, **kwargs):
+    # is_superuser and is_active change the permissions; a login only saves last_login
+    if not raw and set(update_fields or ()) != {'last_login'}:
+        _invalidate_permissions([instance.pk])
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action.startswith('post_'):
+        _invalidate_permissions()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def invalidate_all_permissions(sender, **kwargs):
+    # deleting cascades to the m2m rows without m2m_changed; superusers have every permission
+    _invalidate_permissions()
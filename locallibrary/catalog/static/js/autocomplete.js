@@ -0,0 +1,25 @@
+// Suggestions for the AutocompleteSelect widget (catalog/forms.py): the visible
+// input searches the endpoint, the hidden input holds the id of the choice.
+document.addEventListener('DOMContentLoaded', () => {
+    document.querySelectorAll('input[data-autocomplete]').forEach((input) => {
+        const target = document.getElementById(input.dataset.target);
+        const choices = document.getElementById(input.getAttribute('list'));
+        let results = [];
+        let timer = null;
+
+        const search = async () => {
+            const response = await fetch(`${input.dataset.autocomplete}?q=${encodeURIComponent(input.value)}`);
+            results = (await response.json()).results;
+            choices.replaceChildren(...results.map((result) => new Option(result.text)));
+        };
+
+        input.addEventListener('input', () => {
+            const chosen = results.find((result) => result.text === input.value);
+            target.value = chosen ? chosen.id : '';
+            clearTimeout(timer);
+            if (!chosen && input.value.trim()) {
+                timer = setTimeout(search, 200);
+            }
+        });
+    });
+});
@@ -0,0 +1,147 @@
+"""Cached catalog statistics for the home page.
+
+All counters are computed with a single SELECT made of scalar sub-queries and
+kept in the cache named by ``settings.CATALOG_STATS_CACHE`` (the 'default'
+local-memory cache unless configured otherwise). Model signals drop the cached
+value whenever the catalog changes, see catalog/signals.py. With a local-memory
+cache only the process that made the change drops it, the others show the old
+counts until ``settings.CATALOG_STATS_TIMEOUT`` expires them.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+
+from .conditional import aggregate_sql
+from .models import Author, Book, Genre
+
+STATS_CACHE_KEY = 'catalog:stats'
+DEFAULT_TIMEOUT = 300
+FANTASY_GENRE = 'fantasy'
+
+_counters_lock = threading.Lock()
+_counters = {
+    'hits': 0,
+    'misses': 0,
+    'rebuilds': 0,
+    'rebuild_time': 0.0,
+    'last_rebuild_time': 0.0,
+}
+
+
+def get_cache():
+    """Return the cache backend used to store the statistics"""
+    return caches[getattr(settings, 'CATALOG_STATS_CACHE', 'default')]
+
+
+def _bump(name, value=1):
+    with _counters_lock:
+        _counters[name] += value
+
+
+def fantasy_books():
+    """Books with a genre matching FANTASY_GENRE"""
+    return Book.objects.filter(genre__name__icontains=FANTASY_GENRE).distinct()
+
+
+def _count_sql(queryset):
+    # wrap the queryset so that COUNT(*) also works for DISTINCT querysets
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    return f'(SELECT COUNT(*) FROM ({sql}) AS subquery)', params
+
+
+def _sum_sql(field):
+    # copies are counted by the counters of Book, see catalog/availability.py
+    sql, params = aggregate_sql(Book.objects.all(), 'SUM', field)
+    return f'COALESCE({sql}, 0)', params
+
+
+def compute_stats():
+    """Compute every counter of the home page with one database query"""
+    counters = {
+        'num_books': _count_sql(Book.objects.all()),
+        'num_instances': _sum_sql('copies_total'),
+        'num_instances_available': _sum_sql('copies_available'),
+        'num_genres': _count_sql(Genre.objects.all()),
+        'num_authors': _count_sql(Author.objects.all()),
+        'fantasy_books_count': _count_sql(fantasy_books()),
+    }
+    columns, params = [], []
+    for sql, sql_params in counters.values():
+        columns.append(sql)
+        params.extend(sql_params)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT ' + ', '.join(columns), params)
+        row = cursor.fetchone()
+    return dict(zip(counters, row))
+
+
+def _store_stats(stats, start):
+    get_cache().set(STATS_CACHE_KEY, stats, getattr(settings, 'CATALOG_STATS_TIMEOUT', DEFAULT_TIMEOUT))
+    elapsed = time.perf_counter() - start
+    with _counters_lock:
+        _counters['rebuilds'] += 1
+        _counters['rebuild_time'] += elapsed
+        _counters['last_rebuild_time'] = elapsed
+    return stats
+
+
+def _fantasy_list():
+    return fantasy_books().order_by('title').values('id', 'title')
+
+
+def rebuild_stats():
+    """Recompute the statistics and store them in the cache"""
+    start = time.perf_counter()
+    stats = compute_stats()
+    stats['fantasy_books'] = list(_fantasy_list())
+    return _store_stats(stats, start)
+
+
+def get_stats():
+    """Return the cached statistics, rebuilding them on a cache miss"""
+    stats = get_cache().get(STATS_CACHE_KEY)
+    if stats is None:
+        _bump('misses')
+        return rebuild_stats()
+    _bump('hits')
+    return stats
+
+
+async def arebuild_stats():
+    """rebuild_stats() for async views.
+
+    Both queries go to the thread of the sync ORM code anyway, one after the
+    other, so they run in a single trip to that thread.
+    """
+    return await sync_to_async(rebuild_stats)()
+
+
+async def aget_stats():
+    stats = await get_cache().aget(STATS_CACHE_KEY)
+    if stats is None:
+        _bump('misses')
+        return await arebuild_stats()
+    _bump('hits')
+    return stats
+
+
+def invalidate_stats(**kwargs):
+    """Drop the cached statistics, they are rebuilt on the next read"""
+    get_cache().delete(STATS_CACHE_KEY)
+
+
+def cache_stats():
+    """Hit/miss and rebuild time counters of the statistics cache"""
+    with _counters_lock:
+        return dict(_counters)
+
+
+def reset_cache_stats():
+    with _counters_lock:
+        for name in _counters:
+            _counters[name] = 0
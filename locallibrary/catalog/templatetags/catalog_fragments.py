@@ -0,0 +1,44 @@
+from django import template
+
+from catalog import fragments
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, kind, pk, cached, key):
+        self.nodelist = nodelist
+        self.kind = kind
+        self.pk = pk
+        self.cached = cached
+        self.key = key
+
+    def render(self, context):
+        if self.cached is not None:
+            # already looked up by the view, before it read the page data
+            key, html = self.key.resolve(context), self.cached.resolve(context)
+        else:
+            key, html = fragments.lookup(self.kind.resolve(context), self.pk.resolve(context))
+        if html is None:
+            html = self.nodelist.render(context)
+            fragments.set_fragment(key, html)
+        return html
+
+
+@register.tag
+def fragmentcache(parser, token):
+    """Cache the enclosed block for a book or author, see catalog/fragments.py
+
+    {% fragmentcache 'book' book.pk [cached_html key] %} ... {% endfragmentcache %}
+
+    cached_html and key come from fragments.lookup() in the view.
+    """
+    bits = token.split_contents()
+    if len(bits) not in (3, 5):
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' takes a kind, a primary key and optionally the cached value and its key"
+        )
+    nodelist = parser.parse(('endfragmentcache',))
+    parser.delete_first_token()
+    cached, key = [parser.compile_filter(bit) for bit in bits[3:]] or [None, None]
+    return FragmentCacheNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]), cached, key)
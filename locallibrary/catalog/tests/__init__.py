@@ -1,3 +1,23 @@
 from .test_models import *
 from .test_forms import *
 from .test_views import *
+from .test_stats import *
+from .test_pagination import *
+from .test_commands import *
+from .test_search import *
+from .test_loans import *
+from .test_instrumentation import *
+from .test_fragments import *
+from .test_conditional import *
+from .test_availability import *
+from .test_routers import *
+from .test_async_views import *
+from .test_visits import *
+from .test_api import *
+from .test_admin import *
+from .test_overdue import *
+from .test_autocomplete import *
+from .test_permissions import *
+from .test_database import *
+from .test_recommendations import *
+from .test_circulation import *
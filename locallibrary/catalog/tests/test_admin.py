@@ -0,0 +1,145 @@
+import datetime
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.pagination import EstimatedCountPaginator, estimate_count
+
+User = get_user_model()
+
+
+class AdminChangelistTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='3Kq1vRV0Z&3iD')
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.genres = [Genre.objects.create(name=name) for name in ('Fantasy', 'Science fiction', 'Poetry')]
+        cls.language = Language.objects.create(name='English')
+        cls.book = cls.add_books(1)[0]
+
+    @classmethod
+    def add_books(cls, count, copies=2):
+        books = []
+        for number in range(count):
+            book = Book.objects.create(
+                title=f'Book {Book.objects.count()}', summary='-', isbn=f'97800000{Book.objects.count():05d}',
+                author=cls.author, language=cls.language
+            )
+            book.genre.set(cls.genres)
+            for _ in range(copies):
+                BookInstance.objects.create(book=book, imprint='Parnassus', status='o', borrower=cls.admin)
+            books.append(book)
+        return books
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_dont_query_per_row(self):
+        urls = [reverse('admin:catalog_book_changelist'), reverse('admin:catalog_bookinstance_changelist')]
+        before = [self.count_queries(url) for url in urls]
+        self.add_books(5)
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+
+    def test_book_changelist_shows_genres_and_counters(self):
+        response = self.client.get(reverse('admin:catalog_book_changelist'))
+        self.assertContains(response, 'Fantasy, Science fiction')
+        self.assertContains(response, '<td class="field-copies_total">2</td>', html=True)
+
+    def test_paginated_inline(self):
+        BookInstance.objects.bulk_create([
+            BookInstance(book=self.book, imprint=f'Imprint {number}', status='a') for number in range(25)
+        ])
+        url = reverse('admin:catalog_book_change', args=[self.book.pk])
+        response = self.client.get(url)
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(formset.initial_form_count(), 20)
+        self.assertContains(response, '27 book instances')
+        self.assertContains(response, '?bookinstance_page=2')
+        response = self.client.get(url, {'bookinstance_page': 2})
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(formset.initial_form_count(), 7)
+        self.assertEqual(formset.page.number, 2)
+
+    def test_author_inline_uses_autocomplete(self):
+        response = self.client.get(reverse('admin:catalog_author_change', args=[self.author.pk]))
+        self.assertContains(response, 'admin-autocomplete')
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'term': 'fan', 'app_label': 'catalog', 'model_name': 'book', 'field_name': 'genre',
+        })
+        self.assertEqual([result['text'] for result in response.json()['results']], ['Fantasy'])
+
+
+class EstimatedCountTest(TestCase):
+    def test_estimate(self):
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        Author.objects.create(first_name='Iain', last_name='Banks')
+        self.assertGreaterEqual(estimate_count(Author.objects.all()), 2)
+        self.assertIsNone(estimate_count(Author.objects.filter(pk=author.pk)))
+
+        estimate = estimate_count(Author.objects.all())
+        paginator = EstimatedCountPaginator(Author.objects.order_by('pk'), 10)
+        paginator.exact_count_limit = 0
+        # SQLite first looks for the statistics of ANALYZE
+        with self.assertNumQueries(2 if connection.vendor == 'sqlite' else 1):
+            self.assertEqual(paginator.count, estimate)
+        # filtered lists and small tables are counted exactly
+        self.assertEqual(EstimatedCountPaginator(Author.objects.filter(pk=author.pk), 10).count, 1)
+        self.assertEqual(EstimatedCountPaginator(Author.objects.all(), 10).count, 2)
+
+    def test_estimate_after_delete(self):
+        authors = Author.objects.bulk_create(Author(first_name='Author', last_name=str(number)) for number in range(30))
+        Author.objects.filter(pk__in=[author.pk for author in authors[:-1]]).delete()
+        paginator = EstimatedCountPaginator(Author.objects.order_by('pk'), 10)
+        paginator.exact_count_limit = 5
+        # MAX(rowid) still says 30
+        self.assertEqual(paginator.count, 1)
+        self.assertEqual(paginator.num_pages, 1)
+
+    def test_sqlite_statistics(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        Author.objects.bulk_create(Author(first_name='Author', last_name=str(number)) for number in range(30))
+        Author.objects.filter(last_name__gte='2').delete()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE catalog_author')
+        self.assertEqual(estimate_count(Author.objects.all()), Author.objects.count())
+
+
+class BookInstanceActionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='3Kq1vRV0Z&3iD')
+        book = Book.objects.create(title='Loaned book', summary='-', isbn='9780000000001')
+        cls.copies = [
+            BookInstance.objects.create(book=book, imprint='Parnassus', status='o', borrower=cls.admin)
+            for _ in range(2)
+        ]
+
+    def renew(self, renewal_date):
+        self.client.force_login(self.admin)
+        return self.client.post(reverse('admin:catalog_bookinstance_changelist'), {
+            'action': 'renew_copies',
+            '_selected_action': [copy.pk for copy in self.copies],
+            'renewal_date': renewal_date,
+        }, follow=True)
+
+    def test_renew_until_the_chosen_date(self):
+        due_back = datetime.date.today() + datetime.timedelta(days=10)
+        response = self.renew(due_back)
+        self.assertContains(response, '2 renewed')
+        self.assertEqual(BookInstance.objects.filter(due_back=due_back).count(), 2)
+
+    def test_renewal_date_is_validated(self):
+        response = self.renew(datetime.date.today() + datetime.timedelta(weeks=5))
+        self.assertContains(response, 'Invalid date - renewal more than 4 weeks ahead')
+        response = self.renew('')
+        self.assertContains(response, 'This field is required.')
+        self.assertFalse(BookInstance.objects.exclude(due_back=None).exists())
@@ -0,0 +1,108 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+User = get_user_model()
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        cls.science_fiction = Genre.objects.create(name='Science fiction')
+        cls.language = Language.objects.create(name='English')
+        cls.books = []
+        for number in range(5):
+            book = Book.objects.create(
+                title=f'Earthsea {number}', summary='Ged', isbn=f'978055338304{number}',
+                author=cls.author, language=cls.language if number else None
+            )
+            book.genre.add(cls.fantasy)
+            cls.books.append(book)
+        cls.books[0].genre.add(cls.science_fiction)
+        cls.copy = BookInstance.objects.create(book=cls.books[0], imprint='Parnassus', status='o',
+                                               borrower=cls.reader)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        return response, response.json()
+
+    def test_root(self):
+        response, data = self.get(reverse('api'))
+        self.assertEqual(data['books'], reverse('api_list', args=['books']))
+
+    def test_book_list_with_sparse_fields(self):
+        with self.assertNumQueries(1):
+            response, data = self.get(reverse('api_list', args=['books']), fields='title,isbn', limit=2)
+        self.assertEqual(data['results'], [
+            {'id': self.books[0].pk, 'title': 'Earthsea 0', 'isbn': '9780553383040'},
+            {'id': self.books[1].pk, 'title': 'Earthsea 1', 'isbn': '9780553383041'},
+        ])
+        self.assertIsNone(data['previous'])
+
+        # the next page keeps the other parameters
+        response, data = self.get(data['next'])
+        self.assertEqual([book['title'] for book in data['results']], ['Earthsea 2', 'Earthsea 3'])
+        self.assertEqual(set(data['results'][0]), {'id', 'title', 'isbn'})
+        response, data = self.get(data['next'])
+        self.assertEqual([book['title'] for book in data['results']], ['Earthsea 4'])
+        self.assertIsNone(data['next'])
+        response, data = self.get(data['previous'])
+        self.assertEqual([book['title'] for book in data['results']], ['Earthsea 2', 'Earthsea 3'])
+
+    def test_book_includes(self):
+        # to-one relations are joined, each to-many relation is one more query
+        with self.assertNumQueries(2):
+            response, data = self.get(
+                reverse('api_list', args=['books']),
+                fields='title', include='author,language,genre', **{'fields[author]': 'last_name'}, limit=2,
+            )
+        first, second = data['results']
+        self.assertEqual(first['author'], {'id': self.author.pk, 'last_name': 'Le Guin'})
+        self.assertIsNone(first['language'])
+        self.assertEqual(second['language'], {'id': self.language.pk, 'name': 'English'})
+        self.assertEqual(first['genre'], [
+            {'id': self.fantasy.pk, 'name': 'Fantasy'},
+            {'id': self.science_fiction.pk, 'name': 'Science fiction'},
+        ])
+        self.assertEqual(second['genre'], [{'id': self.fantasy.pk, 'name': 'Fantasy'}])
+
+    def test_author_with_books(self):
+        response, data = self.get(reverse('api_detail', args=['authors', self.author.pk]),
+                                  include='books', **{'fields[books]': 'title'})
+        self.assertEqual(data['last_name'], 'Le Guin')
+        self.assertEqual([book['title'] for book in data['books']], [f'Earthsea {number}' for number in range(5)])
+
+    def test_detail(self):
+        response, data = self.get(reverse('api_detail', args=['books', self.books[1].pk]))
+        self.assertEqual(data['title'], 'Earthsea 1')
+        self.assertEqual(data['author'], self.author.pk)
+        self.assertIn('updated_at', data)
+        response, data = self.get(reverse('api_detail', args=['books', 0]))
+        self.assertEqual(response.status_code, 404)
+        response, data = self.get(reverse('api_detail', args=['books', 'abc']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_copies_need_a_login(self):
+        response, data = self.get(reverse('api_list', args=['copies']))
+        self.assertEqual(response.status_code, 401)
+        self.client.force_login(self.reader)
+        response, data = self.get(reverse('api_detail', args=['copies', self.copy.pk]), include='book',
+                                  **{'fields[book]': 'title'})
+        self.assertEqual(data['status'], 'o')
+        self.assertEqual(data['book'], {'id': self.books[0].pk, 'title': 'Earthsea 0'})
+        self.assertNotIn('borrower', data)
+
+    def test_bad_requests(self):
+        url = reverse('api_list', args=['books'])
+        for params in ({'fields': 'title,borrower'}, {'include': 'copies'}, {'fields[author]': 'x', 'include': 'author'},
+                       {'limit': '0'}, {'limit': 'many'}, {'cursor': 'nonsense'}):
+            response, data = self.get(url, **params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', data)
+        response, data = self.get(reverse('api_list', args=['users']))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.post(url).status_code, 405)
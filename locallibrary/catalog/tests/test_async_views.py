@@ -0,0 +1,112 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.test import TestCase, override_settings
+from django.urls import resolve, reverse
+from catalog import async_views, fragments
+from catalog.benchmark import use_async_views
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+User = get_user_model()
+
+
+class AsyncViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK', is_staff=True)
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='delete_author'))
+        cls.genre = Genre.objects.create(name='Fantasy')
+        cls.language = Language.objects.create(name='English')
+        for number in range(4):
+            book = Book.objects.create(
+                title=f'Earthsea {number}', summary='Ged', isbn=f'978055338304{number}',
+                author=cls.author, language=cls.language
+            )
+            book.genre.add(cls.genre)
+        cls.book = Book.objects.get(title='Earthsea 0')
+        BookInstance.objects.create(book=cls.book, imprint='Parnassus', status='a')
+        BookInstance.objects.create(book=cls.book, imprint='Parnassus', status='o')
+
+    def setUp(self):
+        fragments.get_cache().clear()
+        self.enterContext(use_async_views())
+
+    def test_urls_use_the_async_views(self):
+        self.assertIs(resolve(reverse('index')).func, async_views.index)
+        self.assertIs(resolve(reverse('books')).func.view_class, async_views.BookListView)
+
+    async def test_index_counts_visits(self):
+        response = await self.async_client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['num_books'], 4)
+        self.assertEqual(response.context['num_instances_available'], 1)
+        self.assertEqual(response.context['num_visits'], 1)
+        response = await self.async_client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 2)
+
+    async def test_book_list_pagination(self):
+        response = await self.async_client.get(reverse('books'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_paginated'])
+        self.assertEqual([book.title for book in response.context['book_list']],
+                         ['Earthsea 0', 'Earthsea 1', 'Earthsea 2'])
+        self.assertContains(response, '1/2 available')
+        response = await self.async_client.get(reverse('books') + '?page=2')
+        self.assertEqual(len(response.context['book_list']), 1)
+        response = await self.async_client.get(reverse('books') + '?page=9')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(CATALOG_CURSOR_PAGINATION=True)
+    async def test_book_list_cursor_pagination(self):
+        response = await self.async_client.get(reverse('books'))
+        page = response.context['page_obj']
+        self.assertTrue(response.context['is_cursor_paginated'])
+        response = await self.async_client.get(reverse('books') + '?cursor=' + page.next_cursor)
+        self.assertEqual([book.title for book in response.context['book_list']], ['Earthsea 3'])
+        response = await self.async_client.get(reverse('books') + '?cursor=nonsense')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_book_list_not_modified(self):
+        response = await self.async_client.get(reverse('books'))
+        self.assertIn('private', response['Cache-Control'])
+        response = await self.async_client.get(reverse('books'), headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_book_detail_requires_login(self):
+        url = reverse('book_detail', args=[self.book.pk])
+        response = await self.async_client.get(url)
+        self.assertRedirects(response, f'/accounts/login/?next={url}', fetch_redirect_response=False)
+
+    async def test_book_detail(self):
+        await self.async_client.aforce_login(self.reader)
+        url = reverse('book_detail', args=[self.book.pk])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Earthsea 0')
+        self.assertContains(response, 'Parnassus')
+        # the second request is served from the fragment cache
+        response = await self.async_client.get(url)
+        self.assertIsNotNone(response.context['fragment'])
+        self.assertContains(response, 'Parnassus')
+        response = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get(reverse('book_detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_authors(self):
+        response = await self.async_client.get(reverse('authors'))
+        self.assertContains(response, 'Le Guin')
+        response = await self.async_client.get(reverse('author_detail', args=[self.author.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Earthsea 3')
+
+    async def test_author_delete_link(self):
+        await self.async_client.aforce_login(self.librarian)
+        no_books = await Author.objects.acreate(first_name='Iain', last_name='Banks')
+        # the second request has the content block from the cache
+        for _ in range(2):
+            response = await self.async_client.get(reverse('author_detail', args=[no_books.pk]))
+            self.assertContains(response, reverse('author_delete', args=[no_books.pk]))
+            response = await self.async_client.get(reverse('author_detail', args=[self.author.pk]))
+            self.assertNotContains(response, reverse('author_delete', args=[self.author.pk]))
@@ -0,0 +1,125 @@
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from catalog import fragments, reference
+from catalog.autocomplete import author_queryset
+from catalog.forms import BookForm
+from catalog.management.commands.explain_catalog import uses_index
+from catalog.models import Author, Book, Genre, Language
+
+User = get_user_model()
+
+
+class AutocompleteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.le_guin = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.lem = Author.objects.create(first_name='Stanislaw', last_name='Lem')
+        Author.objects.create(first_name='Iain', last_name='Banks')
+        for name in ('Fantasy', 'Fairy tale', 'Science fiction'):
+            Genre.objects.create(name=name)
+        cls.english = Language.objects.create(name='English')
+        Language.objects.create(name='French')
+
+    def setUp(self):
+        fragments.get_cache().clear()
+
+    def search(self, kind, term, **params):
+        response = self.client.get(reverse('autocomplete', args=[kind]), {'q': term, **params})
+        return [result['text'] for result in response.json()['results']]
+
+    def test_authors(self):
+        self.assertEqual(self.search('author', 'le'), ['Le Guin, Ursula', 'Lem, Stanislaw'])
+        self.assertEqual(self.search('author', 'LEM'), ['Lem, Stanislaw'])
+        self.assertEqual(self.search('author', 'le', limit=1), ['Le Guin, Ursula'])
+        self.assertEqual(self.search('author', ''), [])
+        self.assertEqual(self.search('author', 'x'), [])
+
+    def test_author_search_uses_index(self):
+        plan = author_queryset('le')[:10].explain()
+        self.assertTrue(uses_index(plan), plan)
+        if connection.vendor == 'sqlite':
+            self.assertIn('author_last_name_lower_idx', plan)
+
+    def test_reference_tables(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name}
+        with override_settings(CACHES={**settings.CACHES, 'shared': shared}, CATALOG_FRAGMENT_CACHE='shared'):
+            self.assertEqual(self.search('genre', 'fa'), ['Fairy tale', 'Fantasy'])
+            self.assertEqual(self.search('language', 'FR'), ['French'])
+            # from memory once loaded
+            with self.assertNumQueries(0):
+                self.assertEqual(self.search('genre', 'sc'), ['Science fiction'])
+            # the signals reload the tables
+            Genre.objects.create(name='Fable')
+            self.assertEqual(self.search('genre', 'fa'), ['Fable', 'Fairy tale', 'Fantasy'])
+            Language.objects.filter(name='French').delete()
+            self.assertEqual(reference.choices(Language), [(self.english.pk, 'English')])
+
+    def test_reference_tables_without_shared_cache(self):
+        # the other processes wouldn't see the changes, nothing is kept in memory
+        self.assertEqual(self.search('genre', 'fa'), ['Fairy tale', 'Fantasy'])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search('genre', 'sc'), ['Science fiction'])
+        Genre.objects.filter(name='Fantasy').update(name='Fable')
+        self.assertEqual(self.search('genre', 'fa'), ['Fable', 'Fairy tale'])
+
+    def test_unknown_kind(self):
+        self.assertEqual(self.client.get(reverse('autocomplete', args=['user']), {'q': 'a'}).status_code, 404)
+
+
+class BookFormTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.set(Permission.objects.filter(codename__in=['add_book', 'change_book']))
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.genre = Genre.objects.create(name='Fantasy')
+        cls.language = Language.objects.create(name='English')
+
+    def setUp(self):
+        fragments.get_cache().clear()
+        self.client.force_login(self.librarian)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_form_cost_doesnt_grow_with_the_catalog(self):
+        url = reverse('book_create')
+        self.client.get(url)
+        before = self.count_queries(url)
+        Author.objects.bulk_create([Author(first_name='A', last_name=f'Author {number}') for number in range(30)])
+        self.assertEqual(self.count_queries(url), before)
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Author 1')
+        self.assertContains(response, 'js/autocomplete.js')
+        self.assertContains(response, reverse('autocomplete', args=['author']))
+        self.assertContains(response, '<option value="%d">Fantasy</option>' % self.genre.pk, html=True)
+
+    def test_create_and_update(self):
+        response = self.client.post(reverse('book_create'), {
+            'title': 'A Wizard of Earthsea', 'author': self.author.pk, 'summary': 'Ged', 'isbn': '9780553383041',
+            'genre': [self.genre.pk], 'language': self.language.pk,
+        })
+        book = Book.objects.get(isbn='9780553383041')
+        self.assertRedirects(response, book.get_absolute_url(), fetch_redirect_response=False)
+        self.assertEqual(list(book.genre.all()), [self.genre])
+        response = self.client.get(reverse('book_update', args=[book.pk]))
+        # the selected author is shown by name
+        self.assertContains(response, 'value="Le Guin, Ursula"')
+
+    def test_invalid_author(self):
+        form = BookForm(data={'title': 'x', 'author': 'abc', 'summary': 'x', 'isbn': '1', 'language': ''})
+        self.assertFalse(form.is_valid())
+        self.assertIn('author', form.errors)
+        self.assertIn('value="abc"', form.as_table())
@@ -0,0 +1,129 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+from django.urls import reverse
+from catalog import availability, loans
+from catalog.benchmark import generate_catalog
+from catalog.bulk import CatalogImporter
+from catalog.models import COPY_COUNTERS, Author, Book, BookInstance
+
+User = get_user_model()
+
+
+class AvailabilityCountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+
+    def setUp(self):
+        self.book = Book.objects.create(title='A Wizard of Earthsea', summary='Ged', isbn='9780553383041', author=self.author)
+        self.other = Book.objects.create(title='The Tombs of Atuan', summary='Tenar', isbn='9780689845369', author=self.author)
+
+    def counters(self, book):
+        return Book.objects.filter(pk=book.pk).values(*COPY_COUNTERS).get()
+
+    def assertCounters(self, book, total=0, available=0, on_loan=0, reserved=0, maintenance=0):
+        self.assertEqual(self.counters(book), {
+            'copies_total': total,
+            'copies_available': available,
+            'copies_on_loan': on_loan,
+            'copies_reserved': reserved,
+            'copies_maintenance': maintenance,
+        })
+
+    def test_save_and_delete(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Parnassus', status='a')
+        BookInstance.objects.create(book=self.book, imprint='Parnassus')
+        self.assertCounters(self.book, total=2, available=1, maintenance=1)
+
+        copy.status = 'o'
+        copy.save()
+        self.assertCounters(self.book, total=2, on_loan=1, maintenance=1)
+
+        copy.book = self.other
+        copy.save()
+        self.assertCounters(self.book, total=1, maintenance=1)
+        self.assertCounters(self.other, total=1, on_loan=1)
+
+        BookInstance.objects.filter(book=self.other).delete()
+        self.assertCounters(self.other)
+
+    def test_stale_instance(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Parnassus', status='a')
+        stale = BookInstance.objects.get(pk=copy.pk)
+        copy.status = 'r'
+        copy.save()
+        # the old status is read from the database, not from the instance
+        stale.status = 'm'
+        stale.save()
+        self.assertCounters(self.book, total=1, maintenance=1)
+
+    def test_saving_book_keeps_counters(self):
+        book = Book.objects.get(pk=self.book.pk)
+        BookInstance.objects.create(book=self.book, imprint='Parnassus', status='a')
+        book.title = 'Earthsea'
+        book.save()
+        self.assertCounters(self.book, total=1, available=1)
+
+    def test_saving_deleted_book(self):
+        book = Book.objects.create(title='Tehanu', summary='Tenar', isbn='9780689316954')
+        Book.objects.filter(pk=book.pk).delete()
+        # inserted again, like a full save
+        book.title = 'Tehanu: The Last Book of Earthsea'
+        book.save()
+        self.assertEqual(Book.objects.get(pk=book.pk).title, 'Tehanu: The Last Book of Earthsea')
+
+        book.isbn = self.book.isbn
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            book.save()
+
+    def test_loan_operations(self):
+        copies = [BookInstance.objects.create(book=self.book, imprint='Parnassus', status='a') for _ in range(3)]
+        loans.reserve(self.book, self.reader)
+        self.assertCounters(self.book, total=3, available=2, reserved=1)
+        loans.checkout(self.book, self.reader)
+        loans.checkout(self.book, self.reader)
+        self.assertCounters(self.book, total=3, available=1, on_loan=2)
+
+        on_loan = BookInstance.objects.filter(status='o').values_list('pk', flat=True)
+        loans.bulk_renew(on_loan, datetime.date.today())
+        self.assertCounters(self.book, total=3, available=1, on_loan=2)
+        loans.bulk_return([copies[0].pk, *on_loan])
+        self.assertCounters(self.book, total=3, available=3)
+
+        loans.reserve(self.book, self.reader)
+        loans.return_copy(BookInstance.objects.get(status='r').pk)
+        self.assertCounters(self.book, total=3, available=3)
+
+    def test_bulk_paths(self):
+        CatalogImporter(default_status='a').run([{
+            'title': 'Dune', 'isbn': '9780441172719', 'author_last_name': 'Herbert', 'copies': 2,
+        }])
+        self.assertCounters(Book.objects.get(isbn='9780441172719'), total=2, available=2)
+        generate_catalog(20, batch_size=7, index_search=False)
+        self.assertEqual(availability.recount(repair=False), [])
+
+    def test_recount_command(self):
+        BookInstance.objects.create(book=self.book, imprint='Parnassus', status='a')
+        Book.objects.filter(pk=self.book.pk).update(copies_available=5, copies_total=0)
+
+        out = StringIO()
+        call_command('recount_availability', dry_run=True, stdout=out)
+        self.assertIn('1 books with wrong counters', out.getvalue())
+        self.assertCounters(self.book, total=0, available=5)
+
+        call_command('recount_availability', batch_size=1, stdout=out)
+        self.assertIn('Repaired the counters of 1 books', out.getvalue())
+        self.assertCounters(self.book, total=1, available=1)
+        self.assertEqual(availability.recount(), [])
+
+    def test_book_list_shows_availability(self):
+        BookInstance.objects.create(book=self.book, imprint='Parnassus', status='a')
+        BookInstance.objects.create(book=self.book, imprint='Parnassus', status='o')
+        response = self.client.get(reverse('books'))
+        self.assertContains(response, '1/2 available')
@@ -0,0 +1,231 @@
+import datetime
+import uuid
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from catalog import circulation, loans
+from catalog.management.commands.explain_catalog import uses_index
+from catalog.models import (
+    Book, BookCirculationDay, BookInstance, CirculationDay, Genre, GenreCirculationDay, LoanEvent,
+)
+
+User = get_user_model()
+
+
+class LoanHistoryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK', is_staff=True)
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.reader = User.objects.create_user(username='reader', password='2HJ1vRV0Z&3iD')
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        cls.poetry = Genre.objects.create(name='Poetry')
+        cls.book = Book.objects.create(title='Loaned book', summary='Summary', isbn='1234567890123')
+        cls.book.genre.add(cls.fantasy, cls.poetry)
+        cls.other = Book.objects.create(title='Other book', summary='Summary', isbn='1234567890124')
+        cls.other.genre.add(cls.fantasy)
+        for book in (cls.book, cls.book, cls.other):
+            BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+
+    def events(self):
+        return list(LoanEvent.objects.order_by('id').values_list('kind', 'book_id', 'borrower_id'))
+
+    def test_loans_are_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = loans.checkout(self.book, self.reader)
+        due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            loans.renew_copy(copy, due_back)
+        with self.captureOnCommitCallbacks(execute=True):
+            loans.return_copy(copy.pk)
+        book, reader = self.book.pk, self.reader.pk
+        self.assertEqual(self.events(), [
+            (LoanEvent.CHECKOUT, book, reader), (LoanEvent.RENEW, book, reader), (LoanEvent.RETURN, book, reader),
+        ])
+        self.assertEqual(LoanEvent.objects.get(kind=LoanEvent.RENEW).due_back, due_back)
+        self.assertEqual(LoanEvent.objects.filter(copy_id=copy.pk).count(), 3)
+
+    def test_reservations_are_not_loans(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = loans.reserve(self.book, self.reader)
+            loans.return_copy(copy.pk)
+        self.assertEqual(self.events(), [])
+
+    def test_bulk_loans_are_logged_in_one_insert(self):
+        copies = [loans.checkout(self.book, self.reader), loans.checkout(self.other, self.reader)]
+        due_back = datetime.date.today() + datetime.timedelta(weeks=2)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            loans.bulk_renew([copy.pk for copy in copies] + [copies[0].pk], due_back)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "catalog_loanevent"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(LoanEvent.objects.filter(kind=LoanEvent.RENEW, due_back=due_back).count(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            loans.bulk_return([copy.pk for copy in copies])
+        # returns keep the due date the copy had
+        self.assertEqual(LoanEvent.objects.filter(kind=LoanEvent.RETURN, due_back=due_back).count(), 2)
+
+    def test_rollback_logs_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    loans.checkout(self.book, self.reader)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(self.events(), [])
+
+    def test_copies_saved_elsewhere_are_logged(self):
+        # e.g. a librarian changing the copy in the admin
+        copy = BookInstance.objects.filter(book=self.book).first()
+        due_back = datetime.date.today() + datetime.timedelta(weeks=1)
+        copy.status, copy.borrower, copy.due_back = 'o', self.reader, due_back
+        copy.save()
+        copy.due_back = due_back + datetime.timedelta(weeks=1)
+        copy.save()
+        copy.borrower = self.librarian
+        copy.save()
+        copy.status = 'a'
+        copy.save()
+        copy.imprint = 'Other imprint'
+        copy.save()
+        book, reader, librarian = self.book.pk, self.reader.pk, self.librarian.pk
+        self.assertEqual(self.events(), [
+            (LoanEvent.CHECKOUT, book, reader), (LoanEvent.RENEW, book, reader),
+            (LoanEvent.RETURN, book, reader), (LoanEvent.CHECKOUT, book, librarian),
+            (LoanEvent.RETURN, book, librarian),
+        ])
+        # the return keeps the due date of the loan
+        self.assertEqual(LoanEvent.objects.filter(kind=LoanEvent.RETURN).first().due_back, copy.due_back)
+
+    def test_renewal_view(self):
+        copy = loans.checkout(self.book, self.reader)
+        self.client.force_login(self.librarian)
+        due_back = datetime.date.today() + datetime.timedelta(weeks=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('renew_book_librarian', args=[copy.pk]), {'renewal_date': due_back})
+        self.assertEqual(LoanEvent.objects.get(kind=LoanEvent.RENEW).due_back, due_back)
+
+
+class RollupTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='staff', password='1X<ISRUkw+tuK', is_staff=True)
+        cls.reader = User.objects.create_user(username='reader', password='2HJ1vRV0Z&3iD')
+        cls.other_reader = User.objects.create_user(username='other', password='2HJ1vRV0Z&3iD')
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        cls.poetry = Genre.objects.create(name='Poetry')
+        cls.book = Book.objects.create(title='Loaned book', summary='Summary', isbn='1234567890123')
+        cls.book.genre.add(cls.fantasy, cls.poetry)
+        cls.other = Book.objects.create(title='Other book', summary='Summary', isbn='1234567890124')
+        cls.other.genre.add(cls.fantasy)
+        cls.today = timezone.localdate()
+        cls.day = cls.today - datetime.timedelta(days=2)
+        cls.next_day = cls.today - datetime.timedelta(days=1)
+
+    def log(self, day, kind, book, reader, count=1):
+        created_at = circulation.day_range(day)[0] + datetime.timedelta(hours=12)
+        LoanEvent.objects.bulk_create([
+            LoanEvent(kind=kind, copy_id=uuid.uuid4(), book=book, borrower=reader, created_at=created_at) for _ in range(count)
+        ])
+
+    def log_days(self):
+        self.log(self.day, LoanEvent.CHECKOUT, self.book, self.reader, 3)
+        self.log(self.day, LoanEvent.CHECKOUT, self.other, self.other_reader)
+        self.log(self.day, LoanEvent.RETURN, self.book, self.reader)
+        self.log(self.next_day, LoanEvent.RENEW, self.other, self.reader, 2)
+        # not completed yet
+        self.log(self.today, LoanEvent.CHECKOUT, self.book, self.reader)
+
+    def test_rollup(self):
+        self.log_days()
+        self.assertEqual(circulation.rollup(self.day), 5)
+        day = CirculationDay.objects.get(day=self.day)
+        self.assertEqual((day.checkouts, day.renewals, day.returns, day.borrowers), (4, 0, 1, 2))
+        self.assertEqual(
+            set(BookCirculationDay.objects.values_list('book_id', 'checkouts', 'returns')),
+            {(self.book.pk, 3, 1), (self.other.pk, 1, 0)},
+        )
+        self.assertEqual(
+            set(GenreCirculationDay.objects.values_list('genre_id', 'checkouts', 'returns')),
+            {(self.fantasy.pk, 4, 1), (self.poetry.pk, 3, 1)},
+        )
+        # late events: the day is rolled up again
+        self.log(self.day, LoanEvent.CHECKOUT, self.other, self.reader)
+        circulation.rollup(self.day)
+        self.assertEqual(CirculationDay.objects.get(day=self.day).checkouts, 5)
+        self.assertEqual(BookCirculationDay.objects.get(day=self.day, book=self.other).checkouts, 2)
+        self.assertEqual(GenreCirculationDay.objects.count(), 2)
+
+    def test_process(self):
+        self.log_days()
+        result = circulation.process()
+        self.assertEqual((result['days'], result['events']), (2, 7))
+        self.assertEqual(list(CirculationDay.objects.values_list('day', flat=True)), [self.day, self.next_day])
+        self.assertEqual(circulation.load_checkpoint(), self.next_day)
+        self.assertEqual(circulation.process()['days'], 0)
+        self.assertEqual(circulation.process(until=self.today)['events'], 1)
+
+    def test_empty_days_are_rolled_up(self):
+        self.log(self.today - datetime.timedelta(days=4), LoanEvent.CHECKOUT, self.book, self.reader)
+        self.assertEqual(circulation.process()['days'], 4)
+        self.assertEqual(CirculationDay.objects.filter(checkouts=0).count(), 3)
+
+    def test_dashboard(self):
+        self.log_days()
+        circulation.process()
+        url = reverse('circulation')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        self.assertEqual(response.context['totals'], {'checkouts': 4, 'renewals': 2, 'returns': 1})
+        self.assertEqual(
+            [(row['title'], row['total_checkouts']) for row in response.context['top_books']],
+            [('Loaned book', 3), ('Other book', 1)],
+        )
+        self.assertEqual(response.context['top_genres'][0]['name'], 'Fantasy')
+        self.assertContains(response, self.book.get_absolute_url())
+
+    def test_dashboard_reads_rollups_only(self):
+        self.log_days()
+        circulation.process()
+        # days, books, genres, titles, names
+        with self.assertNumQueries(5):
+            circulation.dashboard()
+        # more events in the rolled up days cost nothing to the dashboard
+        self.log(self.day, LoanEvent.CHECKOUT, self.other, self.reader, 500)
+        circulation.rollup(self.day)
+        with self.assertNumQueries(5):
+            self.assertEqual(circulation.dashboard()['totals']['checkouts'], 504)
+
+    def test_queries_use_indexes(self):
+        start, end = circulation.day_range(self.day)
+        for queryset in [
+            LoanEvent.objects.filter(created_at__gte=start, created_at__lt=end),
+            CirculationDay.objects.filter(day__gte=self.day, day__lt=self.today),
+            BookCirculationDay.objects.filter(day__gte=self.day, day__lt=self.today),
+            GenreCirculationDay.objects.filter(day__gte=self.day, day__lt=self.today),
+        ]:
+            plan = queryset.explain()
+            self.assertTrue(uses_index(plan), plan)
+
+    def test_command(self):
+        self.log_days()
+        out = StringIO()
+        call_command('rollup_circulation', stdout=out)
+        self.assertIn('2 days rolled up, 7 events', out.getvalue())
+        call_command('rollup_circulation', day=self.today, stdout=out)
+        self.assertIn(f'{self.today}: 1 events', out.getvalue())
+        # --day doesn't move the checkpoint
+        self.assertEqual(circulation.load_checkpoint(), self.next_day)
+        call_command('rollup_circulation', reset=True, stdout=out)
+        self.assertIn('2 days rolled up, 7 events', out.getvalue())
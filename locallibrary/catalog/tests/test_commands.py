@@ -0,0 +1,175 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from catalog.management.commands.explain_catalog import uses_index
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog.search import search_books
+
+
+class ExplainCatalogCommandTest(TestCase):
+    def test_reports_every_view_queryset(self):
+        out = StringIO()
+        call_command('explain_catalog', stdout=out)
+        output = out.getvalue()
+        self.assertIn('all_borrowed: index', output)
+        self.assertIn('my_borrowed: index', output)
+        self.assertIn('queries without an index', output)
+
+    def test_uses_index(self):
+        self.assertTrue(uses_index('SEARCH catalog_bookinstance USING INDEX bookinst_status_due_idx (status=?)', 'sqlite'))
+        self.assertFalse(uses_index('SCAN catalog_bookinstance\nUSE TEMP B-TREE FOR ORDER BY', 'sqlite'))
+        self.assertTrue(uses_index('Index Scan using bookinst_on_loan_idx on catalog_bookinstance', 'postgresql'))
+        self.assertFalse(uses_index('Seq Scan on catalog_bookinstance', 'postgresql'))
+
+
+class ImportExportCatalogCommandTest(TestCase):
+    CSV = (
+        'title,summary,isbn,author_first_name,author_last_name,genres,language,imprint,copies\n'
+        'Dune,Spice,9780441172719,Frank,Herbert,Science Fiction;Classic,English,Ace,2\n'
+        'Dune Messiah,More spice,9780441172696,Frank,Herbert,science fiction,english,Ace,1\n'
+        'Dune again,Duplicate,9780441172719,Frank,Herbert,,English,Ace,5\n'
+        'Earthsea,Mages,9780553383041,Ursula,Le Guin,Fantasy,French,Parnassus,0\n'
+    )
+
+    def setUp(self):
+        Genre.objects.create(name='Fantasy')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as stream:
+            stream.write(content)
+        return path
+
+    def test_import_csv(self):
+        out = StringIO()
+        call_command('import_catalog', self.write('books.csv', self.CSV), batch_size=2, stdout=out)
+        self.assertIn('3 books and 3 copies created, 1 skipped', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+
+        self.assertEqual(Book.objects.count(), 3)
+        self.assertEqual(Author.objects.count(), 2)
+        # case-insensitive match on existing and imported names
+        self.assertEqual(sorted(Genre.objects.values_list('name', flat=True)), ['Classic', 'Fantasy', 'Science Fiction'])
+        self.assertEqual(Language.objects.count(), 2)
+        dune = Book.objects.get(isbn='9780441172719')
+        self.assertEqual(dune.summary, 'Spice')
+        self.assertEqual(dune.genre.count(), 2)
+        self.assertEqual(dune.bookinstance_set.filter(status='a').count(), 2)
+        # the search index is kept up to date
+        self.assertEqual([book.title for book in search_books('messiah')[0:10]], ['Dune Messiah'])
+
+        # importing again doesn't duplicate anything
+        call_command('import_catalog', self.write('books.csv', self.CSV), stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 3)
+        self.assertEqual(BookInstance.objects.count(), 3)
+
+    def test_import_status(self):
+        path = self.write('books.csv', self.CSV)
+        call_command('import_catalog', path, '--status', 'm', stdout=StringIO())
+        self.assertEqual(BookInstance.objects.filter(status='m').count(), 3)
+        self.assertEqual(Book.objects.get(isbn='9780441172719').copies_maintenance, 2)
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', path, '--status', 'x', stdout=StringIO())
+
+    def test_export_then_import_jsonl(self):
+        call_command('import_catalog', self.write('books.csv', self.CSV), stdout=StringIO())
+        path = os.path.join(self.directory.name, 'books.jsonl')
+        call_command('export_catalog', path, format='jsonl', stderr=StringIO())
+        with open(path) as stream:
+            records = [json.loads(line) for line in stream]
+        self.assertEqual(len(records), 3)
+        dune = next(record for record in records if record['isbn'] == '9780441172719')
+        self.assertEqual(dune['copies'], 2)
+        self.assertEqual(dune['author_last_name'], 'Herbert')
+
+        BookInstance.objects.all().delete()
+        Book.objects.all().delete()
+        call_command('import_catalog', path, stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 3)
+        self.assertEqual(BookInstance.objects.count(), 3)
+
+
+from unittest import mock
+from catalog.benchmark import SQLITE_PROFILES, compare, parse_size
+from django.core.management.base import CommandError
+from django.db import connections
+
+class BenchmarkCommandsTest(TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size('1k'), 1000)
+        self.assertEqual(parse_size('100k'), 100000)
+        self.assertEqual(parse_size('1M'), 1000000)
+        self.assertEqual(parse_size('250'), 250)
+
+    def test_generate_and_benchmark(self):
+        call_command('generate_catalog_data', '40', batch_size=15, stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 40)
+        self.assertEqual(BookInstance.objects.count(), 80)
+        self.assertEqual(Author.objects.count(), 4)
+        self.assertTrue(all(book.genre.exists() for book in Book.objects.all()[:5]))
+        # running it again adds more books
+        call_command('generate_catalog_data', '10', seed=1, stdout=StringIO())
+        self.assertEqual(Book.objects.count(), 50)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'results.json')
+        call_command('benchmark_catalog', requests=2, host='testserver', output=output, stdout=StringIO())
+        with open(output) as stream:
+            results = json.load(stream)
+        self.assertEqual(results['meta']['books'], 50)
+        for name in ('index', 'books', 'book_detail', 'authors', 'author_detail', 'all_borrowed', 'renew_book_librarian',
+                     'api_list', 'api_detail'):
+            self.assertEqual(results['routes'][name]['status'], 200, name)
+        self.assertGreater(results['routes']['books']['queries'], 0)
+
+        call_command('benchmark_catalog', requests=2, host='testserver', route=['books'],
+                     baseline=output, threshold=1000, stdout=StringIO())
+
+    def test_asgi_benchmark(self):
+        call_command('generate_catalog_data', '10', stdout=StringIO())
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'asgi.json')
+        call_command('benchmark_catalog', asgi=True, requests=4, concurrency=2, host='testserver',
+                     output=output, stdout=StringIO())
+        with open(output) as stream:
+            results = json.load(stream)
+        for mode in ('sync', 'async'):
+            self.assertEqual(set(results['views'][mode]), {'index', 'books', 'book_detail', 'authors', 'author_detail'})
+            for name, result in results['views'][mode].items():
+                self.assertEqual(result['status'], 200, f'{mode} {name}')
+                self.assertGreater(result['requests_per_second'], 0)
+        with self.assertRaises(CommandError):
+            call_command('benchmark_catalog', asgi=True, baseline=output, stdout=StringIO())
+
+    def test_sqlite_benchmark(self):
+        out = StringIO()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        output = os.path.join(directory.name, 'sqlite.json')
+        # the threads connect to the scratch databases of the benchmark
+        aliases = {f'catalog_benchmark_{profile}' for profile in SQLITE_PROFILES}
+        with mock.patch.object(type(self), 'databases', self.databases | aliases):
+            call_command('benchmark_catalog', sqlite=True, readers=2, writers=2, seconds=0.3, output=output,
+                         stdout=out)
+        self.assertIn('"database is locked" errors', out.getvalue())
+        with open(output) as stream:
+            results = json.load(stream)
+        self.assertEqual(results['profiles']['default']['journal_mode'], 'delete')
+        self.assertEqual(results['profiles']['tuned']['journal_mode'], 'wal')
+        for result in results['profiles'].values():
+            self.assertGreater(result['reads_per_second'], 0)
+            self.assertGreater(result['writes'], 0)
+        # the scratch databases are gone
+        self.assertNotIn('catalog_benchmark_tuned', connections.settings)
+
+    def test_compare(self):
+        baseline = {'routes': {'books': {'p95_ms': 10.0, 'queries': 3}}}
+        self.assertEqual(compare({'routes': {'books': {'p95_ms': 12.0, 'queries': 3}}}, baseline), [])
+        self.assertEqual(len(compare({'routes': {'books': {'p95_ms': 20.0, 'queries': 4}}}, baseline)), 2)
@@ -0,0 +1,120 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from catalog import fragments, loans
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+User = get_user_model()
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.genre = Genre.objects.create(name='Fantasy')
+        cls.language = Language.objects.create(name='English')
+        cls.book = Book.objects.create(
+            title='A Wizard of Earthsea', summary='Ged', isbn='9780553383041',
+            author=cls.author, language=cls.language
+        )
+        cls.book.genre.add(cls.genre)
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Parnassus', status='a')
+
+    def setUp(self):
+        fragments.get_cache().clear()
+        self.client.force_login(self.reader)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_book_list_not_modified(self):
+        url = reverse('books')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        # session + user + the validators + permissions of the user and of their
+        # groups (cached only in a shared cache, see catalog/permissions.py)
+        with self.assertNumQueries(5):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+    def test_book_list_changes(self):
+        url = reverse('books')
+        response = self.client.get(url)
+        self.author.last_name = 'K. Le Guin'
+        self.author.save()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+        response = self.client.get(url)
+        self.copy.delete()
+        self.book.delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_book_list_depends_on_user(self):
+        url = reverse('books')
+        response = self.client.get(url)
+        self.client.logout()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_book_detail_not_modified(self):
+        url = reverse('book_detail', args=[self.book.pk])
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        # session + user + Last-Modified + permissions of the user and of their groups
+        with self.assertNumQueries(5):
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_book_detail_changes(self):
+        url = reverse('book_detail', args=[self.book.pk])
+        response = self.client.get(url)
+        self.genre.name = 'High fantasy'
+        self.genre.save()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+        response = self.client.get(url)
+        loans.reserve(self.book, self.reader)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_update_sets_updated_at(self):
+        before = timezone.now()
+        loans.checkout(self.book, self.reader, datetime.date.today())
+        self.copy.refresh_from_db()
+        self.assertGreaterEqual(self.copy.updated_at, before)
+
+    def test_author_detail_not_modified(self):
+        url = reverse('author_detail', args=[self.author.pk])
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        BookInstance.objects.create(book=self.book, imprint='Ace Books', status='a')
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_depends_on_permissions(self):
+        url = reverse('author_detail', args=[self.author.pk])
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Update author')
+        self.reader.user_permissions.add(*Permission.objects.filter(codename__in=['add_author', 'change_author']))
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Update author')
+
+    def test_messages_are_shown(self):
+        self.copy.status = 'm'
+        self.copy.save()
+        url = reverse('book_detail', args=[self.book.pk])
+        response = self.client.get(url)
+        # no copy to reserve, the error is for the unchanged book page
+        self.client.post(reverse('reserve_book', args=[self.book.pk]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['messages']), 1)
+
+    def test_missing_object(self):
+        response = self.client.get(reverse('author_detail', args=[999]), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,103 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.db import OperationalError, connection
+from django.forms.models import BaseModelForm
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from catalog import database
+from catalog.models import Author, Book, Genre, Language
+
+User = get_user_model()
+
+
+@override_settings(CATALOG_WRITE_RETRIES=3, CATALOG_WRITE_RETRY_DELAY=0)
+class RetryOnLockTest(SimpleTestCase):
+    def setUp(self):
+        database.reset_retry_stats()
+
+    def failing(self, errors):
+        calls = []
+
+        def write():
+            calls.append(1)
+            if len(calls) <= len(errors):
+                raise errors[len(calls) - 1]
+            return 'saved'
+        return write, calls
+
+    def test_retries_until_the_lock_is_free(self):
+        write, calls = self.failing([OperationalError('database is locked')] * 2)
+        self.assertEqual(database.retry_on_lock(write)(), 'saved')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(database.retry_stats(), {'retries': 2, 'failures': 0})
+
+    def test_gives_up(self):
+        write, calls = self.failing([OperationalError('database is locked')] * 10)
+        with self.assertRaises(OperationalError):
+            database.retry_on_lock(write)()
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(database.retry_stats(), {'retries': 3, 'failures': 1})
+
+    def test_other_errors_are_not_retried(self):
+        write, calls = self.failing([OperationalError('no such table: catalog_book')])
+        with self.assertRaises(OperationalError):
+            database.retry_on_lock(write)()
+        self.assertEqual(len(calls), 1)
+
+
+class SQLiteSettingsTest(TestCase):
+    def test_pragmas(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -64 * 1024)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_no_retry_inside_a_transaction(self):
+        calls = []
+
+        def write():
+            calls.append(1)
+            raise OperationalError('database is locked')
+        # the test runs in a transaction, only the caller can retry all of it
+        with self.assertRaises(OperationalError):
+            database.retry_on_lock(write)()
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(CATALOG_WRITE_RETRIES=3, CATALOG_WRITE_RETRY_DELAY=0)
+class RetryOnLockMixinTest(TransactionTestCase):
+    # the view must own its transaction to retry it
+
+    def test_new_object_inserted_again(self):
+        user = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        user.user_permissions.add(Permission.objects.get(codename='add_book'))
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        genre = Genre.objects.create(name='Fantasy')
+        language = Language.objects.create(name='English')
+        self.client.force_login(user)
+        save_m2m = BaseModelForm._save_m2m
+        calls = []
+
+        def locked_once(form):
+            # the book row is inserted, the transaction rolls back at its genres
+            calls.append(form.instance.pk)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            save_m2m(form)
+
+        with mock.patch.object(BaseModelForm, '_save_m2m', locked_once):
+            response = self.client.post(reverse('book_create'), {
+                'title': 'A Wizard of Earthsea', 'author': author.pk, 'summary': 'Ged', 'isbn': '9780553383041',
+                'genre': [genre.pk], 'language': language.pk,
+            })
+        book = Book.objects.get()
+        self.assertRedirects(response, book.get_absolute_url(), fetch_redirect_response=False)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(list(book.genre.all()), [genre])
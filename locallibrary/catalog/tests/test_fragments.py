@@ -0,0 +1,112 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.template import Context, Template
+from django.test import TestCase
+from django.urls import reverse
+from catalog import fragments, loans
+from catalog.models import Author, Book, BookInstance, Genre, Language
+
+User = get_user_model()
+
+
+class FragmentCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK', is_staff=True)
+        cls.librarian.user_permissions.add(*Permission.objects.filter(codename__in=['change_book', 'delete_book', 'add_book']))
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.genre = Genre.objects.create(name='Fantasy')
+        cls.language = Language.objects.create(name='English')
+        cls.book = Book.objects.create(
+            title='A Wizard of Earthsea', summary='Ged', isbn='9780553383041',
+            author=cls.author, language=cls.language
+        )
+        cls.book.genre.add(cls.genre)
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Parnassus', status='a')
+
+    def setUp(self):
+        # the objects of setUpTestData outlive a test, their cached fragments too
+        fragments.get_cache().clear()
+        fragments.reset_cache_stats()
+        self.client.force_login(self.reader)
+
+    def get_book(self):
+        return self.client.get(reverse('book_detail', args=[self.book.pk]))
+
+    def test_book_content_is_cached(self):
+        self.get_book()
+        # session + user + Last-Modified + book + permissions of the user and of
+        # their groups for the sidebar, the copies and genres come from the cache
+        with self.assertNumQueries(6):
+            response = self.get_book()
+        self.assertContains(response, 'A Wizard of Earthsea')
+        self.assertContains(response, 'Fantasy')
+        self.assertEqual(fragments.cache_stats()['hits'], 1)
+        self.assertEqual(fragments.cache_stats()['misses'], 1)
+
+    def test_book_changes_invalidate(self):
+        self.get_book()
+        BookInstance.objects.create(book=self.book, imprint='Ace Books', status='m')
+        self.assertContains(self.get_book(), 'Ace Books')
+
+        loans.checkout(self.book, self.reader)
+        self.assertContains(self.get_book(), 'On loan')
+
+        self.author.last_name = 'K. Le Guin'
+        self.author.save()
+        self.assertContains(self.get_book(), 'K. Le Guin')
+
+        self.genre.name = 'High fantasy'
+        self.genre.save()
+        self.assertContains(self.get_book(), 'High fantasy')
+
+        self.book.genre.clear()
+        self.assertNotContains(self.get_book(), 'High fantasy')
+
+    def test_invalidated_again_at_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = 'The Farthest Shore'
+            self.book.save()
+            # a concurrent request still reads the old row, under the new version
+            fragments.set_fragment(fragments.fragment_key('book', self.book.pk), 'A Wizard of Earthsea')
+            fragments.set_fragment(fragments.fragment_key('author', self.author.pk), 'A Wizard of Earthsea')
+        self.assertIsNone(fragments.get_fragment('book', self.book.pk))
+        self.assertIsNone(fragments.get_fragment('author', self.author.pk))
+        self.assertContains(self.get_book(), 'The Farthest Shore')
+
+    def test_change_during_render(self):
+        def change():
+            # committed while the old row is rendered
+            fragments.invalidate('book', [self.book.pk])
+            return self.book.title
+        template = Template("{% load catalog_fragments %}{% fragmentcache 'book' pk %}{{ change }}{% endfragmentcache %}")
+        template.render(Context({'pk': self.book.pk, 'change': change}))
+        self.assertIsNone(fragments.get_fragment('book', self.book.pk))
+
+    def test_author_content_is_cached(self):
+        url = reverse('author_detail', args=[self.author.pk])
+        self.client.get(url)
+        # session + user + Last-Modified + author + permissions of the user and
+        # of their groups, the books come from the cache
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertContains(response, 'A Wizard of Earthsea</a> (1)')
+
+        BookInstance.objects.create(book=self.book, imprint='Ace Books', status='a')
+        self.assertContains(self.client.get(url), 'A Wizard of Earthsea</a> (2)')
+
+        other = Book.objects.create(title='The Tombs of Atuan', summary='Tenar', isbn='9780689845369', author=self.author)
+        self.assertContains(self.client.get(url), 'The Tombs of Atuan')
+        other.author = None
+        other.save()
+        self.assertNotContains(self.client.get(url), 'The Tombs of Atuan')
+
+    def test_sidebar_is_not_cached(self):
+        self.assertNotContains(self.get_book(), 'Update book')
+        self.client.force_login(self.librarian)
+        response = self.get_book()
+        self.assertEqual(fragments.cache_stats()['hits'], 1)
+        self.assertContains(response, 'Update book')
+        # the book has a copy, it can't be deleted
+        self.assertNotContains(response, 'Delete book')
@@ -0,0 +1,79 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from catalog import instrumentation
+from catalog.models import Author
+
+User = get_user_model()
+
+
+@override_settings(CATALOG_INSTRUMENTATION=True)
+class QueryTimingMiddlewareTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for author_id in range(3):
+            Author.objects.create(first_name=f'First {author_id}', last_name=f'Last {author_id}')
+        cls.staff = User.objects.create_user(username='staff', password='1X<ISRUkw+tuK', is_staff=True)
+
+    def setUp(self):
+        instrumentation.registry.clear()
+
+    def test_records_catalog_views(self):
+        for request in range(4):
+            self.client.get(reverse('authors'))
+        summary = instrumentation.registry.summary()
+        self.assertEqual(summary['authors']['count'], 4)
+        self.assertEqual(summary['authors']['sql_queries'][0.5], 2)
+        self.assertEqual(summary['authors']['duplicate_sql_queries'][0.99], 0)
+        self.assertGreater(summary['authors']['template_render_seconds'][0.5], 0)
+        self.assertGreater(summary['authors']['response_size_bytes'][0.5], 0)
+
+    def test_detects_duplicate_queries(self):
+        metrics = instrumentation.RequestMetrics()
+        execute = lambda sql, params, many, context: None
+        for query in range(3):
+            metrics(execute, 'SELECT 1', (), False, {})
+        metrics(execute, 'SELECT 2', (), False, {})
+        self.assertEqual(metrics.queries, 4)
+        self.assertEqual(metrics.duplicates, 2)
+
+    def test_ring_buffer_is_bounded(self):
+        registry = instrumentation.MetricsRegistry(size=10)
+        for value in range(100):
+            registry.record('books', (value,) * len(instrumentation.METRICS))
+        summary = registry.summary()['books']
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(len(registry.samples['books']), 10)
+        self.assertEqual(summary['request_duration_seconds'], {0.5: 94, 0.95: 99, 0.99: 99})
+
+    def test_prometheus_endpoint(self):
+        self.client.get(reverse('books'))
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '# TYPE catalog_sql_queries summary')
+        self.assertContains(response, 'catalog_request_duration_seconds_count{view="books"} 1')
+        self.assertContains(response, 'catalog_sql_queries{view="books",quantile="0.95"}')
+
+        response = self.client.get(reverse('metrics_panel'))
+        self.assertContains(response, 'books')
+
+    def test_endpoint_is_restricted(self):
+        # e.g. behind a reverse proxy
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics_panel')).status_code, 403)
+
+    @override_settings(CATALOG_METRICS_TOKEN='s3cret')
+    def test_token(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+
+
+class InstrumentationOffTest(TestCase):
+    def test_nothing_recorded(self):
+        instrumentation.registry.clear()
+        self.client.get(reverse('authors'))
+        self.assertEqual(instrumentation.registry.summary(), {})
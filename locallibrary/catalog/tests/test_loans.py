@@ -0,0 +1,206 @@
+import datetime
+import uuid
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.test import TestCase
+from django.urls import reverse
+from catalog import loans
+from catalog.models import Book, BookInstance
+
+User = get_user_model()
+
+
+class BulkLoanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK', is_staff=True)
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.reader = User.objects.create_user(username='reader', password='2HJ1vRV0Z&3iD')
+        book = Book.objects.create(title='Loaned book', summary='Summary', isbn='1234567890123')
+        due_back = datetime.date.today() + datetime.timedelta(days=1)
+        cls.on_loan = [
+            BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=cls.reader, due_back=due_back)
+            for copy in range(5)
+        ]
+        cls.available = BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+
+    def test_bulk_renew(self):
+        due_back = datetime.date.today() + datetime.timedelta(weeks=2)
+        ids = [copy.pk for copy in self.on_loan] + [self.available.pk, uuid.uuid4()]
+        # savepoint, select for update, one update, the loan events, release savepoint
+        with self.assertNumQueries(5):
+            results = loans.bulk_renew(ids, due_back)
+        self.assertEqual(list(results.values()), [loans.RENEWED] * 5 + [loans.NOT_ON_LOAN, loans.NOT_FOUND])
+        self.assertEqual(BookInstance.objects.filter(due_back=due_back).count(), 5)
+
+    def test_bulk_return_in_batches(self):
+        results = loans.bulk_return([copy.pk for copy in self.on_loan], batch_size=2)
+        self.assertEqual(set(results.values()), {loans.RETURNED})
+        self.assertEqual(BookInstance.objects.filter(status='a', borrower=None, due_back=None).count(), 6)
+
+    def test_bulk_view(self):
+        self.client.force_login(self.librarian)
+        response = self.client.post(reverse('bulk_loans'), {
+            'action': 'renew',
+            'renewal_date': datetime.date.today() + datetime.timedelta(weeks=5),
+            'copies': [copy.pk for copy in self.on_loan],
+        })
+        # same rules as RenewBookForm
+        self.assertFalse(response.context['form'].is_valid())
+        self.assertIn('renewal_date', response.context['form'].errors)
+
+        response = self.client.post(reverse('bulk_loans'), {
+            'action': 'return',
+            'copies': [self.on_loan[0].pk, self.available.pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['result'] for item in response.context['results']], [loans.RETURNED, loans.NOT_ON_LOAN])
+
+    def test_bulk_view_requires_permission(self):
+        self.client.force_login(self.reader)
+        response = self.client.post(reverse('bulk_loans'), {'action': 'return', 'copies': [self.on_loan[0].pk]})
+        self.assertEqual(response.status_code, 403)
+
+    def test_renew_view(self):
+        self.client.force_login(self.librarian)
+        url = reverse('renew_book_librarian', args=[self.on_loan[0].pk])
+        response = self.client.get(url)
+        self.assertEqual(response.context['form'].initial['renewal_date'], datetime.date.today() + datetime.timedelta(weeks=3))
+
+        due_back = datetime.date.today() + datetime.timedelta(weeks=2)
+        response = self.client.post(url, {'renewal_date': due_back})
+        self.assertRedirects(response, reverse('all_borrowed'))
+        self.on_loan[0].refresh_from_db()
+        self.assertEqual(self.on_loan[0].due_back, due_back)
+
+    def test_admin_actions(self):
+        admin = User.objects.create_superuser(username='admin', password='3Kq1vRV0Z&3iD')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:catalog_bookinstance_changelist'), {
+            'action': 'return_copies',
+            '_selected_action': [copy.pk for copy in self.on_loan[:2]],
+        }, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '2 returned')
+        self.assertEqual(BookInstance.objects.filter(status='o').count(), 3)
+
+
+class CheckoutTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.reader = User.objects.create_user(username='reader', password='2HJ1vRV0Z&3iD')
+        cls.other_reader = User.objects.create_user(username='other', password='2HJ1vRV0Z&3iD')
+        cls.book = Book.objects.create(title='Popular book', summary='Summary', isbn='1234567890123')
+        cls.copies = [BookInstance.objects.create(book=cls.book, imprint='Imprint', status='a') for copy in range(2)]
+        BookInstance.objects.create(book=cls.book, imprint='Imprint', status='m')
+
+    def test_checkout_until_no_copy_is_left(self):
+        first = loans.checkout(self.book, self.reader)
+        second = loans.checkout(self.book, self.other_reader)
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertEqual((first.status, first.borrower), ('o', self.reader))
+        self.assertEqual(first.due_back, datetime.date.today() + loans.LOAN_PERIOD)
+        with self.assertRaises(loans.NoCopyAvailable):
+            loans.checkout(self.book, self.reader)
+
+        loans.return_copy(first.pk)
+        self.assertEqual(loans.checkout(self.book, self.reader).pk, first.pk)
+
+    def test_reservation_is_kept_for_the_borrower(self):
+        reserved = loans.reserve(self.book, self.reader)
+        self.assertEqual((reserved.status, reserved.borrower), ('r', self.reader))
+        other = loans.checkout(self.book, self.other_reader)
+        self.assertNotEqual(other.pk, reserved.pk)
+        with self.assertRaises(loans.NoCopyAvailable):
+            loans.checkout(self.book, self.other_reader)
+        self.assertEqual(loans.checkout(self.book, self.reader).pk, reserved.pk)
+
+    def test_return_copy_not_on_loan(self):
+        with self.assertRaises(loans.LoanError):
+            loans.return_copy(self.copies[0].pk)
+
+    def test_views(self):
+        self.client.force_login(self.reader)
+        response = self.client.post(reverse('reserve_book', args=[self.book.pk]))
+        self.assertRedirects(response, self.book.get_absolute_url())
+        self.assertEqual(BookInstance.objects.filter(status='r', borrower=self.reader).count(), 1)
+
+        self.client.force_login(self.librarian)
+        response = self.client.post(reverse('checkout_book_librarian', args=[self.book.pk]), {
+            'borrower': 'reader',
+            'due_back': datetime.date.today() + datetime.timedelta(weeks=1),
+        })
+        self.assertRedirects(response, self.book.get_absolute_url())
+        copy = BookInstance.objects.get(status='o')
+        self.assertEqual(copy.borrower, self.reader)
+
+        response = self.client.post(reverse('return_book_librarian', args=[copy.pk]))
+        self.assertRedirects(response, reverse('all_borrowed'))
+        copy.refresh_from_db()
+        self.assertEqual(copy.status, 'a')
+
+    def test_checkout_view_unknown_borrower(self):
+        self.client.force_login(self.librarian)
+        response = self.client.post(reverse('checkout_book_librarian', args=[self.book.pk]), {
+            'borrower': 'nobody',
+            'due_back': datetime.date.today(),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('borrower', response.context['form'].errors)
+
+
+import threading
+import time
+from django.db import OperationalError, connection
+from django.test import TransactionTestCase
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    """Many threads lending copies of the same book at once"""
+    threads = 8
+    copies = 5
+
+    def test_no_copy_is_lent_twice(self):
+        book = Book.objects.create(title='Popular book', summary='Summary', isbn='1234567890123')
+        for copy in range(self.copies):
+            BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        readers = [User.objects.create_user(username=f'reader{number}') for number in range(self.threads)]
+
+        barrier = threading.Barrier(self.threads)
+        lent, failures, errors = [], [], []
+
+        def checkout(reader):
+            # the in-memory test database uses SQLite's shared cache, where a lock
+            # conflict fails at once instead of waiting for the busy timeout
+            for attempt in range(100):
+                try:
+                    return loans.checkout(book, reader)
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    time.sleep(0.01)
+            raise AssertionError('database still locked')
+
+        def borrow(reader):
+            try:
+                barrier.wait()
+                lent.append(checkout(reader).pk)
+            except loans.NoCopyAvailable:
+                failures.append(reader)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=borrow, args=[reader]) for reader in readers]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(lent), self.copies)
+        self.assertEqual(len(set(lent)), self.copies)
+        self.assertEqual(len(failures), self.threads - self.copies)
+        self.assertEqual(BookInstance.objects.filter(status='o').count(), self.copies)
@@ -0,0 +1,133 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.test import TestCase
+from catalog import loans, overdue
+from catalog.management.commands.explain_catalog import uses_index
+from catalog.models import Author, Book, BookInstance, Language
+
+User = get_user_model()
+
+
+class OverdueTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = datetime.date.today()
+        cls.alice = User.objects.create_user(username='alice', first_name='Alice', email='alice@example.com')
+        cls.bob = User.objects.create_user(username='bob', email='bob@example.com')
+        cls.carol = User.objects.create_user(username='carol')
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        language = Language.objects.create(name='English')
+        cls.book = Book.objects.create(title='A Wizard of Earthsea', summary='Ged', isbn='9780553383041',
+                                       author=author, language=language)
+        cls.lend(cls.alice, -10)
+        cls.lend(cls.alice, -3)
+        cls.lend(cls.bob, -5)
+        cls.lend(cls.carol, -4)
+        # not overdue
+        cls.lend(cls.bob, 0)
+        cls.lend(cls.bob, 7)
+        BookInstance.objects.create(book=cls.book, imprint='-', status='r', borrower=cls.alice,
+                                    due_back=cls.today - datetime.timedelta(days=20))
+        BookInstance.objects.create(book=cls.book, imprint='-', status='a',
+                                    due_back=cls.today - datetime.timedelta(days=20))
+
+    @classmethod
+    def lend(cls, borrower, days):
+        return BookInstance.objects.create(book=cls.book, imprint='-', status='o', borrower=borrower,
+                                           due_back=cls.today + datetime.timedelta(days=days))
+
+    def test_notices_grouped_by_borrower(self):
+        result = overdue.process()
+        self.assertEqual(result['copies'], 4)
+        self.assertEqual(result['borrowers'], 3)
+        self.assertEqual(result['emails'], 2)
+        self.assertEqual(result['no_email'], 1)
+        notices = {message.to[0]: message for message in mail.outbox}
+        self.assertEqual(set(notices), {'alice@example.com', 'bob@example.com'})
+        self.assertEqual(notices['alice@example.com'].subject, '2 overdue books')
+        self.assertIn('Dear Alice', notices['alice@example.com'].body)
+        self.assertEqual(notices['alice@example.com'].body.count('A Wizard of Earthsea'), 2)
+        self.assertIn('Dear bob', notices['bob@example.com'].body)
+
+    def test_reruns_are_incremental(self):
+        overdue.process(batch_size=2)
+        # copies are grouped per batch: alice's two copies are in different batches
+        self.assertEqual(len(mail.outbox), 3)
+        # nothing new, carol has no email address yet
+        result = overdue.process()
+        self.assertEqual((result['copies'], result['no_email']), (1, 1))
+        self.assertEqual(len(mail.outbox), 3)
+        # a copy due today is overdue tomorrow
+        result = overdue.process(today=self.today + datetime.timedelta(days=1))
+        self.assertEqual(result['copies'], 2)
+        self.assertEqual(mail.outbox[-1].to, ['bob@example.com'])
+
+    def test_batches_and_reset(self):
+        result = overdue.process(batch_size=3)
+        self.assertEqual(result['batches'], 2)
+        # carol's copy, she has no email address
+        self.assertEqual(overdue.batch_queryset().count(), 1)
+        overdue.reset_notices()
+        self.assertEqual(overdue.process()['copies'], 4)
+
+    def test_due_date_changes(self):
+        overdue.process()
+        copy = BookInstance.objects.get(borrower=self.bob, due_back=self.today - datetime.timedelta(days=5))
+        # moved before the oldest notified due date: still notified
+        copy.due_back = self.today - datetime.timedelta(days=30)
+        copy.save()
+        result = overdue.process()
+        self.assertEqual(result['emails'], 1)
+        self.assertEqual(mail.outbox[-1].to, ['bob@example.com'])
+        # renewed, then overdue again
+        BookInstance.objects.filter(pk=copy.pk).update(due_back=self.today + datetime.timedelta(days=1))
+        self.assertEqual(overdue.process()['emails'], 0)
+        # with bob's copy due today, in one email
+        self.assertEqual(overdue.process(today=self.today + datetime.timedelta(days=2))['emails'], 1)
+
+    def test_borrower_without_email(self):
+        overdue.process()
+        self.carol.email = 'carol@example.com'
+        self.carol.save()
+        result = overdue.process()
+        self.assertEqual((result['emails'], result['no_email']), (1, 0))
+        self.assertEqual(mail.outbox[-1].to, ['carol@example.com'])
+
+    def test_loans_clear_the_notice(self):
+        overdue.process()
+        copy = BookInstance.objects.get(borrower=self.bob, due_back=self.today - datetime.timedelta(days=5))
+        # renewed to the same due date
+        loans.renew_copy(copy, copy.due_back)
+        self.assertEqual(overdue.process()['emails'], 1)
+        # returned, then lent again with the same due date
+        loans.return_copy(copy.pk)
+        copy = loans.checkout(self.book, self.bob, copy.due_back)
+        self.assertEqual(overdue.process()['emails'], 1)
+        loans.bulk_renew([copy.pk], copy.due_back)
+        self.assertEqual(overdue.process()['emails'], 1)
+        loans.bulk_return([copy.pk])
+        self.assertIsNone(BookInstance.objects.get(pk=copy.pk).notified_due_back)
+
+    def test_dry_run(self):
+        result = overdue.process(dry_run=True)
+        self.assertEqual(result['copies'], 4)
+        self.assertEqual(result['emails'], 0)
+        self.assertEqual(mail.outbox, [])
+        self.assertFalse(BookInstance.objects.exclude(notified_due_back=None).exists())
+
+    def test_query_uses_index(self):
+        for position in (None, (self.today, BookInstance.objects.first().pk)):
+            plan = overdue.batch_queryset(position)[:overdue.BATCH_SIZE].explain()
+            self.assertTrue(uses_index(plan), plan)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('process_overdue', stdout=out)
+        self.assertIn('4 overdue copies, 3 borrowers, 2 emails sent', out.getvalue())
+        self.assertIn('copies/s', out.getvalue())
+        call_command('process_overdue', reset=True, dry_run=True, stdout=out)
+        self.assertEqual(len(mail.outbox), 2)
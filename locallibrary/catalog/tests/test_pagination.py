@@ -0,0 +1,87 @@
+import datetime
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from catalog.models import Author, Book, BookInstance
+from catalog.pagination import CursorPaginator, InvalidCursor
+
+
+class CursorPaginatorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # several authors share a last name so that the tie breakers are used
+        for author_id in range(11):
+            Author.objects.create(first_name=f'First {author_id % 3}', last_name=f'Last {author_id % 4}')
+        book = Book.objects.create(title='Book', summary='Summary', isbn='1234567890123')
+        today = datetime.date.today()
+        for copy in range(7):
+            due_back = None if copy % 3 == 0 else today + datetime.timedelta(days=copy % 2)
+            BookInstance.objects.create(book=book, imprint='Imprint', due_back=due_back, status='o')
+
+    def walk(self, paginator):
+        pages, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append(page)
+            if not page.has_next():
+                return pages
+            cursor = page.next_cursor
+
+    def test_walk_authors_forward_and_back(self):
+        ordering = ['last_name', 'first_name', 'id']
+        paginator = CursorPaginator(Author.objects.all(), 5, ordering)
+        pages = self.walk(paginator)
+        self.assertEqual([len(page) for page in pages], [5, 5, 1])
+        expected = list(Author.objects.order_by(*ordering))
+        self.assertEqual([author for page in pages for author in page], expected)
+        self.assertFalse(pages[0].has_previous())
+
+        previous = paginator.page(pages[2].previous_cursor)
+        self.assertEqual(list(previous), list(pages[1]))
+        first = paginator.page(previous.previous_cursor)
+        self.assertEqual(list(first), list(pages[0]))
+        self.assertFalse(first.has_previous())
+
+    def test_nullable_ordering_field(self):
+        paginator = CursorPaginator(BookInstance.objects.all(), 2, ['due_back', 'id'])
+        pages = self.walk(paginator)
+        copies = [copy for page in pages for copy in page]
+        self.assertEqual(len(copies), 7)
+        self.assertEqual(len(set(copy.id for copy in copies)), 7)
+        # NULL due dates come last
+        self.assertEqual([copy.due_back is None for copy in copies], [False] * 4 + [True] * 3)
+        self.assertEqual(list(paginator.page(pages[-1].previous_cursor)), list(pages[-2]))
+
+    def test_page_does_not_count(self):
+        paginator = CursorPaginator(Author.objects.all(), 5, ['last_name', 'first_name', 'id'])
+        cursor = paginator.page().next_cursor
+        with self.assertNumQueries(1):
+            paginator.page(cursor)
+
+    def test_invalid_cursor(self):
+        paginator = CursorPaginator(Author.objects.all(), 5, ['last_name', 'first_name', 'id'])
+        with self.assertRaises(InvalidCursor):
+            paginator.page('not-a-cursor')
+
+
+@override_settings(CATALOG_CURSOR_PAGINATION=True)
+class CursorPaginatedListViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for author_id in range(9):
+            Author.objects.create(first_name=f'Dominique {author_id}', last_name=f'Surname {author_id}')
+
+    def test_author_list_pages(self):
+        response = self.client.get(reverse('authors'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_cursor_paginated'])
+        self.assertEqual(len(response.context['author_list']), 5)
+        next_cursor = response.context['page_obj'].next_cursor
+        self.assertContains(response, f'?cursor={next_cursor}')
+
+        response = self.client.get(reverse('authors') + f'?cursor={next_cursor}')
+        self.assertEqual(len(response.context['author_list']), 4)
+        self.assertFalse(response.context['page_obj'].has_next())
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get(reverse('authors') + '?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
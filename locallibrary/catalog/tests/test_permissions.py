@@ -0,0 +1,119 @@
+import tempfile
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from catalog import permissions
+
+User = get_user_model()
+
+
+def shared_cache_settings(directory):
+    """A file based cache, shared by the processes like memcached or redis would be"""
+    return override_settings(
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        },
+        CATALOG_PERMISSIONS_CACHE='shared',
+    )
+
+
+class PermissionCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        cls.enterClassContext(shared_cache_settings(directory.name))
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.can_mark_returned = Permission.objects.get(codename='can_mark_returned')
+        cls.add_book = Permission.objects.get(codename='add_book')
+        cls.staff = Group.objects.create(name='Staff')
+
+    def setUp(self):
+        permissions.get_cache().clear()
+
+    def perms(self):
+        # a new instance, like the user of the next request
+        return User.objects.get(pk=self.librarian.pk).get_all_permissions()
+
+    def test_cached_between_requests(self):
+        self.librarian.user_permissions.add(self.can_mark_returned)
+        self.assertEqual(self.perms(), {'catalog.can_mark_returned'})
+        with self.assertNumQueries(1):
+            self.assertEqual(self.perms(), {'catalog.can_mark_returned'})
+
+        self.client.force_login(self.librarian)
+        url = reverse('all_borrowed')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse([query for query in queries if 'auth_permission' in query['sql']])
+
+    def test_user_permissions_invalidate(self):
+        self.assertEqual(self.perms(), set())
+        self.librarian.user_permissions.add(self.can_mark_returned)
+        self.assertEqual(self.perms(), {'catalog.can_mark_returned'})
+        self.can_mark_returned.user_set.remove(self.librarian)
+        self.assertEqual(self.perms(), set())
+        self.librarian.user_permissions.add(self.can_mark_returned)
+        self.perms()
+        self.can_mark_returned.user_set.clear()
+        self.assertEqual(self.perms(), set())
+
+    def test_groups_invalidate(self):
+        self.staff.permissions.add(self.add_book)
+        self.assertEqual(self.perms(), set())
+        self.librarian.groups.add(self.staff)
+        self.assertEqual(self.perms(), {'catalog.add_book'})
+        self.staff.permissions.add(self.can_mark_returned)
+        self.assertEqual(self.perms(), {'catalog.add_book', 'catalog.can_mark_returned'})
+        self.staff.delete()
+        self.assertEqual(self.perms(), set())
+
+    def test_user_changes(self):
+        self.perms()
+        self.librarian.is_superuser = True
+        self.librarian.save()
+        self.assertIn('catalog.add_book', self.perms())
+        # logging in doesn't
+        key = permissions.permissions_key(self.librarian.pk)
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        self.assertEqual(permissions.permissions_key(self.librarian.pk), key)
+
+    def test_async(self):
+        self.librarian.user_permissions.add(self.can_mark_returned)
+        user = User.objects.get(pk=self.librarian.pk)
+        self.assertTrue(async_to_sync(user.ahas_perm)('catalog.can_mark_returned'))
+        self.assertEqual(self.perms(), {'catalog.can_mark_returned'})
+
+    def test_other_workers_see_revocations(self):
+        # another process has its own client of the shared cache
+        other_worker = caches.create_connection('shared')
+        self.librarian.user_permissions.add(self.can_mark_returned)
+        with mock.patch('catalog.permissions.get_cache', return_value=other_worker):
+            self.assertEqual(self.perms(), {'catalog.can_mark_returned'})
+        self.librarian.user_permissions.remove(self.can_mark_returned)
+        with mock.patch('catalog.permissions.get_cache', return_value=other_worker):
+            self.assertEqual(self.perms(), set())
+
+
+class LocalCacheTest(TestCase):
+    def test_local_memory_cache_is_not_used(self):
+        user = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        user.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.assertIsNone(permissions.get_cache())
+        for _ in range(2):
+            user = User.objects.get(pk=user.pk)
+            # the permissions of the user and of their groups, on every request
+            with self.assertNumQueries(2):
+                self.assertEqual(user.get_all_permissions(), {'catalog.can_mark_returned'})
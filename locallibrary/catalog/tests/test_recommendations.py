@@ -0,0 +1,108 @@
+import unittest
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from catalog import fragments, loans, recommendations
+from catalog.management.commands.explain_catalog import uses_index
+from catalog.models import Author, Book, BookInstance, BookRecommendation, Genre, Language
+
+User = get_user_model()
+
+
+class RecommendationsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        le_guin = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        banks = Author.objects.create(first_name='Iain', last_name='Banks')
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        cls.poetry = Genre.objects.create(name='Poetry')
+        language = Language.objects.create(name='English')
+        cls.books = {}
+        for title, author, genre in [
+            ('A Wizard of Earthsea', le_guin, cls.fantasy),
+            ('The Tombs of Atuan', le_guin, cls.fantasy),
+            ('Feersum Endjinn', banks, cls.fantasy),
+            ('Poems', banks, cls.poetry),
+            ('Untitled', None, None),
+        ]:
+            book = Book.objects.create(title=title, summary='-', isbn=f'97800000{len(cls.books):05d}',
+                                       author=author, language=language)
+            if genre:
+                book.genre.add(genre)
+            BookInstance.objects.create(book=book, imprint='-', status='a')
+            cls.books[title] = book
+
+    def setUp(self):
+        fragments.get_cache().clear()
+
+    def recommended(self, title):
+        return [
+            (row.recommended.title, row.score)
+            for row in BookRecommendation.objects.filter(book=self.books[title]).order_by('rank')
+        ]
+
+    def test_full_run(self):
+        result = recommendations.process(engine=recommendations.PYTHON)
+        self.assertEqual(result['recomputed'], 5)
+        # same author and genre: 1, same genre only: 1 / (sqrt(5) * sqrt(5))
+        self.assertEqual(self.recommended('A Wizard of Earthsea'), [('The Tombs of Atuan', 1.0), ('Feersum Endjinn', 0.2)])
+        self.assertEqual(self.recommended('Poems'), [('Feersum Endjinn', 0.8)])
+        self.assertEqual(self.recommended('Untitled'), [])
+        recommendations.process(full=True, k=1, engine=recommendations.PYTHON)
+        self.assertEqual(self.recommended('A Wizard of Earthsea'), [('The Tombs of Atuan', 1.0)])
+
+    @unittest.skipIf(recommendations.sparse is None, 'NumPy and SciPy are not installed')
+    def test_engines_agree(self):
+        features = recommendations.book_features()
+        pks = sorted(features)
+        self.assertEqual(
+            recommendations.similarity_function(features, recommendations.NUMPY)(pks, 3),
+            recommendations.similarity_function(features, recommendations.PYTHON)(pks, 3),
+        )
+
+    def test_incremental_run(self):
+        recommendations.process(engine=recommendations.PYTHON)
+        self.assertEqual(recommendations.process(engine=recommendations.PYTHON)['recomputed'], 0)
+
+        # Poems is now fantasy too: the fantasy books and those of its author are recomputed
+        self.books['Poems'].genre.add(self.fantasy)
+        result = recommendations.process(engine=recommendations.PYTHON)
+        self.assertEqual(result['recomputed'], 4)
+        self.assertIn('Poems', [title for title, _ in self.recommended('A Wizard of Earthsea')])
+
+        # a reader borrowing two books brings them closer
+        loans.checkout(self.books['Poems'], self.reader)
+        loans.checkout(self.books['A Wizard of Earthsea'], self.reader)
+        recommendations.process(engine=recommendations.PYTHON)
+        self.assertEqual(self.recommended('Poems')[0][0], 'Feersum Endjinn')
+        self.assertEqual(self.recommended('Poems')[1][0], 'A Wizard of Earthsea')
+
+        # a book leaving a genre leaves the lists it was in
+        self.books['Feersum Endjinn'].genre.clear()
+        recommendations.process(engine=recommendations.PYTHON)
+        self.assertNotIn('Feersum Endjinn', [title for title, _ in self.recommended('A Wizard of Earthsea')])
+
+    def test_book_page(self):
+        self.client.force_login(self.reader)
+        url = reverse('book_detail', args=[self.books['A Wizard of Earthsea'].pk])
+        self.assertNotContains(self.client.get(url), 'Readers also liked')
+        recommendations.process(engine=recommendations.PYTHON)
+        # the run invalidated the cached content of the page
+        response = self.client.get(url)
+        self.assertContains(response, 'Readers also liked')
+        self.assertContains(response, self.books['The Tombs of Atuan'].get_absolute_url())
+
+    def test_query_uses_index(self):
+        plan = recommendations.prefetch().queryset.filter(book_id=1).explain()
+        self.assertTrue(uses_index(plan), plan)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('build_recommendations', engine='python', stdout=out)
+        self.assertIn('5 of 5 books recomputed (python), 8 recommendations', out.getvalue())
+        call_command('build_recommendations', engine='python', stdout=out)
+        self.assertIn('0 of 5 books recomputed', out.getvalue())
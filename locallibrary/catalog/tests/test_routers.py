@@ -0,0 +1,113 @@
+import os
+import tempfile
+
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from catalog import routers
+from catalog.models import Author, Book
+
+REPLICAS = ['replica1', 'replica2']
+
+
+@override_settings(CATALOG_READ_REPLICAS=REPLICAS, CATALOG_REPLICA_SELECTION='round-robin')
+class ReplicaRouterTest(TransactionTestCase):
+    """Two SQLite files stand in for the read replicas"""
+
+    @classmethod
+    def setUpClass(cls):
+        # the test runner only knows the databases of settings.DATABASES,
+        # the replicas are added once the test case is set up
+        super().setUpClass()
+        cls.databases = {'default', *REPLICAS}
+        cls.directory = tempfile.TemporaryDirectory()
+        for alias in REPLICAS:
+            config = connections.configure_settings({
+                'default': connections.settings['default'],
+                alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.directory.name, f'{alias}.sqlite3')},
+            })
+            connections.settings[alias] = config[alias]
+            call_command('migrate', database=alias, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        for alias in REPLICAS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.databases = {'default'}
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        # a different author in each database tells where a page was read from
+        for alias in ['default', *REPLICAS]:
+            Author.objects.using(alias).bulk_create([Author(first_name='In', last_name=alias)])
+        routers.latency.clear()
+
+    def test_round_robin(self):
+        router = routers.ReplicaRouter()
+        used = []
+        for _ in range(4):
+            with routers.read_scope():
+                used.append(router.db_for_read(Book))
+                # the replica stays the same for the whole request
+                self.assertEqual(router.db_for_read(Author), used[-1])
+        self.assertEqual(used, ['replica1', 'replica2', 'replica1', 'replica2'])
+
+    def test_pages_read_from_replicas(self):
+        pages = [self.client.get(reverse('authors')).content.decode() for _ in range(2)]
+        self.assertIn('replica1', pages[0])
+        self.assertIn('replica2', pages[1])
+        self.assertNotIn('default', ''.join(pages))
+
+    def test_other_apps_use_primary(self):
+        router = routers.ReplicaRouter()
+        with routers.read_scope():
+            self.assertIsNone(router.db_for_read(User))
+            self.assertEqual(router.db_for_write(User), 'default')
+            # and don't pin the catalog reads to the primary
+            self.assertIn(router.db_for_read(Author), REPLICAS)
+
+    def test_read_your_writes(self):
+        router = routers.ReplicaRouter()
+        with routers.read_scope():
+            self.assertIn(router.db_for_read(Author), REPLICAS)
+            Author.objects.create(first_name='Ursula', last_name='Le Guin')
+            self.assertEqual(router.db_for_read(Author), 'default')
+            self.assertTrue(Author.objects.filter(last_name='Le Guin').exists())
+
+    def test_transaction_uses_primary(self):
+        router = routers.ReplicaRouter()
+        with routers.read_scope():
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Author), 'default')
+
+    def test_pinned_after_write(self):
+        response = self.client.post(reverse('author_create'))
+        # anonymous: redirected to the login page without writing
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+        user = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        user.user_permissions.add(Permission.objects.get(codename='add_author'))
+        self.client.force_login(user)
+        response = self.client.post(reverse('author_create'), {'first_name': 'Ursula', 'last_name': 'Le Guin'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        # the next page is read from the primary, which has the new author
+        self.assertContains(self.client.get(reverse('authors')), 'Le Guin')
+
+    @override_settings(CATALOG_REPLICA_SELECTION='least-latency')
+    def test_least_latency(self):
+        router = routers.ReplicaRouter()
+        routers.latency.record('replica1', 0.050)
+        routers.latency.record('replica2', 0.001)
+        with routers.read_scope():
+            self.assertEqual(router.db_for_read(Book), 'replica2')
+        # queries on the replicas are measured
+        routers.latency.clear()
+        with routers.read_scope():
+            list(Author.objects.all())
+        self.assertTrue(set(routers.latency.latencies) & set(REPLICAS))
@@ -0,0 +1,66 @@
+from django.test import TestCase
+from django.urls import reverse
+from catalog.models import Author, Book, Genre, Language
+from catalog.search import search_books, rebuild_index
+
+
+class BookSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        cls.other_author = Author.objects.create(first_name='Frank', last_name='Herbert')
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        language = Language.objects.create(name='English')
+        cls.wizard = Book.objects.create(
+            title='A Wizard of Earthsea', summary='A young mage on the islands',
+            isbn='9780553383041', author=cls.author, language=language
+        )
+        cls.wizard.genre.set([cls.fantasy])
+        cls.dune = Book.objects.create(
+            title='Dune', summary='Spice, sand and a wizard of sorts',
+            isbn='9780441172719', author=cls.other_author, language=language
+        )
+
+    def titles(self, query):
+        return [book.title for book in search_books(query)[0:10]]
+
+    def test_search_fields(self):
+        self.assertEqual(self.titles('earthsea'), ['A Wizard of Earthsea'])
+        self.assertEqual(self.titles('guin'), ['A Wizard of Earthsea'])
+        self.assertEqual(self.titles('fantasy'), ['A Wizard of Earthsea'])
+        self.assertEqual(self.titles('9780441172719'), ['Dune'])
+        self.assertEqual(self.titles('spice sand'), ['Dune'])
+        self.assertEqual(self.titles('nothing'), [])
+        self.assertEqual(self.titles('  '), [])
+
+    def test_ranking(self):
+        # a match in the title ranks before a match in the summary
+        self.assertEqual(self.titles('wizard'), ['A Wizard of Earthsea', 'Dune'])
+        self.assertEqual(search_books('wizard').count(), 2)
+
+    def test_query_operators_are_escaped(self):
+        self.assertEqual(self.titles('"dune" *('), ['Dune'])
+
+    def test_index_follows_changes(self):
+        self.dune.genre.add(self.fantasy)
+        self.assertEqual(sorted(self.titles('fantasy')), ['A Wizard of Earthsea', 'Dune'])
+
+        self.fantasy.name = 'Speculative'
+        self.fantasy.save()
+        self.assertEqual(self.titles('fantasy'), [])
+        self.assertEqual(len(self.titles('speculative')), 2)
+
+        self.other_author.last_name = 'Lovecraft'
+        self.other_author.save()
+        self.assertEqual(self.titles('lovecraft'), ['Dune'])
+
+        self.wizard.delete()
+        self.assertEqual(self.titles('earthsea'), [])
+        self.assertEqual(rebuild_index(), 1)
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search') + '?q=wizard')
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/book_search.html')
+        self.assertEqual(len(response.context['book_list']), 2)
+        self.assertContains(response, 'A Wizard of Earthsea')
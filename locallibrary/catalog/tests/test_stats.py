@@ -0,0 +1,76 @@
+import time
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from catalog.models import Author, Book, BookInstance, Genre, Language
+from catalog import stats
+
+
+class CatalogStatsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Ursula', last_name='Le Guin')
+        language = Language.objects.create(name='English')
+        fantasy = Genre.objects.create(name='Fantasy')
+        dark_fantasy = Genre.objects.create(name='Dark fantasy')
+        Genre.objects.create(name='Poetry')
+        cls.book = Book.objects.create(
+            title='A Wizard of Earthsea',
+            summary='Ged',
+            isbn='9780553383041',
+            author=author,
+            language=language
+        )
+        # two matching genres must not count the book twice
+        cls.book.genre.set([fantasy, dark_fantasy])
+        BookInstance.objects.create(book=cls.book, imprint='Parnassus 1968', status='a')
+        BookInstance.objects.create(book=cls.book, imprint='Parnassus 1968', status='o')
+
+    def setUp(self):
+        stats.invalidate_stats()
+        stats.reset_cache_stats()
+
+    def test_compute_stats_uses_one_query(self):
+        with self.assertNumQueries(1):
+            result = stats.compute_stats()
+        self.assertEqual(result, {
+            'num_books': 1,
+            'num_instances': 2,
+            'num_instances_available': 1,
+            'num_genres': 3,
+            'num_authors': 1,
+            'fantasy_books_count': 1,
+        })
+
+    def test_stats_are_cached(self):
+        stats.get_stats()
+        with self.assertNumQueries(0):
+            stats.get_stats()
+        counters = stats.cache_stats()
+        self.assertEqual(counters['misses'], 1)
+        self.assertEqual(counters['hits'], 1)
+        self.assertEqual(counters['rebuilds'], 1)
+
+    def test_stats_expire(self):
+        # the other processes only drop their statistics when they expire
+        stats.get_stats()
+        with mock.patch('time.time', return_value=time.time() + stats.DEFAULT_TIMEOUT + 1):
+            stats.get_stats()
+        self.assertEqual(stats.cache_stats()['misses'], 2)
+
+    def test_signals_refresh_stats(self):
+        self.assertEqual(stats.get_stats()['num_instances_available'], 1)
+        BookInstance.objects.create(book=self.book, imprint='Ace 1975', status='a')
+        self.assertEqual(stats.get_stats()['num_instances_available'], 2)
+
+        self.book.genre.clear()
+        self.assertEqual(stats.get_stats()['fantasy_books_count'], 0)
+
+    def test_index_reads_from_cache(self):
+        self.client.get(reverse('index'))
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_books'], 1)
+        self.assertEqual(response.context['fantasy_books_count'], 1)
+        self.assertContains(response, 'A Wizard of Earthsea')
+        self.assertEqual(stats.cache_stats()['hits'], 1)
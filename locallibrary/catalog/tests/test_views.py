@@ -1,6 +1,7 @@
 from django.test import TestCase
 from django.urls import reverse 
 from catalog.models import Author, BookInstance, Book, Genre, Language
+from catalog import fragments
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required, permission_required
 from django.shortcuts import render, get_object_or_404
@@ -195,3 +196,118 @@ def renew_book_librarian(request, pk):
 
     return render(request, 'catalog/book_renew_librarian.html', context)
 
+
+
+class DetailViewQueryCountTest(TestCase):
+    """The detail pages must not run one query per related row"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+        cls.author = Author.objects.create(first_name='Terry', last_name='Pratchett')
+        cls.language = Language.objects.create(name='English')
+        cls.genres = [Genre.objects.create(name=f'Genre {number}') for number in range(3)]
+        cls.book = cls.create_book(0)
+
+    @classmethod
+    def create_book(cls, number):
+        book = Book.objects.create(
+            title=f'Discworld {number}', 
+            summary='Turtles all the way down',
+            isbn=f'ISBN{number:09d}',
+            author=cls.author,
+            language=cls.language
+        )
+        book.genre.set(cls.genres)
+        for copy in range(3):
+            BookInstance.objects.create(book=book, imprint='Corgi', status='a')
+        return book
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        fragments.get_cache().clear()
+
+    def test_book_detail_query_count(self):
+        # session + user + Last-Modified + book (with author and language) + genres
+        # + copies + recommendations + permissions of the user and of their groups
+        # for the sidebar (cached only in a shared cache, see catalog/permissions.py)
+        with self.assertNumQueries(9):
+            response = self.client.get(reverse('book_detail', args=[self.book.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Genre 0, Genre 1, Genre 2')
+
+        for copy in range(20):
+            BookInstance.objects.create(book=self.book, imprint='Corgi', status='o')
+        with self.assertNumQueries(9):
+            self.client.get(reverse('book_detail', args=[self.book.pk]))
+
+    def test_author_detail_query_count(self):
+        for number in range(1, 10):
+            self.create_book(number)
+        BookInstance.objects.create(book=self.book, imprint='Corgi', status='o')
+
+        # session + user + Last-Modified + author + books annotated with their number
+        # of copies + permissions of the user and of their groups
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('author_detail', args=[self.author.pk]))
+        self.assertEqual(response.status_code, 200)
+        books = list(response.context['author'].book_set.all())
+        self.assertEqual(len(books), 10)
+        self.assertEqual(books[0].copies_total, 4)
+        self.assertEqual(books[1].copies_total, 3)
+
+
+import csv
+import json
+from django.contrib.auth.models import Permission
+
+class ExportLoansViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.reader = User.objects.create_user(username='reader', password='2HJ1vRV0Z&3iD')
+        book = Book.objects.create(title='Loaned book', summary='Summary', isbn='1234567890123')
+        today = datetime.date.today()
+        for days in (-3, -1, 2, 10):
+            BookInstance.objects.create(
+                book=book, imprint='Imprint', status='o', borrower=cls.reader,
+                due_back=today + datetime.timedelta(days=days)
+            )
+        BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=cls.librarian,
+                                    due_back=today + datetime.timedelta(days=5))
+        BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+
+    def export(self, query=''):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('all_borrowed_export') + query)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_requires_permission(self):
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('all_borrowed_export'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_csv_export(self):
+        rows = list(csv.DictReader(self.export('?format=csv').splitlines()))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['title'], 'Loaned book')
+        self.assertEqual([row['overdue'] for row in rows], ['True', 'True', 'False', 'False', 'False'])
+
+    def test_ndjson_export_with_filters(self):
+        rows = [json.loads(line) for line in self.export('?format=ndjson&overdue=on').splitlines()]
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(all(row['overdue'] for row in rows))
+
+        rows = self.export('?format=ndjson&borrower=librarian').splitlines()
+        self.assertEqual(len(rows), 1)
+
+        today = datetime.date.today()
+        rows = self.export(f'?format=ndjson&due_after={today}&due_before={today + datetime.timedelta(days=5)}').splitlines()
+        self.assertEqual(len(rows), 2)
+
+    def test_invalid_filters(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('all_borrowed_export') + '?due_after=2025-02-01&due_before=2025-01-01')
+        self.assertEqual(response.status_code, 400)
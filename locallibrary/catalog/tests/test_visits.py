@@ -0,0 +1,89 @@
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from catalog import visits
+from catalog.models import VisitCount
+from catalog.stats import get_stats
+
+User = get_user_model()
+
+
+class VisitCounterTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(username='reader', password='1X<ISRUkw+tuK')
+
+    def setUp(self):
+        visits.buffer.take()
+        visits.get_cache().clear()
+
+    def test_anonymous_visits_dont_use_the_session(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 1)
+        self.assertIn(visits.VISITOR_COOKIE, response.cookies)
+        self.assertNotIn('sessionid', response.cookies)
+        get_stats()
+        # the stats and the visit total are cached: no query at all
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 2)
+        self.assertNotIn(visits.VISITOR_COOKIE, response.cookies)
+        self.assertFalse(Session.objects.exists())
+
+    def test_visitors_are_counted_separately(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        self.client.login(username='reader', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 1)
+        # a forged cookie is a new visitor
+        self.client.logout()
+        self.client.cookies[visits.VISITOR_COOKIE] = 'forged'
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 1)
+
+    @override_settings(CATALOG_VISITS_FLUSH_SIZE=2)
+    def test_visits_are_written_in_batches(self):
+        visits.record_visit('user:1')
+        self.assertFalse(VisitCount.objects.exists())
+        visits.record_visit('user:1')
+        self.assertFalse(VisitCount.objects.exists())
+        visits.record_visit('user:2')
+        self.assertEqual(dict(VisitCount.objects.values_list('visitor', 'count')), {'user:1': 2, 'user:2': 1})
+        # the stored counts are incremented
+        visits.record_visit('user:1')
+        visits.record_visit('user:3')
+        self.assertEqual(dict(VisitCount.objects.values_list('visitor', 'count')),
+                         {'user:1': 3, 'user:2': 1, 'user:3': 1})
+
+    def test_count_survives_the_cache(self):
+        VisitCount.objects.create(visitor='user:1', count=10)
+        self.assertEqual(visits.record_visit('user:1'), 11)
+        visits.get_cache().clear()
+        # stored count + the visit still buffered
+        self.assertEqual(visits.record_visit('user:1'), 12)
+        self.assertEqual(visits.flush(), 1)
+        self.assertEqual(VisitCount.objects.get(visitor='user:1').count, 12)
+        self.assertEqual(visits.flush(), 0)
+
+    @override_settings(CATALOG_VISITS_FLUSH_SECONDS=0)
+    def test_flush_after_delay(self):
+        visits.record_visit('user:1')
+        self.assertEqual(VisitCount.objects.get(visitor='user:1').count, 1)
+
+    @override_settings(CATALOG_VISITS_FLUSH_SIZE=1)
+    def test_cookieless_visits_share_a_row(self):
+        # e.g. a crawler, which never sends the cookie back
+        for _ in range(3):
+            response = self.client.get(reverse('index'))
+            self.assertEqual(response.context['num_visits'], 1)
+            del self.client.cookies[visits.VISITOR_COOKIE]
+        self.assertEqual(dict(VisitCount.objects.values_list('visitor', 'count')), {visits.FIRST_VISITS: 3})
+
+        # a browser keeping the cookie counts its next visits in its own row
+        self.client.get(reverse('index'))
+        visits.get_cache().clear()
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_visits'], 2)
+        self.assertEqual(VisitCount.objects.count(), 2)
@@ -1,23 +1,47 @@
+from django.conf import settings
 from django.urls import path, include
-from . import views 
+from . import api, views
+
+# the read-only pages have async versions for ASGI servers, see catalog/async_views.py
+if settings.CATALOG_ASYNC_VIEWS:
+    from . import async_views as pages
+else:
+    pages = views
 
 urlpatterns = [
-    path('', views.index, name='index'),
-    path('books/', views.BookListView.as_view(), name='books'), 
-    path('book/<int:pk>', views.BookDetailView.as_view(), name='book_detail'),
+    path('', pages.index, name='index'),
+    path('books/', pages.BookListView.as_view(), name='books'), 
+    path('search/', views.BookSearchView.as_view(), name='search'),
+    path('book/<int:pk>', pages.BookDetailView.as_view(), name='book_detail'),
     path('book/create', views.BookCreate.as_view(), name='book_create'),
     path('book/<int:pk>/update', views.BookUpdate.as_view(), name='book_update'),
     path('book/<int:pk>/delete', views.BookDelete.as_view(), name='book_delete'),
 
-    path('authors/', views.AuthorListView.as_view(), name='authors'), 
-    path('author/<int:pk>', views.AuthorDetailView.as_view(), name='author_detail'), 
+    path('authors/', pages.AuthorListView.as_view(), name='authors'), 
+    path('author/<int:pk>', pages.AuthorDetailView.as_view(), name='author_detail'), 
     path('author/create', views.AuthorCreate.as_view(), name='author_create'),
     path('author/<int:pk>/update', views.AuthorUpdate.as_view(), name='author_update'),
     path('author/<int:pk>/delete', views.AuthorDelete.as_view(), name='author_delete'),
 
     path('mybooks/', views.LoanedBooksByUserListView.as_view(), name='my_borrowed'),
     path('allborrowed/', views.LoanedBooksAllListView.as_view(), name='all_borrowed'), 
+    path('allborrowed/export/', views.export_loans, name='all_borrowed_export'),
+    path('allborrowed/bulk/', views.bulk_loans_librarian, name='bulk_loans'),
     path('book/<uuid:pk>/renew/', views.renew_book_librarian, name='renew_book_librarian'),
+    path('book/<int:pk>/checkout/', views.checkout_book_librarian, name='checkout_book_librarian'),
+    path('book/<int:pk>/reserve/', views.reserve_book, name='reserve_book'),
+    path('book/<uuid:pk>/return/', views.return_book_librarian, name='return_book_librarian'),
+
+    path('autocomplete/<slug:kind>/', views.autocomplete, name='autocomplete'),
+
+    # read-only JSON API, see catalog/api.py
+    path('api/', api.api_root, name='api'),
+    path('api/<slug:resource>/', api.api_list, name='api_list'),
+    path('api/<slug:resource>/<str:pk>/', api.api_detail, name='api_detail'),
+
+    path('circulation/', views.circulation_dashboard, name='circulation'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('metrics/panel/', views.metrics_panel, name='metrics_panel'),
 ]
 
 
@@ -1,89 +1,214 @@
 from django.shortcuts import render, get_object_or_404
-from .models import Book, Author, BookInstance, Genre
+from .models import Book, Author, BookInstance
 from django.views.generic import ListView, DetailView
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
-from django.http import HttpResponseRedirect  # Http404
+from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.core.exceptions import PermissionDenied
 from django.urls import reverse, reverse_lazy
-from catalog.forms import RenewBookForm
+from django.db.models import Max, Prefetch
+from catalog.forms import RenewBookForm, LoanExportForm, BulkLoanForm, CheckoutForm, BookForm, DEFAULT_RENEWAL_PERIOD
+from catalog import loans
+from catalog.stats import get_stats
+from catalog.pagination import CursorPaginationMixin
+from catalog.search import search_books
+from catalog import autocomplete as completion, circulation, fragments, instrumentation, recommendations, visits
+from catalog.conditional import ConditionalGetMixin, latest, select_aggregates
+from catalog.database import RetryOnLockMixin, retry_on_lock
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from django.contrib.auth.decorators import login_required, permission_required
+from django.contrib import messages
+from django.views.decorators.http import require_POST
+import csv
 import datetime
+import itertools
+import json
 
 # Create your views here.
+def index_context(stats, num_visits):
+    return {
+        'num_books': stats['num_books'],
+        'fantasy_books_count': stats['fantasy_books_count'],
+        'num_instances': stats['num_instances'], 
+        'num_instances_available': stats['num_instances_available'], 
+        'num_authors': stats['num_authors'],
+        'fantasy_books': stats['fantasy_books'], 
+        'num_genres': stats['num_genres'], 
+        'num_visits': num_visits,
+    }
+
 def index(request):
 
-    num_books = Book.objects.all().count()
-    num_instaces = BookInstance.objects.all().count()
+    # All the counters come from the statistics cache, see catalog/stats.py
+    stats = get_stats()
 
-    # Available books (status = 'a')
-    num_instaces_available = BookInstance.objects.filter(status__exact='a').count()
+    # counted without a session write, see catalog/visits.py
+    visitor, cookie = visits.visitor_id(request, request.user)
+    num_visits = visits.record_visit(visitor, first=cookie is not None)
 
-    # genre count
-    num_genres = Genre.objects.all().count()
+    response = render(request, 'index.html', context=index_context(stats, num_visits))
+    return visits.set_visitor_cookie(response, cookie)
 
-    # Filtering books by a specific genre
-    fantasy_books = Book.objects.filter(genre__name__icontains='fantasy')
-    fantasy_books_count = fantasy_books.count()
+class BookListView(ConditionalGetMixin, CursorPaginationMixin, ListView):
+    model = Book
+    context_object_name = 'book_list'
+    paginate_by = 3
+    cursor_ordering = ['title', 'id']
 
-    # The 'all()' is implied by default
-    num_authors = Author.objects.count()
+    def get_validators(self):
+        # the list shows titles and author names, the count catches deleted books
+        return select_aggregates(
+            (Book.objects.all(), 'MAX', 'updated_at'),
+            (Author.objects.all(), 'MAX', 'updated_at'),
+            (Book.objects.all(), 'COUNT', 'pk'),
+        )
 
-    num_visits = request.session.get('num_visits', 0)
-    num_visits += 1
-    request.session['num_visits'] = num_visits
+class BookSearchView(ListView):
+    """Full-text search over title, summary, ISBN, author and genres, best matches first"""
+    template_name = 'catalog/book_search.html'
+    context_object_name = 'book_list'
+    paginate_by = 10
 
-    context = {
-        'num_books': num_books,
-        'fantasy_books_count': fantasy_books_count,
-        'num_instances': num_instaces, 
-        'num_instances_available': num_instaces_available, 
-        'num_authors': num_authors,
-        'fantasy_books': fantasy_books, 
-        'num_genres': num_genres, 
-        'num_visits': num_visits,
-    }
+    def get_queryset(self):
+        return search_books(self.request.GET.get('q', ''))
 
-    print(type(fantasy_books))
-    return render(request, 'index.html', context=context)   
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.request.GET.get('q', '')
+        return context
 
-class BookListView(ListView):
+class BookDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     model = Book
-    context_object_name = 'book_list'
-    paginate_by = 3
 
-class BookDetailView(LoginRequiredMixin, DetailView):
-    model = Book
+    def get_validators(self):
+        if self.last_modified is None:
+            return None  # no such book
+        # the fragment versions change with the book, its author, copies, genres and languages
+        return fragments.fragment_key('book', self.kwargs['pk'])
+
+    def get_last_modified(self):
+        row = (
+            Book.objects.filter(pk=self.kwargs['pk'])
+            .annotate(copies_updated_at=Max('bookinstance__updated_at'))
+            .values_list('updated_at', 'author__updated_at', 'copies_updated_at')
+            .first()
+        )
+        return latest(*row) if row else None
 
-class BookCreate(PermissionRequiredMixin, CreateView):
+    def get_queryset(self):
+        # the content block is cached per book, see catalog/fragments.py
+        self.fragment_key, self.fragment = fragments.lookup('book', self.kwargs['pk'])
+        if self.fragment is not None:
+            return Book.objects.all()
+        # load everything the template needs up front, so the page costs the same
+        # number of queries whatever the number of genres and copies
+        return (
+            Book.objects.select_related('author', 'language')
+            .prefetch_related('genre', 'bookinstance_set', recommendations.prefetch())
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['fragment'] = self.fragment
+        context['fragment_key'] = self.fragment_key
+        return context
+
+class BookCreate(RetryOnLockMixin, PermissionRequiredMixin, CreateView):
     model = Book 
-    fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
+    form_class = BookForm
     permission_required = 'catalog.add_book'
 
-class BookUpdate(PermissionRequiredMixin, UpdateView):
+class BookUpdate(RetryOnLockMixin, PermissionRequiredMixin, UpdateView):
     model = Book 
-    fields = ['title', 'author', 'summary', 'isbn', 'genre', 'language']
+    form_class = BookForm
     permission_required = 'catalog.change_book'
 
+def autocomplete(request, kind):
+    """Prefix search for the autocomplete widgets: {"results": [{"id": .., "text": ..}]}"""
+    if kind not in completion.SEARCHES:
+        raise Http404('Unknown autocomplete')
+    term = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', completion.LIMIT)), completion.MAX_LIMIT)
+    except ValueError:
+        limit = completion.LIMIT
+    results = completion.SEARCHES[kind](term, limit) if term and limit > 0 else []
+    return JsonResponse({'results': [{'id': pk, 'text': text} for pk, text in results]})
 
-class LoanedBooksByUserListView(LoginRequiredMixin, ListView):
+
+class LoanedBooksByUserListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     model = BookInstance
     template_name = 'catalog/bookinstance_list_borrowed_user.html'
     paginate_by = 10
+    cursor_ordering = ['due_back', 'id']
 
     def get_queryset(self):
         return (
             BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
         )
     
-class LoanedBooksAllListView(PermissionRequiredMixin, ListView):
+class LoanedBooksAllListView(PermissionRequiredMixin, CursorPaginationMixin, ListView):
     model = BookInstance
     permission_required = 'catalog.can_mark_returned'
     template_name = 'catalog/bookinstance_list_borrowed_all.html'
     paginate_by = 10
+    cursor_ordering = ['due_back', 'id']
 
     def get_queryset(self):
         return BookInstance.objects.filter(status__exact='o').order_by('due_back')
 
+LOAN_EXPORT_FIELDS = ['id', 'book_id', 'title', 'imprint', 'status', 'due_back', 'borrower', 'overdue']
+LOAN_EXPORT_CHUNK_SIZE = 2000
+
+class Echo:
+    """File-like object whose write() returns the value, for csv.writer"""
+    def write(self, value):
+        return value
+
+def loan_export_rows(queryset):
+    today = datetime.date.today()
+    for copy in queryset.iterator(chunk_size=LOAN_EXPORT_CHUNK_SIZE):
+        yield {
+            'id': str(copy.id),
+            'book_id': copy.book_id,
+            'title': copy.book.title if copy.book else '',
+            'imprint': copy.imprint,
+            'status': copy.status,
+            'due_back': copy.due_back.isoformat() if copy.due_back else '',
+            'borrower': copy.borrower.username if copy.borrower else '',
+            'overdue': bool(copy.due_back and copy.due_back < today),
+        }
+
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def export_loans(request):
+    """Stream every copy on loan (optionally filtered) as CSV or NDJSON"""
+    form = LoanExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_json(), content_type='application/json')
+
+    queryset = form.filter(
+        BookInstance.objects.filter(status__exact='o')
+        .select_related('book', 'borrower')
+        .only('id', 'imprint', 'status', 'due_back', 'book', 'book__title', 'borrower', 'borrower__username')
+        .order_by('due_back', 'id')
+    )
+    rows = loan_export_rows(queryset)
+
+    if form.cleaned_data['format'] == 'ndjson':
+        content = (json.dumps(row) + '\n' for row in rows)
+        response = StreamingHttpResponse(content, content_type='application/x-ndjson')
+        extension = 'ndjson'
+    else:
+        writer = csv.DictWriter(Echo(), fieldnames=LOAN_EXPORT_FIELDS)
+        header = writer.writerow(dict(zip(LOAN_EXPORT_FIELDS, LOAN_EXPORT_FIELDS)))
+        content = itertools.chain([header], (writer.writerow(row) for row in rows))
+        response = StreamingHttpResponse(content, content_type='text/csv')
+        extension = 'csv'
+    response['Content-Disposition'] = f'attachment; filename="loans-{datetime.date.today()}.{extension}"'
+    return response
+
 @login_required
 @permission_required('catalog.can_mark_returned', raise_exception=True)
 def renew_book_librarian(request, pk):
@@ -98,13 +223,12 @@ def renew_book_librarian(request, pk):
         form = RenewBookForm(request.POST)
         if form.is_valid():
             # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
-            book_instance.due_back = form.cleaned_data['due_back']
-            book_instance.save()
+            loans.renew_copy(book_instance, form.cleaned_data['renewal_date'])
             return HttpResponseRedirect(reverse('all_borrowed'))
     # if this is a GET (or any other method) create the default form
     else:
-        proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
-        form = RenewBookForm(initial={'due_back': proposed_renewal_date})
+        proposed_renewal_date = datetime.date.today() + DEFAULT_RENEWAL_PERIOD
+        form = RenewBookForm(initial={'renewal_date': proposed_renewal_date})
     
     context = {
         'form': form, 
@@ -113,21 +237,177 @@ def renew_book_librarian(request, pk):
     
     return render(request, 'catalog/book_renew_librarian.html', context)
 
-class AuthorListView(ListView):
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def bulk_loans_librarian(request):
+    """Renew or mark returned many copies on loan at once"""
+    if request.method != 'POST':
+        return HttpResponseRedirect(reverse('all_borrowed'))
+
+    form = BulkLoanForm(request.POST)
+    results = []
+    if form.is_valid():
+        copy_ids = form.cleaned_data['copies']
+        if form.cleaned_data['action'] == 'renew':
+            outcome = loans.bulk_renew(copy_ids, form.cleaned_data['renewal_date'])
+        else:
+            outcome = loans.bulk_return(copy_ids)
+        titles = dict(BookInstance.objects.filter(pk__in=copy_ids).values_list('pk', 'book__title'))
+        results = [
+            {'id': pk, 'title': titles.get(pk, ''), 'result': result} for pk, result in outcome.items()
+        ]
+
+    context = {
+        'form': form,
+        'results': results,
+    }
+    return render(request, 'catalog/bookinstance_bulk_result.html', context)
+
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def checkout_book_librarian(request, pk):
+    """Lend any available copy of a book (or the one reserved by the borrower)"""
+    book = get_object_or_404(Book, pk=pk)
+    if request.method == 'POST':
+        form = CheckoutForm(request.POST)
+        if form.is_valid():
+            try:
+                copy = loans.checkout(book, form.cleaned_data['borrower'], form.cleaned_data['due_back'])
+            except loans.LoanError as e:
+                form.add_error(None, str(e))
+            else:
+                messages.success(request, f'Copy {copy.id} lent to {copy.borrower}')
+                return HttpResponseRedirect(book.get_absolute_url())
+    else:
+        form = CheckoutForm(initial={'due_back': datetime.date.today() + DEFAULT_RENEWAL_PERIOD})
+
+    context = {
+        'form': form, 
+        'book': book
+    }
+    return render(request, 'catalog/book_checkout_librarian.html', context)
+
+@login_required
+@require_POST
+def reserve_book(request, pk):
+    """Reserve a copy of a book for the current user"""
+    book = get_object_or_404(Book, pk=pk)
+    try:
+        loans.reserve(book, request.user)
+    except loans.LoanError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, f'A copy of {book} is reserved for you')
+    return HttpResponseRedirect(book.get_absolute_url())
+
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+@require_POST
+def return_book_librarian(request, pk):
+    """Mark a copy on loan (or reserved) as available"""
+    copy = get_object_or_404(BookInstance, pk=pk)
+    try:
+        loans.return_copy(copy.pk)
+    except loans.LoanError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, f'Copy {copy.id} returned')
+    return HttpResponseRedirect(reverse('all_borrowed'))
+
+def can_read_metrics(request):
+    """Staff users, or a scraper sending settings.CATALOG_METRICS_TOKEN as a bearer token"""
+    if request.user.is_staff:
+        return True
+    # not the client address: behind a reverse proxy every request comes from it
+    token = getattr(settings, 'CATALOG_METRICS_TOKEN', None)
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and constant_time_compare(credentials.strip(), token)
+
+def metrics(request):
+    """Request metrics of the catalog views in the Prometheus text format"""
+    if not can_read_metrics(request):
+        raise PermissionDenied
+    return HttpResponse(instrumentation.prometheus_text(), content_type='text/plain; version=0.0.4')
+
+def metrics_panel(request):
+    """Request metrics of the catalog views, for humans"""
+    if not can_read_metrics(request):
+        raise PermissionDenied
+    summary = instrumentation.registry.summary()
+    rows = [
+        {'view': view, 'count': values['count'], 'metrics': [values[name] for name, _ in instrumentation.METRICS]}
+        for view, values in sorted(summary.items())
+    ]
+    caches = [
+        {'name': name, 'ratio': values['hits'] / ((values['hits'] + values['misses']) or 1), **values}
+        for name, values in sorted(instrumentation.cache_counters().items())
+    ]
+    context = {
+        'caches': caches,
+        'enabled': settings.CATALOG_INSTRUMENTATION,
+        'columns': [name for name, _ in instrumentation.METRICS],
+        'rows': rows,
+    }
+    return render(request, 'catalog/metrics_panel.html', context)
+
+def circulation_dashboard(request):
+    """Checkouts, renewals and returns of the last days, read from the daily rollups"""
+    if not request.user.is_staff:
+        raise PermissionDenied
+    return render(request, 'catalog/circulation_dashboard.html', circulation.dashboard())
+
+class AuthorListView(CursorPaginationMixin, ListView):
     model = Author 
     context_object_name = 'author_list'
     paginate_by = 5
+    cursor_ordering = ['last_name', 'first_name', 'id']
 
-class AuthorDetailView(DetailView):
+def author_books_prefetch():
+    """Prefetch the books of an author, the number of copies is a field of Book"""
+    return Prefetch('book_set', queryset=Book.objects.order_by('title', 'id'))
+
+class AuthorDetailView(ConditionalGetMixin, DetailView):
     model = Author
 
-class AuthorCreate(PermissionRequiredMixin, CreateView):
+    def get_validators(self):
+        if self.last_modified is None:
+            return None
+        return fragments.fragment_key('author', self.kwargs['pk'])
+
+    def get_last_modified(self):
+        row = (
+            Author.objects.filter(pk=self.kwargs['pk'])
+            .annotate(
+                books_updated_at=Max('book__updated_at'),
+                copies_updated_at=Max('book__bookinstance__updated_at'),
+            )
+            .values_list('updated_at', 'books_updated_at', 'copies_updated_at')
+            .first()
+        )
+        return latest(*row) if row else None
+
+    def get_queryset(self):
+        self.fragment_key, self.fragment = fragments.lookup('author', self.kwargs['pk'])
+        if self.fragment is not None:
+            return Author.objects.all()
+        return Author.objects.prefetch_related(author_books_prefetch())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['fragment'] = self.fragment
+        context['fragment_key'] = self.fragment_key
+        # only for the delete link, no query for the others
+        if self.request.user.has_perm('catalog.delete_author'):
+            context['has_books'] = self.object.book_set.exists()
+        return context
+
+class AuthorCreate(RetryOnLockMixin, PermissionRequiredMixin, CreateView):
     model = Author
     fields = ['first_name', 'last_name', 'date_of_birth', 'date_of_death']
     initial = {'date_of_birth': datetime.date.today()}
     permission_required = 'catalog.add_author'
 
-class AuthorUpdate(PermissionRequiredMixin, UpdateView):
+class AuthorUpdate(RetryOnLockMixin, PermissionRequiredMixin, UpdateView):
     model = Author
     fields = ['first_name', 'last_name', 'date_of_birth', 'date_of_death']
     permission_required = 'catalog.change_author'
@@ -137,9 +417,12 @@ class AuthorDelete(PermissionRequiredMixin, DeleteView):
     success_url = reverse_lazy('authors')
     permission_required = 'catalog.delete_author'
 
+    def get_queryset(self):
+        return Author.objects.prefetch_related(author_books_prefetch())
+
     def form_valid(self, form):
         try:
-            self.object.delete()
+            retry_on_lock(self.object.delete)()
             return HttpResponseRedirect(self.success_url)
         except Exception as e:
             reverse('author_delete', kwargs={'pk':self.object.pk})
@@ -151,7 +434,7 @@ class BookDelete(PermissionRequiredMixin, DeleteView):
 
     def form_valid(self, form):
         try:
-            self.object.delete()
+            retry_on_lock(self.object.delete)()
             return HttpResponseRedirect(self.success_url)
         except Exception as e:
             reverse('book_delete', kwargs={'pk':self.object.pk})
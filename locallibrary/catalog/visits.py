@@ -0,0 +1,192 @@
+"""Visit counter of the home page, without a session write per page view.
+
+A visitor is a logged in user, or an anonymous browser identified by a signed
+cookie (VISITOR_COOKIE), so anonymous browsing never creates a session. The
+first visit of a browser, before it has the cookie, is counted in the single
+FIRST_VISITS row: clients that never send the cookie back (e.g. crawlers)
+don't add a row per request.
+
+Each visit increments the visitor's total in the cache (settings.CATALOG_VISITS_CACHE),
+which is the count shown on the page, and adds one to an in-memory buffer of
+the process. The buffer is written to VisitCount in one batch every
+CATALOG_VISITS_FLUSH_SECONDS or CATALOG_VISITS_FLUSH_SIZE visitors, by the
+request that fills it. A cached total that is missing is loaded from the
+database plus what the process still buffers.
+
+The count is approximate when several processes serve the site:
+- each process buffers its own visits, the database lags by up to
+  CATALOG_VISITS_FLUSH_SECONDS per process;
+- with the local-memory cache each process also keeps its own totals, loaded
+  from the database when missing, so a visitor served by several processes
+  sees numbers that miss the visits of the others until their cached totals
+  expire (a shared cache keeps a single total);
+- visits buffered by a process that stops before its next flush, including a
+  restart, are lost. There is no flush at exit: the process may no longer have
+  its database, e.g. the test runner has dropped the test database by then.
+"""
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import VisitCount
+
+VISITOR_COOKIE = 'catalog_visitor'
+VISITOR_COOKIE_SALT = 'catalog.visits'
+VISITOR_COOKIE_AGE = 365 * 24 * 3600
+# the first visits of every anonymous browser
+FIRST_VISITS = 'anonymous:first'
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_VISITS_CACHE', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOG_VISITS_TIMEOUT', 24 * 3600)
+
+
+def cache_key(visitor):
+    return f'catalog:visits:{visitor}'
+
+
+class VisitBuffer:
+    """Visits not written to the database yet, per visitor"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.since = time.monotonic()
+
+    def add(self, visitor):
+        """Buffer a visit, True when the buffer is due for a flush"""
+        with self.lock:
+            if not self.pending:
+                self.since = time.monotonic()
+            self.pending[visitor] += 1
+            return (
+                len(self.pending) >= getattr(settings, 'CATALOG_VISITS_FLUSH_SIZE', 500)
+                or time.monotonic() - self.since >= getattr(settings, 'CATALOG_VISITS_FLUSH_SECONDS', 10)
+            )
+
+    def get(self, visitor):
+        with self.lock:
+            return self.pending[visitor]
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            return pending
+
+    def restore(self, pending):
+        with self.lock:
+            self.pending.update(pending)
+
+
+buffer = VisitBuffer()
+
+
+def save_visits(pending):
+    """Add {visitor: visits} to the stored counts"""
+    now = timezone.now()
+    # visitors with the same number of new visits share an UPDATE
+    visitors = defaultdict(list)
+    for visitor, visits in pending.items():
+        visitors[visits].append(visitor)
+    with transaction.atomic():
+        VisitCount.objects.bulk_create(
+            [VisitCount(visitor=visitor, count=0) for visitor in pending], ignore_conflicts=True
+        )
+        for visits, group in visitors.items():
+            VisitCount.objects.filter(visitor__in=group).update(count=F('count') + visits, updated_at=now)
+
+
+def flush():
+    """Write the buffered visits, return the number of visitors written"""
+    pending = buffer.take()
+    if not pending:
+        return 0
+    try:
+        save_visits(pending)
+    except DatabaseError:
+        # e.g. a locked SQLite file: keep the visits for the next flush
+        buffer.restore(pending)
+        return 0
+    return len(pending)
+
+
+def stored_count(visitor):
+    count = VisitCount.objects.filter(visitor=visitor).values_list('count', flat=True).first()
+    # plus the first visit of an anonymous browser, counted in FIRST_VISITS
+    first = 1 if visitor.startswith('anonymous:') else 0
+    return (count or 0) + buffer.get(visitor) + first
+
+
+def record_visit(visitor, first=False):
+    """Count a visit of ``visitor``, the first one of a new cookie if ``first``, return its number of visits"""
+    cache = get_cache()
+    key = cache_key(visitor)
+    if first:
+        cache.set(key, 1, get_timeout())
+        if buffer.add(FIRST_VISITS):
+            flush()
+        return 1
+    if cache.get(key) is None:
+        cache.add(key, stored_count(visitor), get_timeout())
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # evicted in the meantime
+        count = stored_count(visitor) + 1
+        cache.set(key, count, get_timeout())
+    if buffer.add(visitor):
+        flush()
+    return count
+
+
+async def arecord_visit(visitor, first=False):
+    """record_visit() for the async views"""
+    cache = get_cache()
+    key = cache_key(visitor)
+    if first:
+        await cache.aset(key, 1, get_timeout())
+        if buffer.add(FIRST_VISITS):
+            await sync_to_async(flush)()
+        return 1
+    if await cache.aget(key) is None:
+        await cache.aadd(key, await sync_to_async(stored_count)(visitor), get_timeout())
+    try:
+        count = await cache.aincr(key)
+    except ValueError:
+        count = await sync_to_async(stored_count)(visitor) + 1
+        await cache.aset(key, count, get_timeout())
+    if buffer.add(visitor):
+        await sync_to_async(flush)()
+    return count
+
+
+def visitor_id(request, user):
+    """(visitor id, new cookie value or None) of the request"""
+    if user.is_authenticated:
+        return f'user:{user.pk}', None
+    cookie = request.get_signed_cookie(VISITOR_COOKIE, default=None, salt=VISITOR_COOKIE_SALT)
+    if cookie:
+        return f'anonymous:{cookie}', None
+    cookie = uuid.uuid4().hex
+    return f'anonymous:{cookie}', cookie
+
+
+def set_visitor_cookie(response, cookie):
+    if cookie:
+        response.set_signed_cookie(
+            VISITOR_COOKIE, cookie, salt=VISITOR_COOKIE_SALT, max_age=VISITOR_COOKIE_AGE, httponly=True,
+            samesite='Lax',
+        )
+    return response
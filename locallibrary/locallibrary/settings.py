@@ -42,6 +42,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # per view query/timing metrics, only active with CATALOG_INSTRUMENTATION
+    'catalog.instrumentation.QueryTimingMiddleware',
+    # read-your-writes with the read replicas, see CATALOG_READ_REPLICAS
+    'catalog.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,12 +80,98 @@ WSGI_APPLICATION = 'locallibrary.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuned for concurrent readers and writers, run on every new connection:
+# - WAL: readers don't block the writer and the writer doesn't block readers
+# - synchronous=NORMAL: with WAL, a commit only waits for the disk at checkpoints
+# - reads served from a 256 MB memory map and a 64 MB page cache per connection
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # in KiB when negative
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            # take the write lock when the transaction starts: a deferred transaction
+            # that reads and then writes fails at once if another one wrote meanwhile
+            'transaction_mode': 'IMMEDIATE',
+            # seconds to wait for the write lock before "database is locked"
+            'timeout': 5,
+        },
+        # keep the connections (and their page cache) between requests
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
+# Writes that still find the database locked are retried (catalog/database.py),
+# this many times, starting after this many seconds and doubling each time
+CATALOG_WRITE_RETRIES = 5
+CATALOG_WRITE_RETRY_DELAY = 0.05
+
+# Read replicas of the primary ('default') serving the catalog reads, see
+# catalog/routers.py. Each one is a DATABASES entry too, e.g.
+#   'replica1': {'ENGINE': ..., 'NAME': ..., 'TEST': {'MIRROR': 'default'}}
+CATALOG_READ_REPLICAS = []
+# 'round-robin' or 'least-latency' (average query time measured per replica)
+CATALOG_REPLICA_SELECTION = 'round-robin'
+# after a write, the client reads from the primary for this long (replication lag)
+CATALOG_REPLICA_PIN_SECONDS = 5
+DATABASE_ROUTERS = ['catalog.routers.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'locallibrary',
+    },
+    # file based cache, shared between processes:
+    # 'default': {
+    #     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    #     'LOCATION': BASE_DIR / 'cache',
+    # },
+    # database cache (run `python manage.py createcachetable` first):
+    # 'default': {
+    #     'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+    #     'LOCATION': 'catalog_cache',
+    # },
+}
+
+# Cache alias used for the home page statistics (catalog/stats.py)
+CATALOG_STATS_CACHE = 'default'
+# a catalog change drops the statistics only in the cache of the process that
+# made it, the timeout bounds how long the other processes show the old ones
+# with the local-memory cache (None keeps them, only with a shared cache)
+CATALOG_STATS_TIMEOUT = 300
+# Cache alias and timeout of the book and author page fragments (catalog/fragments.py).
+# With the local-memory cache the other processes only see a change when their
+# fragment expires, raise the timeout with a shared cache only. The genre and
+# language tables of catalog/reference.py are only kept in memory with a shared cache.
+CATALOG_FRAGMENT_CACHE = 'default'
+CATALOG_FRAGMENT_TIMEOUT = 300
+# Home page visit counter (catalog/visits.py): cache alias and timeout of the
+# totals, and how often the buffered visits are written to the database. The
+# count is approximate with several processes, see the module.
+CATALOG_VISITS_CACHE = 'default'
+CATALOG_VISITS_TIMEOUT = 24 * 3600
+CATALOG_VISITS_FLUSH_SECONDS = 10
+CATALOG_VISITS_FLUSH_SIZE = 500
+# Cache alias and timeout of the permission sets of the users (catalog/permissions.py).
+# Only a cache shared by every process is used (e.g. the file or database cache
+# above): with the local-memory cache the permissions are loaded on each request.
+CATALOG_PERMISSIONS_CACHE = 'default'
+CATALOG_PERMISSIONS_TIMEOUT = 3600
+
+# ModelBackend with the permissions of each user cached between requests
+AUTHENTICATION_BACKENDS = ['catalog.permissions.CachedModelBackend']
 
 
 # Password validation
@@ -137,6 +227,22 @@ SCHEMA_VIEWER = {
     },
 }
 
+# Use keyset (cursor) pagination instead of page numbers in the catalog list views
+CATALOG_CURSOR_PAGINATION = False
+
+# Serve the home page and the book/author lists and details with the async views
+# of catalog/async_views.py (for ASGI servers, see locallibrary/asgi.py)
+CATALOG_ASYNC_VIEWS = False
+
+# Record query count, SQL/template time and response size of the catalog views
+# (catalog/instrumentation.py), exposed at /catalog/metrics/
+CATALOG_INSTRUMENTATION = False
+# requests kept per view to compute the percentiles
+CATALOG_INSTRUMENTATION_SAMPLES = 1000
+# bearer token allowing a scraper (e.g. Prometheus) to read the metrics without
+# logging in, None for staff users only
+CATALOG_METRICS_TOKEN = None
+
 LOGIN_REDIRECT_URL = '/catalog/'
 LOGIN_URL = '/accounts/login/'
 